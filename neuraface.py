@@ -1,4 +1,28 @@
 import sys
+import os
+import time
+import csv
+import json
+import asyncio
+import random
+import urllib.request
+import http.server
+import queue
+import struct
+import hashlib
+import gc
+import signal
+import tracemalloc
+import argparse
+import calendar
+import multiprocessing
+import platform
+import importlib.metadata
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, date, timedelta
+from pathlib import Path
 import cv2
 import sqlite3
 import numpy as np
@@ -6,140 +30,3333 @@ from deepface import DeepFace
 from PySide6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QLabel, QPushButton,
     QVBoxLayout, QHBoxLayout, QSpacerItem, QGraphicsDropShadowEffect, QLineEdit, QMessageBox,
-    QTableWidget, QTableWidgetItem, QDateEdit, QComboBox,
+    QTableView, QDateEdit, QComboBox, QFileDialog,
 )
-from PySide6.QtCore import Qt, QTimer, QDate
-from PySide6.QtGui import QPixmap, QFont, QImage, QColor, Qt
+from PySide6.QtCore import Qt, QTimer, QDate, QAbstractTableModel, QModelIndex, QThread, Signal
+from PySide6.QtGui import QPixmap, QFont, QImage, QColor, Qt, QShortcut, QKeySequence
 
 DB = "database.db"
 THRESHOLD = 4.0
 
+
+def deepface_version():
+    try:
+        return importlib.metadata.version("deepface")
+    except importlib.metadata.PackageNotFoundError:
+        return "unknown"
+
+# Cascade: a small model answers the easy cases, ArcFace only the ambiguous ones.
+# Off until the three thresholds are calibrated with cascade-eval on this
+# site's faces; reembed and cascade-eval fill in missing SFace embeddings.
+CASCADE_ENABLED = False
+FAST_MODEL = "SFace"
+FAST_THRESHOLD = 9.0
+FAST_REJECT = 14.0
+CASCADE_MARGIN = 3.0
+
+# Room this kiosk is installed in; None matches timetable slots in any room.
+KIOSK_ROOM = None
+ROSTER_CHECK_MS = 30000
+
+# In-memory ArcFace gallery format: "float32", "float16" or "int8" (per-row scale).
+# Quantized galleries shortlist QUANT_RERANK_K candidates, which are re-ranked
+# against the float32 embeddings kept in the students table.
+EMBEDDING_STORAGE = "float32"
+QUANT_RERANK_K = 8
+QUANT_CHUNK = 4096
+
+# All-pairs gallery analysis works on GALLERY_BLOCK x GALLERY_BLOCK tiles of the
+# distance matrix. Registering a face closer than DUPLICATE_THRESHOLD to another
+# student is refused, since kiosks could not tell the two apart.
+GALLERY_BLOCK = 2048
+DUPLICATE_THRESHOLD = THRESHOLD
+
+# Exact float32 galleries of SHARD_MIN_ROWS or more are split into SEARCH_SHARDS
+# contiguous shards searched in parallel, SHARD_CHUNK rows at a time.
+SEARCH_SHARDS = os.cpu_count() or 1
+SHARD_MIN_ROWS = 50000
+SHARD_CHUNK = 8192
+
+# The home screen's "here today" panel checks for changes every
+# DASHBOARD_POLL_MS and reads only the change_log entries since its last look
+# (with sync off there is no log, and it re-reads today's present students);
+# it re-queries everything after midnight, after more than DASHBOARD_MAX_DELTA
+# changes, or when the daily summary disagrees with what it holds.
+DASHBOARD_POLL_MS = 2000
+DASHBOARD_MAX_DELTA = 500
+
+# Rows pulled from the cursor each time the attendance table scrolls near its end.
+SQL_PAGE_SIZE = 500
+
+# Ad hoc queries run their first page on a worker thread, which checks for
+# Cancel every SQL_PROGRESS_STEPS virtual machine steps.
+SQL_PROGRESS_STEPS = 1000
+
+# Exports stream EXPORT_CHUNK rows (or matrix students) at a time, so memory
+# does not grow with the date range. Parquet/Arrow output needs pyarrow.
+EXPORT_CHUNK = 2000
+
+# Attendance from before the current term (or month, with ARCHIVE_PERIOD =
+# "month") is moved into one SQLite file per period under ARCHIVE_DIR, which
+# reports ATTACH only when their date range reaches back that far. Terms start
+# on the first of each TERM_START_MONTHS month. None keeps everything hot.
+ARCHIVE_DIR = "archive"
+ARCHIVE_PERIOD = "term"
+TERM_START_MONTHS = (1, 5, 9)
+
+# Face crops live in student_images, away from the embeddings the gallery reads.
+# Thumbnails are always kept; originals (PNG) only when KEEP_ORIGINAL_IMAGES.
+THUMB_FORMAT = ".webp"
+THUMB_SIZE = 160
+THUMB_QUALITY = 80
+KEEP_ORIGINAL_IMAGES = True
+
+# Embeddings of near-identical crops (stationary camera, repeated captures)
+# are reused for EMBED_CACHE_TTL seconds instead of re-running the model.
+EMBED_CACHE_SIZE = 256
+EMBED_CACHE_TTL = 2.0
+
+# Sequential decision: each frame adds (threshold - dist) / threshold of evidence
+# to a tracked face; it is committed once the evidence crosses either bound.
+# An Unknown decision is held for SEQ_UNKNOWN_HOLD frames and then reopened,
+# so a student who turned away at first can still be recognised.
+SEQ_ACCEPT = 0.8
+SEQ_REJECT = -0.8
+SEQ_MAX_FRAMES = 20
+SEQ_UNKNOWN_HOLD = 15
+TRACK_IOU = 0.3
+TRACK_MAX_MISSES = 5
+PENDING = "Pending"
+
+# Frames larger than DETECT_TILE in either direction (4K classroom cameras) are
+# cut into overlapping tiles and detected on a pool of DETECT_WORKERS processes.
+# The overlap must exceed the largest expected face so every face is whole in
+# some tile; boxes cut by an inner tile edge are dropped and the rest merged by NMS.
+DETECT_TILE = 1280
+DETECT_TILE_OVERLAP = 0.2
+DETECT_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+NMS_IOU = 0.4
+
+# Cameras are opened once by a shared service and kept warm between windows.
+# An unplugged camera is retried every CAMERA_RETRY_S; one nobody has watched
+# for CAMERA_IDLE_S is released.
+CAMERA_RETRY_S = 2.0
+CAMERA_MAX_FAILURES = 30
+CAMERA_OPEN_TIMEOUT = 3.0
+CAMERA_IDLE_S = 600
+
+# Offline-first sync: every local change is appended to change_log and pushed
+# to the central store in batches of SYNC_BATCH, then dropped from the log;
+# other kiosks' changes are pulled back. SYNC_CENTRAL is the central store (a
+# SQLite file stands in for it); None disables background sync and the log.
+SYNC_CENTRAL = None
+KIOSK_ID = platform.node() or "kiosk"
+SYNC_BATCH = 500
+SYNC_INTERVAL_S = 60
+
+# Attendance marks are also published to OUTBOX_SINK (None = off): an http(s)
+# URL that takes a JSON batch by POST, or a file to append JSON lines to. Marks
+# are queued in attendance_outbox in the same transaction as the attendance row
+# and delivered at least once; receivers dedupe on each event's "key".
+OUTBOX_SINK = None
+OUTBOX_BATCH = 100
+OUTBOX_INTERVAL_S = 5
+OUTBOX_BACKOFF_S = 2
+OUTBOX_BACKOFF_MAX_S = 600
+OUTBOX_TIMEOUT_S = 10
+OUTBOX_RETENTION_DAYS = 30
+
+# Every detection/match is journaled: recognize_frame only appends a tuple to
+# a ring buffer of JOURNAL_CAPACITY events, and a background thread writes
+# them to JOURNAL_PATH every JOURNAL_FLUSH_S. None disables the journal.
+JOURNAL_PATH = "journal.db"
+JOURNAL_CAPACITY = 65536
+JOURNAL_FLUSH_S = 1.0
+JOURNAL_RETENTION_DAYS = 30
+
+# Set RECORD_DIR to save every scan session (frames + timestamps) for replay
+# with `python neuraface.py replay`. ".png" records losslessly.
+RECORD_DIR = None
+RECORD_CODEC = ".jpg"
+RECORD_QUALITY = 95
+
+# Memory monitor: RSS is sampled every MEMORY_CHECK_S into a trend window.
+# Above MEMORY_BUDGET_MB (None = no budget) an alert is printed, and with
+# MEMORY_RESTART the scan window rebuilds its inference state to release
+# memory. SIGUSR1 (or `replay --memory`) takes a tracemalloc snapshot broken
+# down by pipeline stage; MEMORY_TRACE_DEPTH frames are kept per allocation.
+MEMORY_BUDGET_MB = None
+MEMORY_CHECK_S = 30
+MEMORY_TREND_SAMPLES = 240
+MEMORY_RESTART = False
+MEMORY_TRACE_DEPTH = 25
+
+# On-demand sampling profiler: SIGUSR2 or Ctrl+Shift+P samples every thread's
+# stack each PROFILE_INTERVAL_S for PROFILE_SECONDS and writes a collapsed-stack
+# file (flamegraph.pl / speedscope) to PROFILE_DIR, rooted at the pipeline stage.
+PROFILE_DIR = "profiles"
+PROFILE_SECONDS = 30
+PROFILE_INTERVAL_S = 0.01
+
+# Everything that changes what an embedding means. Bump the trailing revision
+# when the crop or preprocessing changes; `reembed` migrates stored faces.
+EMBEDDING_VERSION = f"ArcFace+{FAST_MODEL}/deepface-{deepface_version()}/opencv-crop/r1"
+REEMBED_BATCH = 50
+
 def extract_face(frame):
     try:
         det = DeepFace.extract_faces(frame, detector_backend="opencv")[0]
         region = det["facial_area"]
 
-        x, y, w, h = region["x"], region["y"], region["w"], region["h"]
-        crop = frame[y:y + h, x:x + w]
+        x, y, w, h = region["x"], region["y"], region["w"], region["h"]
+        crop = frame[y:y + h, x:x + w]
+
+        return crop
+    except:
+        return None
+
+
+def detect_boxes(frame):
+    detections = DeepFace.extract_faces(
+        frame,
+        detector_backend="opencv",
+        enforce_detection=False
+    )
+
+    boxes = []
+    for det in detections:
+        region = det["facial_area"]
+        if region["w"] >= frame.shape[1] and region["h"] >= frame.shape[0]:
+            continue  # enforce_detection=False returns the whole frame when nothing is found
+        boxes.append((region["x"], region["y"], region["w"], region["h"], det.get("confidence") or 0.0))
+    return boxes
+
+
+def tile_starts(length, tile, overlap):
+    if length <= tile:
+        return [0]
+    stride = max(1, int(tile * (1 - overlap)))
+    starts = list(range(0, length - tile, stride))
+    return starts + [length - tile]
+
+
+def detect_worker_init():
+    # Same contract as bulk_worker_init: never raise from a Pool initializer.
+    try:
+        DeepFace.extract_faces(np.zeros((64, 64, 3), np.uint8), detector_backend="opencv",
+                               enforce_detection=False)
+    except Exception as e:
+        print(f"Detector warm-up failed: {e}")
+
+
+def detect_tile(task):
+    x0, y0, tile = task
+    try:
+        boxes = detect_boxes(tile)
+    except Exception:
+        return []
+    return [(x + x0, y + y0, w, h, conf) for x, y, w, h, conf in boxes]
+
+
+def nms_boxes(boxes, iou=NMS_IOU):
+    # Highest confidence first; a box is dropped when it overlaps a kept one by
+    # more than `iou`, or sits almost entirely inside it (a partial face).
+    kept = []
+    for box in sorted(boxes, key=lambda b: (b[4], b[2] * b[3]), reverse=True):
+        x, y, w, h = box[:4]
+        duplicate = False
+        for kx, ky, kw, kh, _ in kept:
+            iw = max(0, min(x + w, kx + kw) - max(x, kx))
+            ih = max(0, min(y + h, ky + kh) - max(y, ky))
+            if box_iou((x, y, w, h), (kx, ky, kw, kh)) > iou or iw * ih > 0.8 * min(w * h, kw * kh):
+                duplicate = True
+                break
+        if not duplicate:
+            kept.append(box)
+    return kept
+
+
+class TiledDetector:
+    def __init__(self, tile=DETECT_TILE, overlap=DETECT_TILE_OVERLAP, workers=DETECT_WORKERS, wait=False):
+        self.tile = tile
+        self.overlap = overlap
+        self.workers = workers
+        # Live scans detect whole frames while the pool warms up; headless
+        # runs set `wait` so every frame is tiled and results repeat.
+        self.wait = wait
+        self.pool = None
+        self.warming = None
+
+    def start(self):
+        # Only on the first frame larger than a tile: a webcam kiosk never pays
+        # for workers that each load the detector. Processes rather than
+        # threads: DeepFace shares one cached OpenCV cascade, and
+        # CascadeClassifier is not safe to call concurrently.
+        ctx = multiprocessing.get_context("spawn")
+        self.pool = ctx.Pool(self.workers, initializer=detect_worker_init)
+        self.warming = self.pool.map_async(abs, range(self.workers))
+
+    def tiles(self, frame):
+        height, width = frame.shape[:2]
+        for y0 in tile_starts(height, self.tile, self.overlap):
+            for x0 in tile_starts(width, self.tile, self.overlap):
+                yield x0, y0, frame[y0:y0 + self.tile, x0:x0 + self.tile]
+
+    def detect(self, frame):
+        height, width = frame.shape[:2]
+        if self.tile is None or (width <= self.tile and height <= self.tile):
+            return [box[:4] for box in detect_boxes(frame)]
+
+        if self.pool is None:
+            self.start()
+        if not self.wait and not self.warming.ready():
+            return [box[:4] for box in detect_boxes(frame)]
+
+        tiles = list(self.tiles(frame))
+        boxes = []
+        for (x0, y0, tile), found in zip(tiles, self.pool.map(detect_tile, tiles)):
+            th, tw = tile.shape[:2]
+            for x, y, w, h, conf in found:
+                # A box touching an inner tile edge is probably a cut face;
+                # the overlapping neighbour tile holds all of it.
+                if ((x0 > 0 and x - x0 <= 1) or (y0 > 0 and y - y0 <= 1)
+                        or (x0 + tw < width and x + w >= x0 + tw - 1)
+                        or (y0 + th < height and y + h >= y0 + th - 1)):
+                    continue
+                boxes.append((x, y, w, h, conf))
+
+        return [box[:4] for box in nms_boxes(boxes)]
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+
+def crop_hash(face):
+    # 64-bit difference hash of the crop resized to 9x8: robust to sensor
+    # noise and small shifts, different as soon as the face itself changes.
+    # The dead-band keeps flat regions from flipping bits on noise alone.
+    gray = cv2.cvtColor(face, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA).astype(np.int16)
+    return np.packbits(small[:, 1:] - small[:, :-1] > 3).tobytes()
+
+
+class PipelineClock:
+    # Live scans read the system clock. A replay pins it to each recorded
+    # frame's timestamp, so cache expiry and decision times repeat exactly.
+    def __init__(self):
+        self.pinned = None
+
+    def now(self):
+        return time.monotonic() if self.pinned is None else self.pinned
+
+    def pin(self, t):
+        self.pinned = t
+
+    def unpin(self):
+        self.pinned = None
+
+
+pipeline_clock = PipelineClock()
+
+
+class EmbeddingCache:
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            stored_at, emb = entry
+            if pipeline_clock.now() - stored_at > self.ttl:
+                del self.entries[key]
+                self.evictions += 1
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return emb
+
+    def put(self, key, emb):
+        with self.lock:
+            self.entries[key] = (pipeline_clock.now(), emb)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def report(self):
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        return (f"Embedding cache: {self.hits} hits, {self.misses} misses ({rate:.1%} hit rate), "
+                f"{self.evictions} evictions, {len(self.entries)}/{self.size} entries")
+
+
+embedding_cache = EmbeddingCache(EMBED_CACHE_SIZE, EMBED_CACHE_TTL)
+
+
+def get_embedding(face, model_name="ArcFace", use_cache=True):
+    try:
+        key = (model_name, face.shape[0] // 16, face.shape[1] // 16, crop_hash(face)) if use_cache else None
+        if key is not None:
+            emb = embedding_cache.get(key)
+            if emb is not None:
+                return emb
+
+        face_rgb = cv2.cvtColor(face, cv2.COLOR_BGR2RGB)
+
+        emb = DeepFace.represent(
+            face_rgb,
+            model_name=model_name,
+            detector_backend="skip"
+        )[0]["embedding"]
+
+        if key is not None:
+            embedding_cache.put(key, emb)
+        return emb
+    except:
+        return None
+
+
+def init_db():
+    conn = sqlite3.connect(DB)
+    cur = conn.cursor()
+
+    # WAL lets attendance writes go through while a paged report holds a read cursor.
+    cur.execute("PRAGMA journal_mode=WAL")
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS students (
+            student_id TEXT PRIMARY KEY,
+            student_name TEXT NOT NULL,
+            embedding BLOB NOT NULL
+        );
+    """)
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS student_images (
+            student_id TEXT PRIMARY KEY REFERENCES students(student_id),
+            thumbnail BLOB NOT NULL,
+            original BLOB
+        );
+    """)
+
+    cur.execute("PRAGMA table_info(students)")
+    if "image" in [row[1] for row in cur.fetchall()]:
+        migrate_student_images(conn)
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS attendance (
+            student_id TEXT REFERENCES students(student_id),
+            attendance_date TEXT DEFAULT (DATE('now')),
+            is_present BOOLEAN DEFAULT FALSE,
+            PRIMARY KEY (student_id, attendance_date)
+        );
+    """)
+
+    add_column_if_missing(cur, "students", "fast_embedding", "BLOB")
+    add_column_if_missing(cur, "students", "fast_embedding_error", "TEXT")
+    add_column_if_missing(cur, "students", "embedding_q", "BLOB")
+    add_column_if_missing(cur, "students", "embedding_scale", "REAL")
+    add_column_if_missing(cur, "students", "embedding_storage", "TEXT")
+    add_column_if_missing(cur, "students", "embedding_version", "TEXT")
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value
+        );
+    """)
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS embedding_migration (
+            student_id TEXT PRIMARY KEY REFERENCES students(student_id),
+            version TEXT NOT NULL,
+            embedding BLOB NOT NULL,
+            fast_embedding BLOB
+        );
+    """)
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS courses (
+            course_id TEXT PRIMARY KEY,
+            course_name TEXT NOT NULL
+        );
+    """)
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS sections (
+            section_id TEXT PRIMARY KEY,
+            course_id TEXT NOT NULL REFERENCES courses(course_id),
+            section_name TEXT NOT NULL
+        );
+    """)
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS enrollments (
+            section_id TEXT REFERENCES sections(section_id),
+            student_id TEXT REFERENCES students(student_id),
+            PRIMARY KEY (section_id, student_id)
+        );
+    """)
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS timetable (
+            section_id TEXT NOT NULL REFERENCES sections(section_id),
+            weekday INTEGER NOT NULL,
+            start_time TEXT NOT NULL,
+            end_time TEXT NOT NULL,
+            room TEXT
+        );
+    """)
+
+    init_reporting(cur)
+    init_sync(cur)
+    init_outbox(cur)
+
+    conn.commit()
+    conn.close()
+
+
+def init_reporting(cur):
+    # The primary key leads on student_id, so date-range scans need their own index.
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_attendance_date
+        ON attendance (attendance_date, student_id)
+    """)
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS attendance_daily (
+            attendance_date TEXT PRIMARY KEY,
+            present_count INTEGER NOT NULL DEFAULT 0
+        );
+    """)
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS attendance_monthly (
+            student_id TEXT,
+            month TEXT,
+            present_days INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (student_id, month)
+        );
+    """)
+
+    # Summaries are kept current by triggers, whoever writes the attendance row.
+    add_present = """
+        INSERT INTO attendance_daily (attendance_date, present_count)
+        SELECT NEW.attendance_date, 1 WHERE NEW.is_present
+        ON CONFLICT(attendance_date) DO UPDATE SET present_count = present_count + 1;
+
+        INSERT INTO attendance_monthly (student_id, month, present_days)
+        SELECT NEW.student_id, substr(NEW.attendance_date, 1, 7), 1 WHERE NEW.is_present
+        ON CONFLICT(student_id, month) DO UPDATE SET present_days = present_days + 1;
+    """
+    remove_present = """
+        UPDATE attendance_daily SET present_count = present_count - 1
+        WHERE OLD.is_present AND attendance_date = OLD.attendance_date;
+
+        UPDATE attendance_monthly SET present_days = present_days - 1
+        WHERE OLD.is_present AND student_id = OLD.student_id
+          AND month = substr(OLD.attendance_date, 1, 7);
+    """
+
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS attendance_summary_insert
+        AFTER INSERT ON attendance
+        BEGIN {add_present} END;
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS attendance_summary_update
+        AFTER UPDATE ON attendance
+        BEGIN {remove_present} {add_present} END;
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS attendance_summary_delete
+        AFTER DELETE ON attendance
+        BEGIN {remove_present} END;
+    """)
+
+    cur.execute("SELECT EXISTS (SELECT 1 FROM attendance_daily)")
+    has_summary = cur.fetchone()[0]
+    cur.execute("SELECT EXISTS (SELECT 1 FROM attendance WHERE is_present)")
+    has_attendance = cur.fetchone()[0]
+    if has_attendance and not has_summary:
+        rebuild_attendance_summaries(cur)
+
+
+def rebuild_attendance_summaries(cur):
+    cur.execute("DELETE FROM attendance_daily")
+    cur.execute("DELETE FROM attendance_monthly")
+
+    cur.execute("""
+        INSERT INTO attendance_daily (attendance_date, present_count)
+        SELECT attendance_date, COUNT(*) FROM attendance
+        WHERE is_present
+        GROUP BY attendance_date
+    """)
+    cur.execute("""
+        INSERT INTO attendance_monthly (student_id, month, present_days)
+        SELECT student_id, substr(attendance_date, 1, 7), COUNT(*) FROM attendance
+        WHERE is_present
+        GROUP BY student_id, substr(attendance_date, 1, 7)
+    """)
+
+
+def init_sync(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            student_id TEXT NOT NULL,
+            attendance_date TEXT
+        );
+    """)
+
+    # Rows applied by a pull are not local changes; sync sets this meta key
+    # inside its transaction so they are not echoed back to the central store.
+    local = "WHEN NOT EXISTS (SELECT 1 FROM meta WHERE key = 'applying_sync')"
+    logged = {
+        "student": (("students", "INSERT", None), ("students", "DELETE", None),
+                    ("students", "UPDATE OF student_name, embedding, fast_embedding, embedding_version", None),
+                    ("student_images", "INSERT", None), ("student_images", "UPDATE", None)),
+        "attendance": (("attendance", "INSERT", "attendance_date"), ("attendance", "UPDATE", "attendance_date"),
+                       ("attendance", "DELETE", "attendance_date")),
+    }
+    for kind, events in logged.items():
+        for table, event, date_col in events:
+            row = "OLD" if event == "DELETE" else "NEW"
+            date = f"{row}.{date_col}" if date_col else "NULL"
+            name = f"{table}_log_{event.split()[0].lower()}"
+            if not SYNC_CENTRAL:
+                # Nothing would ever push or prune the log.
+                cur.execute(f"DROP TRIGGER IF EXISTS {name}")
+                continue
+            cur.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {name}
+                AFTER {event} ON {table} {local}
+                BEGIN
+                    INSERT INTO change_log (kind, student_id, attendance_date)
+                    VALUES ('{kind}', {row}.student_id, {date});
+                END;
+            """)
+
+
+def init_outbox(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS attendance_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_key TEXT NOT NULL UNIQUE,
+            student_id TEXT NOT NULL,
+            attendance_date TEXT NOT NULL,
+            marked_at TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt REAL NOT NULL DEFAULT 0,
+            last_error TEXT,
+            delivered_at REAL
+        );
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_outbox_due
+        ON attendance_outbox (next_attempt) WHERE delivered_at IS NULL
+    """)
+
+
+def add_column_if_missing(cur, table, column, decl):
+    cur.execute(f"PRAGMA table_info({table})")
+    if column not in [row[1] for row in cur.fetchall()]:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+def quantize_embedding(emb, storage):
+    emb = np.asarray(emb, dtype=np.float32)
+    if storage == "float16":
+        return emb.astype(np.float16), 1.0
+    if storage == "int8":
+        peak = float(np.abs(emb).max())
+        scale = peak / 127.0 if peak > 0 else 1.0
+        return np.round(emb / scale).astype(np.int8), scale
+    raise ValueError(f"Unknown embedding storage: {storage}")
+
+
+def encode_thumbnail(face):
+    h, w = face.shape[:2]
+    scale = THUMB_SIZE / max(h, w)
+    if scale < 1:
+        face = cv2.resize(face, (max(1, round(w * scale)), max(1, round(h * scale))),
+                          interpolation=cv2.INTER_AREA)
+    quality_flag = cv2.IMWRITE_WEBP_QUALITY if THUMB_FORMAT == ".webp" else cv2.IMWRITE_JPEG_QUALITY
+    ok, buf = cv2.imencode(THUMB_FORMAT, face, [quality_flag, THUMB_QUALITY])
+    if not ok:
+        raise ValueError(f"Could not encode {THUMB_FORMAT} thumbnail")
+    return buf.tobytes()
+
+
+def image_row(sid, image):
+    face = cv2.imdecode(np.frombuffer(image, dtype=np.uint8), cv2.IMREAD_COLOR)
+    original = image if KEEP_ORIGINAL_IMAGES else None
+    return sid, encode_thumbnail(face), original
+
+
+def migrate_student_images(conn):
+    # Older databases kept the PNG crop inline in students.image.
+    cur = conn.cursor()
+    rows = conn.execute("SELECT student_id, image FROM students WHERE length(image) > 0")
+    for sid, image in rows:
+        cur.execute("INSERT OR IGNORE INTO student_images (student_id, thumbnail, original) VALUES (?, ?, ?)",
+                    image_row(sid, image))
+
+    if sqlite3.sqlite_version_info >= (3, 35, 0):
+        cur.execute("ALTER TABLE students DROP COLUMN image")
+    else:
+        # No DROP COLUMN before SQLite 3.35: copy everything else into a new
+        # table and swap it in, in the same transaction as the image copy.
+        cur.execute("PRAGMA table_info(students)")
+        columns = [row for row in cur.fetchall() if row[1] != "image"]
+        decls = ", ".join(
+            f"{name} {decl}" + (" NOT NULL" if notnull else "")
+            + (f" DEFAULT {default}" if default is not None else "") + (" PRIMARY KEY" if pk else "")
+            for _, name, decl, notnull, default, pk in columns
+        )
+        names = ", ".join(row[1] for row in columns)
+        if not conn.in_transaction:
+            cur.execute("BEGIN")
+        cur.execute("DROP TABLE IF EXISTS students_rebuild")
+        cur.execute(f"CREATE TABLE students_rebuild ({decls})")
+        cur.execute(f"INSERT INTO students_rebuild ({names}) SELECT {names} FROM students")
+        cur.execute("DROP TABLE students")
+        cur.execute("ALTER TABLE students_rebuild RENAME TO students")
+    conn.commit()
+
+
+def load_student_face(student_id):
+    conn = sqlite3.connect(DB)
+    cur = conn.cursor()
+
+    cur.execute("SELECT COALESCE(original, thumbnail) FROM student_images WHERE student_id = ?",
+                (student_id,))
+    row = cur.fetchone()
+
+    conn.close()
+    if row is None:
+        return None
+    return cv2.imdecode(np.frombuffer(row[0], dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+def save_student_to_db(id, name, image, embedding, fast_embedding=None):
+    conn = sqlite3.connect(DB)
+    cur = conn.cursor()
+
+    insert_student(cur, id, name, image, embedding, fast_embedding)
+
+    conn.commit()
+    conn.close()
+
+
+def insert_student(cur, id, name, image, embedding, fast_embedding=None):
+    embedding = np.array(embedding, dtype=np.float32)
+    emb_q, emb_scale, storage = None, None, None
+    if EMBEDDING_STORAGE != "float32":
+        emb_q, emb_scale = quantize_embedding(embedding, EMBEDDING_STORAGE)
+        emb_q, storage = emb_q.tobytes(), EMBEDDING_STORAGE
+    embedding = embedding.tobytes()
+    if fast_embedding is not None:
+        fast_embedding = np.array(fast_embedding, dtype=np.float32).tobytes()
+
+    cur.execute("""
+        INSERT INTO students (
+            student_id, student_name, embedding, fast_embedding,
+            embedding_q, embedding_scale, embedding_storage, embedding_version
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?);
+    """, (id, name, embedding, fast_embedding, emb_q, emb_scale, storage, EMBEDDING_VERSION))
+
+    cur.execute("""
+        INSERT OR REPLACE INTO student_images (student_id, thumbnail, original)
+        VALUES (?, ?, ?);
+    """, image_row(id, image))
+
+
+def load_all_students_faces():
+    conn = sqlite3.connect(DB)
+    cur = conn.cursor()
+
+    cur.execute("SELECT student_id, student_name, embedding FROM students")
+    rows = cur.fetchall()
+
+    conn.close()
+
+    ids, names, embeddings = [], [], []
+
+    for sid, name, emb_bytes in rows:
+        emb = np.frombuffer(emb_bytes, dtype=np.float32)
+        ids.append(sid)
+        names.append(name)
+        embeddings.append(emb)
+
+    return ids, names, np.vstack(embeddings)
+
+
+class QuantizedGallery:
+    def __init__(self, codes, scales):
+        self.codes = codes
+        self.scales = scales
+        self.dtype = codes.dtype
+
+        # Squared norms of the stored codes, so a distance only needs a dot product.
+        self.code_norms = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), QUANT_CHUNK):
+            block = codes[start:start + QUANT_CHUNK].astype(np.float32)
+            self.code_norms[start:start + QUANT_CHUNK] = np.einsum("ij,ij->i", block, block)
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.scales.nbytes + self.code_norms.nbytes
+
+    def distances(self, emb, rows=None):
+        codes, scales, norms = self.codes, self.scales, self.code_norms
+        if rows is not None:
+            codes, scales, norms = codes[rows], scales[rows], norms[rows]
+
+        dots = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), QUANT_CHUNK):
+            block = codes[start:start + QUANT_CHUNK].astype(np.float32)
+            dots[start:start + QUANT_CHUNK] = block @ emb
+
+        sq = scales * scales * norms - 2.0 * scales * dots + float(emb @ emb)
+        return np.sqrt(np.maximum(sq, 0.0))
+
+
+def load_gallery():
+    if EMBEDDING_STORAGE == "float32":
+        return load_all_students_faces()
+
+    conn = sqlite3.connect(DB)
+    cur = conn.cursor()
+
+    cur.execute("""
+        SELECT student_id, student_name, embedding_storage, embedding_q, embedding_scale, embedding
+        FROM students
+    """)
+
+    ids, names, codes, scales, stale = [], [], [], [], []
+    dtype = np.float16 if EMBEDDING_STORAGE == "float16" else np.int8
+
+    # Stream the cursor so the float32 embeddings are never all resident at once.
+    for sid, name, storage, emb_q, scale, emb_bytes in cur:
+        if storage == EMBEDDING_STORAGE:
+            code = np.frombuffer(emb_q, dtype=dtype)
+        else:
+            code, scale = quantize_embedding(np.frombuffer(emb_bytes, dtype=np.float32), EMBEDDING_STORAGE)
+            stale.append((code.tobytes(), scale, EMBEDDING_STORAGE, sid))
+        ids.append(sid)
+        names.append(name)
+        codes.append(code)
+        scales.append(scale)
+
+    if stale:
+        cur.executemany("""
+            UPDATE students SET embedding_q = ?, embedding_scale = ?, embedding_storage = ?
+            WHERE student_id = ?
+        """, stale)
+        conn.commit()
+    conn.close()
+
+    if not ids:
+        raise ValueError("No students registered")
+
+    return ids, names, QuantizedGallery(np.vstack(codes), np.array(scales, dtype=np.float32))
+
+
+def load_embeddings(student_ids):
+    conn = sqlite3.connect(DB)
+    cur = conn.cursor()
+
+    marks = ",".join("?" * len(student_ids))
+    cur.execute(f"SELECT student_id, embedding FROM students WHERE student_id IN ({marks})",
+                list(student_ids))
+    rows = dict(cur.fetchall())
+
+    conn.close()
+    return {sid: np.frombuffer(emb, dtype=np.float32) for sid, emb in rows.items()}
+
+
+def rerank_search(gallery, emb, rows, fetch_exact, k=QUANT_RERANK_K):
+    dists = gallery.distances(emb, rows)
+    if len(dists) > k:
+        candidates = np.argpartition(dists, k)[:k]
+    else:
+        candidates = np.arange(len(dists))
+
+    exact = fetch_exact(candidates if rows is None else rows[candidates])
+    exact_dists = np.linalg.norm(exact - emb, axis=1)
+    best, best_dist, second_dist = best_two(exact_dists)
+    return candidates[best], best_dist, second_dist
+
+
+def backfill_fast_embeddings():
+    conn = sqlite3.connect(DB)
+    cur = conn.cursor()
+
+    # A face that failed once is not retried; re-embedding the student clears the error.
+    cur.execute("""
+        SELECT s.student_id, COALESCE(i.original, i.thumbnail)
+        FROM students s
+        JOIN student_images i ON i.student_id = s.student_id
+        WHERE s.fast_embedding IS NULL AND s.fast_embedding_error IS NULL
+    """)
+    rows = cur.fetchall()
+
+    filled = 0
+    failures = []
+    for sid, image in rows:
+        face = cv2.imdecode(np.frombuffer(image, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if face is None:
+            failures.append(("cannot decode stored image", sid))
+            continue
+        emb = get_embedding(face, FAST_MODEL)
+        if emb is None:
+            failures.append(("embedding failed", sid))
+            continue
+        cur.execute(
+            "UPDATE students SET fast_embedding = ? WHERE student_id = ?",
+            (np.array(emb, dtype=np.float32).tobytes(), sid)
+        )
+        filled += 1
+
+    cur.executemany("UPDATE students SET fast_embedding_error = ? WHERE student_id = ?", failures)
+    conn.commit()
+    conn.close()
+    return filled, len(failures)
+
+
+def load_fast_embeddings(ids):
+    conn = sqlite3.connect(DB)
+    cur = conn.cursor()
+
+    cur.execute("SELECT student_id, fast_embedding FROM students")
+    rows = dict(cur.fetchall())
+
+    conn.close()
+
+    # The fast stage is all-or-nothing: a student missing from the light
+    # gallery could never win it, so fall back to ArcFace for everyone.
+    if any(rows.get(sid) is None for sid in ids):
+        return None
+
+    return np.vstack([np.frombuffer(rows[sid], dtype=np.float32) for sid in ids])
+
+
+def best_two(dists):
+    if len(dists) == 1:
+        return 0, dists[0], np.inf
+    top = np.argpartition(dists, 1)[:2]
+    if dists[top[1]] < dists[top[0]]:
+        top = top[::-1]
+    return top[0], dists[top[0]], dists[top[1]]
+
+
+def block_distances(a, a_norms, b, b_norms):
+    # |a - b|^2 = |a|^2 + |b|^2 - 2 a.b, so each tile is one BLAS matrix product.
+    d = a @ b.T
+    d *= -2
+    d += a_norms[:, None]
+    d += b_norms[None, :]
+    np.maximum(d, 0, out=d)
+    return np.sqrt(d, out=d)
+
+
+def gallery_topk(queries, gallery, k=5, block=GALLERY_BLOCK):
+    queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+    gallery = np.asarray(gallery, dtype=np.float32)
+    k = min(k, len(gallery))
+    q_norms = np.einsum("ij,ij->i", queries, queries)
+    g_norms = np.einsum("ij,ij->i", gallery, gallery)
+
+    best_idx = np.zeros((len(queries), k), dtype=np.intp)
+    best_dist = np.full((len(queries), k), np.inf, dtype=np.float32)
+    for start in range(0, len(gallery), block):
+        d = block_distances(queries, q_norms, gallery[start:start + block], g_norms[start:start + block])
+        idx = np.broadcast_to(np.arange(start, start + d.shape[1]), d.shape)
+
+        # Merge this tile's candidates with the running top-k.
+        d = np.hstack([best_dist, d])
+        idx = np.hstack([best_idx, idx])
+        keep = np.argpartition(d, k - 1, axis=1)[:, :k] if d.shape[1] > k else np.argsort(d, axis=1)
+        best_dist = np.take_along_axis(d, keep, axis=1)
+        best_idx = np.take_along_axis(idx, keep, axis=1)
+
+    order = np.argsort(best_dist, axis=1)
+    return np.take_along_axis(best_idx, order, axis=1), np.take_along_axis(best_dist, order, axis=1)
+
+
+class ShardedGallery:
+    def __init__(self, embeddings, shards=SEARCH_SHARDS, chunk=SHARD_CHUNK):
+        self.embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        self.norms = np.einsum("ij,ij->i", self.embeddings, self.embeddings)
+        self.chunk = chunk
+
+        # Shards are row ranges of the one gallery array: worker threads share
+        # it without copies, and the matrix products release the GIL.
+        bounds = np.linspace(0, len(self.embeddings), max(1, shards) + 1).astype(np.intp)
+        self.shards = [(start, stop) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+        # One distance buffer per shard, reused by every search instead of an
+        # N x dim temporary per query.
+        self.buffers = [np.empty(min(chunk, stop - start), dtype=np.float32)
+                        for start, stop in self.shards]
+        self.lock = threading.Lock()
+        self.executor = None
+        if len(self.shards) > 1:
+            self.executor = ThreadPoolExecutor(len(self.shards), thread_name_prefix="shard")
+
+    def __len__(self):
+        return len(self.embeddings)
+
+    def __getitem__(self, rows):
+        return self.embeddings[rows]
+
+    @property
+    def nbytes(self):
+        return self.embeddings.nbytes + self.norms.nbytes + sum(b.nbytes for b in self.buffers)
+
+    def search_shard(self, shard, emb, k):
+        start, stop = self.shards[shard]
+        buffer = self.buffers[shard]
+        best_idx = np.empty(0, dtype=np.intp)
+        best_sq = np.empty(0, dtype=np.float32)
+        for lo in range(start, stop, self.chunk):
+            hi = min(lo + self.chunk, stop)
+            # |g|^2 - 2 g.e; |e|^2 is the same for every row and added after the merge.
+            d = buffer[:hi - lo]
+            np.dot(self.embeddings[lo:hi], emb, out=d)
+            d *= -2
+            d += self.norms[lo:hi]
+
+            top = np.argpartition(d, k - 1)[:k] if len(d) > k else np.arange(len(d))
+            best_idx = np.concatenate([best_idx, top + lo])
+            best_sq = np.concatenate([best_sq, d[top]])
+            if len(best_sq) > k:
+                keep = np.argpartition(best_sq, k - 1)[:k]
+                best_idx, best_sq = best_idx[keep], best_sq[keep]
+        return best_idx, best_sq
+
+    def topk(self, emb, k=2):
+        emb = np.ascontiguousarray(emb, dtype=np.float32)
+        k = min(k, len(self.embeddings))
+        with self.lock:
+            if self.executor is None:
+                parts = [self.search_shard(0, emb, k)]
+            else:
+                n = len(self.shards)
+                parts = list(self.executor.map(self.search_shard, range(n), [emb] * n, [k] * n))
+
+        idx = np.concatenate([i for i, _ in parts])
+        sq = np.concatenate([d for _, d in parts])
+        order = np.argsort(sq)[:k]
+        return idx[order], np.sqrt(np.maximum(sq[order] + float(emb @ emb), 0.0))
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+
+class GalleryAnalysis:
+    def __init__(self, bins, bin_width, pairs, nearest, nearest_idx, duplicates):
+        self.bins = bins
+        self.bin_width = bin_width
+        self.pairs = pairs
+        self.nearest = nearest
+        self.nearest_idx = nearest_idx
+        self.duplicates = duplicates
+
+    def pair_far(self, threshold):
+        # Fraction of impostor pairs that a kiosk at this threshold would accept.
+        return self.bins[:int(threshold / self.bin_width)].sum() / self.pairs
+
+    def threshold_at(self, far):
+        cumulative = np.cumsum(self.bins)
+        return np.searchsorted(cumulative, far * self.pairs, side="right") * self.bin_width
+
+
+def analyze_gallery(embeddings, duplicate_threshold=DUPLICATE_THRESHOLD, block=GALLERY_BLOCK,
+                    bin_width=0.01, max_duplicates=10000):
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    n = len(embeddings)
+    norms = np.einsum("ij,ij->i", embeddings, embeddings)
+    nbins = int(2 * np.sqrt(norms.max()) / bin_width) + 2
+
+    bins = np.zeros(nbins, dtype=np.int64)
+    codes = np.empty((min(block, n), min(block, n)), dtype=np.int32)
+    nearest = np.full(n, np.inf, dtype=np.float32)
+    nearest_idx = np.full(n, -1, dtype=np.intp)
+    duplicates = []
+
+    # Only tiles on or above the diagonal; each pair is counted once.
+    for i in range(0, n, block):
+        a = embeddings[i:i + block]
+        for j in range(i, n, block):
+            d = block_distances(a, norms[i:i + block], embeddings[j:j + block], norms[j:j + block])
+            if i == j:
+                d[np.tril_indices(len(d))] = np.inf
+
+            rows = np.argmin(d, axis=1)
+            row_best = d[np.arange(len(d)), rows]
+            better = row_best < nearest[i:i + len(d)]
+            nearest[i:i + len(d)][better] = row_best[better]
+            nearest_idx[i:i + len(d)][better] = rows[better] + j
+
+            # argmin down columns is strided and slow; only do it where the minimum improved.
+            col_best = d.min(axis=0)
+            better = np.flatnonzero(col_best < nearest[j:j + d.shape[1]])
+            if len(better):
+                nearest[j + better] = col_best[better]
+                nearest_idx[j + better] = np.argmin(d[:, better], axis=0) + i
+
+            if len(duplicates) < max_duplicates:
+                for r, c in zip(*np.nonzero(d < duplicate_threshold)):
+                    duplicates.append((i + r, j + c, float(d[r, c])))
+
+            # Histogram via integer bin codes, reusing the tile in place. The masked
+            # lower triangle lands in the overflow bin and is taken out again.
+            d *= 1 / bin_width
+            np.minimum(d, nbins - 1, out=d)
+            tile = codes[:d.shape[0], :d.shape[1]]
+            np.copyto(tile, d, casting="unsafe")
+            bins += np.bincount(tile.ravel(), minlength=nbins)
+            if i == j:
+                bins[-1] -= len(d) * (len(d) + 1) // 2
+
+    duplicates.sort(key=lambda pair: pair[2])
+    return GalleryAnalysis(bins, bin_width, n * (n - 1) // 2, nearest, nearest_idx,
+                           duplicates[:max_duplicates])
+
+
+def nearest_in_gallery(ids, names, gallery, emb, k=3):
+    emb = np.asarray(emb, dtype=np.float32)
+
+    if isinstance(gallery, QuantizedGallery):
+        # Shortlist on the codes, then rank the shortlist on float32.
+        dists = gallery.distances(emb)
+        shortlist = min(k * QUANT_RERANK_K, len(dists))
+        candidates = np.argpartition(dists, shortlist - 1)[:shortlist]
+        exact = load_embeddings([ids[i] for i in candidates])
+        rows, dists = gallery_topk(emb, np.vstack([exact[ids[i]] for i in candidates]), k)
+        rows = candidates[rows[0]]
+    else:
+        rows, dists = gallery_topk(emb, gallery, k)
+        rows = rows[0]
+
+    return [(ids[r], names[r], float(d)) for r, d in zip(rows, dists[0])]
+
+
+class RegistrationGallery:
+    # What the duplicate check at registration searches. The gallery is
+    # loaded once; students registered by this process are kept alongside it
+    # rather than reloading and decoding every embedding per registration.
+    # Any other change to students (sync, reembed, another kiosk on the same
+    # file) moves the signature and the next check reloads.
+    def __init__(self):
+        self.signature = None
+        self.ids, self.names, self.gallery = [], [], None
+        self.added = []
+
+    def read_signature(self):
+        conn = sqlite3.connect(DB)
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT (SELECT value FROM meta WHERE key = 'gallery_generation'), COUNT(*), MAX(rowid)
+            FROM students
+        """)
+        signature = cur.fetchone()
+        conn.close()
+        return signature
+
+    def nearest(self, emb, k=3):
+        signature = self.read_signature()
+        if signature != self.signature:
+            try:
+                self.ids, self.names, self.gallery = load_gallery()
+            except ValueError:
+                self.ids, self.names, self.gallery = [], [], None
+            self.added = []
+            self.signature = signature
+
+        found = nearest_in_gallery(self.ids, self.names, self.gallery, emb, k) if self.ids else []
+        emb = np.asarray(emb, dtype=np.float32)
+        found += [(sid, name, float(np.linalg.norm(other - emb))) for sid, name, other in self.added]
+        return sorted(found, key=lambda match: match[2])[:k]
+
+    def add(self, student_id, name, emb):
+        # Called after this process inserted the student. If that insert is
+        # the only change since the last look, keep it in memory; otherwise
+        # leave the next check to reload.
+        signature = self.read_signature()
+        if self.signature is not None and signature[:2] == (self.signature[0], self.signature[1] + 1):
+            self.added.append((student_id, name, np.asarray(emb, dtype=np.float32)))
+            self.signature = signature
+        else:
+            self.signature = None
+
+
+registration_gallery = RegistrationGallery()
+
+
+class CascadeMatcher:
+    def __init__(self, ids, names, embeddings, fast_embeddings=None):
+        self.ids = ids
+        self.names = names
+        self.embeddings = embeddings
+        self.fast_embeddings = fast_embeddings
+        self.row_of = {sid: i for i, sid in enumerate(ids)}
+
+        # Row indices of the active roster; None searches the whole gallery.
+        self.roster = None
+
+        # float32 rows fetched for re-ranking when the gallery is quantized.
+        self.exact_cache = {}
+
+        self.faces = 0
+        self.fast_accepts = 0
+        self.fast_rejects = 0
+        self.escalations = 0
+        self.roster_fallbacks = 0
+
+        # How the last match() was decided, for the recognition journal.
+        self.last_stage = None
+        self.last_nearest = None
+        self.last_margin = np.inf
+        self.last_embed_ms = 0.0
+
+    def set_roster(self, student_ids):
+        if student_ids is None:
+            self.roster = None
+            return
+        rows = [self.row_of[sid] for sid in student_ids if sid in self.row_of]
+        self.roster = np.array(rows, dtype=np.intp)
+
+    def embed(self, face, embs, model_name):
+        if model_name not in embs:
+            start = time.perf_counter()
+            emb = get_embedding(face, model_name)
+            self.last_embed_ms += (time.perf_counter() - start) * 1000
+            embs[model_name] = None if emb is None else np.array(emb, dtype=np.float32)
+        return embs[model_name]
+
+    def distances(self, gallery, emb, rows):
+        if rows is not None:
+            gallery = gallery[rows]
+        return np.linalg.norm(gallery - emb, axis=1)
+
+    def result(self, idx, dist, rows, threshold, second_dist=np.inf):
+        if rows is not None:
+            idx = rows[idx]
+        self.last_nearest = self.ids[idx]
+        self.last_margin = second_dist - dist
+        # Positive below the threshold, negative above it, comparable across stages.
+        score = (threshold - dist) / threshold
+        if dist < threshold:
+            return self.names[idx], self.ids[idx], dist, score
+        return "Unknown", "Unknown", dist, score
+
+    def match_arcface(self, face, embs=None, rows=None):
+        emb = self.embed(face, {} if embs is None else embs, "ArcFace")
+        if emb is None:
+            return None
+
+        self.last_stage = "arcface"
+        if isinstance(self.embeddings, QuantizedGallery):
+            best_idx, best_dist, second_dist = rerank_search(self.embeddings, emb, rows, self.fetch_exact)
+            return self.result(best_idx, best_dist, rows, THRESHOLD, second_dist)
+
+        if isinstance(self.embeddings, ShardedGallery) and rows is None:
+            idxs, dists = self.embeddings.topk(emb, 2)
+            second_dist = dists[1] if len(dists) > 1 else np.inf
+            return self.result(idxs[0], dists[0], None, THRESHOLD, second_dist)
+
+        dists = self.distances(self.embeddings, emb, rows)
+        best_idx, best_dist, second_dist = best_two(dists)
+        return self.result(best_idx, best_dist, rows, THRESHOLD, second_dist)
+
+    def fetch_exact(self, idxs):
+        wanted = [self.ids[i] for i in idxs]
+        missing = [sid for sid in wanted if sid not in self.exact_cache]
+        if missing:
+            if len(self.exact_cache) > 1024:
+                self.exact_cache.clear()
+            self.exact_cache.update(load_embeddings(missing))
+        return np.vstack([self.exact_cache[sid] for sid in wanted])
+
+    def match_rows(self, face, embs, rows):
+        if self.fast_embeddings is not None:
+            emb = self.embed(face, embs, FAST_MODEL)
+            if emb is not None:
+                dists = self.distances(self.fast_embeddings, emb, rows)
+                best_idx, best_dist, second_dist = best_two(dists)
+
+                if best_dist < FAST_THRESHOLD and second_dist - best_dist >= CASCADE_MARGIN:
+                    self.fast_accepts += 1
+                    self.last_stage = "fast"
+                    return self.result(best_idx, best_dist, rows, FAST_THRESHOLD, second_dist)
+                if best_dist > FAST_REJECT:
+                    self.fast_rejects += 1
+                    self.last_stage = "fast-reject"
+                    self.last_nearest = self.ids[best_idx if rows is None else rows[best_idx]]
+                    self.last_margin = second_dist - best_dist
+                    return "Unknown", "Unknown", best_dist, (FAST_THRESHOLD - best_dist) / FAST_THRESHOLD
+
+        return self.match_arcface(face, embs, rows)
+
+    def match(self, face):
+        self.faces += 1
+        self.last_embed_ms = 0.0
+        embs = {}
+
+        result = None
+        if self.roster is not None and len(self.roster):
+            result = self.match_rows(face, embs, self.roster)
+            if result is not None and result[1] == "Unknown":
+                # Not on the roster (late enrolment, visiting student):
+                # retry against everyone before calling the face unknown.
+                self.roster_fallbacks += 1
+                result = None
+
+        if result is None:
+            result = self.match_rows(face, embs, None)
+
+        if "ArcFace" in embs:
+            self.escalations += 1
+        return result
+
+    def escalation_rate(self):
+        return self.escalations / self.faces if self.faces else 0.0
+
+    def report(self):
+        return (f"Cascade: {self.faces} faces, {self.fast_accepts} fast accepts, "
+                f"{self.fast_rejects} fast rejects, {self.escalations} escalated to ArcFace "
+                f"({self.escalation_rate():.1%}), {self.roster_fallbacks} roster fallbacks")
+
+
+def box_iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    iw = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    ih = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = iw * ih
+    union = aw * ah + bw * bh - inter
+    return inter / union if union else 0.0
+
+
+class FaceTrack:
+    def __init__(self, track_id, box):
+        self.track_id = track_id
+        self.box = box
+        self.misses = 0
+        self.reopen()
+
+    def reopen(self):
+        self.evidence = {}
+        self.names = {}
+        self.total = 0.0
+        self.frames = 0
+        self.started = pipeline_clock.now()
+
+        # (name, id_, dist) once the track has been committed.
+        self.decision = None
+        self.held = 0
+
+
+class SequentialDecider:
+    def __init__(self):
+        self.tracks = []
+        self.next_id = 0
+
+        self.decision_frames = []
+        self.decision_seconds = []
+
+    def reset(self):
+        self.tracks = []
+
+    def assign(self, boxes):
+        pairs = sorted(
+            ((box_iou(box, track.box), i, track) for i, box in enumerate(boxes) for track in self.tracks),
+            key=lambda pair: pair[0], reverse=True
+        )
+
+        assigned = [None] * len(boxes)
+        used = set()
+        for iou, i, track in pairs:
+            if iou < TRACK_IOU:
+                break
+            if assigned[i] is not None or track.track_id in used:
+                continue
+            assigned[i] = track
+            used.add(track.track_id)
+
+        for track in self.tracks:
+            track.misses = 0 if track.track_id in used else track.misses + 1
+        self.tracks = [t for t in self.tracks if t.misses <= TRACK_MAX_MISSES]
+
+        for i, box in enumerate(boxes):
+            if assigned[i] is None:
+                assigned[i] = FaceTrack(self.next_id, box)
+                self.next_id += 1
+                self.tracks.append(assigned[i])
+            assigned[i].box = box
+
+        for track in assigned:
+            if track.decision is not None and track.decision[1] == "Unknown":
+                track.held += 1
+                if track.held > SEQ_UNKNOWN_HOLD:
+                    track.reopen()
+
+        return assigned
+
+    def observe(self, track, name, id_, dist, score):
+        track.frames += 1
+        track.total += score
+
+        if id_ != "Unknown":
+            track.evidence[id_] = track.evidence.get(id_, 0.0) + score
+            track.names[id_] = name
+        else:
+            for key in track.evidence:
+                track.evidence[key] += score
+
+        best = max(track.evidence, key=track.evidence.get, default=None)
+        if best is not None and track.evidence[best] >= SEQ_ACCEPT:
+            self.commit(track, track.names[best], best, dist)
+        elif track.total <= SEQ_REJECT or track.frames >= SEQ_MAX_FRAMES:
+            self.commit(track, "Unknown", "Unknown", dist)
+
+    def commit(self, track, name, id_, dist):
+        track.decision = (name, id_, dist)
+        self.decision_frames.append(track.frames)
+        self.decision_seconds.append(pipeline_clock.now() - track.started)
+
+    def report(self):
+        if not self.decision_frames:
+            return "Sequential decisions: none"
+        return (f"Sequential decisions: {len(self.decision_frames)}, "
+                f"avg {np.mean(self.decision_frames):.2f} frames, "
+                f"avg {np.mean(self.decision_seconds):.2f} s to decision")
+
+
+def prepare_frame(frame):
+    # Recordings hold raw camera frames; the live scan and replay both go
+    # through here so they recognise exactly the same pixels.
+    return cv2.flip(frame, 1)
+
+
+def recognize_frame(frame, detector, matcher, decider, journal=None, camera=None):
+    results = []
+    now = time.time()
+
+    start = time.perf_counter()
+    boxes = detector.detect(frame)
+    detect_ms = (time.perf_counter() - start) * 1000
+
+    for (x, y, w, h), track in zip(boxes, decider.assign(boxes)):
+        if track.decision is not None:
+            results.append((x, y, w, h, *track.decision))
+            if journal is not None:
+                name, id_, dist = track.decision
+                journal.record((now, camera, track.track_id, x, y, w, h, "tracked", id_,
+                                id_, float(dist), None, detect_ms, 0.0, 0.0))
+            continue
+
+        face = frame[y:y + h, x:x + w]
+        if face.size == 0:
+            continue
+
+        start = time.perf_counter()
+        match = matcher.match(face)
+        match_ms = (time.perf_counter() - start) * 1000
+        if match is None:
+            continue
+
+        name, id_, best_dist, score = match
+        decider.observe(track, name, id_, best_dist, score)
+        if track.decision is not None:
+            results.append((x, y, w, h, *track.decision))
+        else:
+            results.append((x, y, w, h, PENDING, None, best_dist))
+
+        if journal is not None:
+            outcome = track.decision[1] if track.decision is not None else PENDING
+            margin = float(matcher.last_margin) if np.isfinite(matcher.last_margin) else None
+            journal.record((now, camera, track.track_id, x, y, w, h, matcher.last_stage, outcome,
+                            matcher.last_nearest, float(best_dist), margin,
+                            detect_ms, matcher.last_embed_ms, match_ms - matcher.last_embed_ms))
+
+    return results
+
+
+JOURNAL_COLUMNS = ("ts", "camera", "track", "x", "y", "w", "h", "stage", "outcome",
+                   "nearest_id", "distance", "margin", "detect_ms", "embed_ms", "search_ms")
+
+
+class RecognitionJournal:
+    def __init__(self, path=JOURNAL_PATH, capacity=JOURNAL_CAPACITY, interval=JOURNAL_FLUSH_S):
+        self.path = path
+        self.interval = interval
+        # deque.append is atomic under the GIL, so the frame loop never takes
+        # a lock; when the writer falls behind the oldest events are dropped.
+        self.buffer = deque(maxlen=capacity)
+        self.recorded = 0
+        self.written = 0
+
+        conn = sqlite3.connect(path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS recognition_events (
+                ts REAL NOT NULL,
+                camera TEXT,
+                track INTEGER,
+                x INTEGER, y INTEGER, w INTEGER, h INTEGER,
+                stage TEXT,
+                outcome TEXT,
+                nearest_id TEXT,
+                distance REAL,
+                margin REAL,
+                detect_ms REAL,
+                embed_ms REAL,
+                search_ms REAL
+            );
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_events_ts ON recognition_events (ts)")
+        conn.commit()
+        conn.close()
+
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="journal", daemon=True)
+        self.thread.start()
+
+    def record(self, event):
+        self.buffer.append(event)
+        self.recorded += 1
+
+    @property
+    def dropped(self):
+        return self.recorded - self.written - len(self.buffer)
+
+    def flush(self, conn):
+        batch = []
+        try:
+            while True:
+                batch.append(self.buffer.popleft())
+        except IndexError:
+            pass
+        if batch:
+            marks = ",".join("?" * len(JOURNAL_COLUMNS))
+            conn.executemany(f"INSERT INTO recognition_events VALUES ({marks})", batch)
+            conn.commit()
+            self.written += len(batch)
+
+    def prune(self, conn):
+        if JOURNAL_RETENTION_DAYS:
+            conn.execute("DELETE FROM recognition_events WHERE ts < ?",
+                         (time.time() - JOURNAL_RETENTION_DAYS * 86400,))
+            conn.commit()
+
+    def run(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        self.prune(conn)
+        pruned = time.monotonic()
+        while not self.stopped.wait(self.interval):
+            self.flush(conn)
+            if time.monotonic() - pruned > 3600:
+                self.prune(conn)
+                pruned = time.monotonic()
+        self.flush(conn)
+        conn.close()
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def report(self):
+        return (f"Journal: {self.written} events written to {self.path}, "
+                f"{len(self.buffer)} buffered, {self.dropped} dropped")
+
+
+recognition_journal = None
+
+
+# Innermost matching function wins, so an allocation made by get_embedding
+# during CascadeMatcher.match counts as "embed", not "match".
+PIPELINE_STAGES = {
+    "CameraDevice.run": "capture",
+    "CameraDevice.latest": "capture",
+    "ReplaySource.read": "capture",
+    "TiledDetector.detect": "detect",
+    "detect_boxes": "detect",
+    "extract_face": "detect",
+    "get_embedding": "embed",
+    "CascadeMatcher.embed": "embed",
+    "CascadeMatcher.match": "match",
+    "SequentialDecider.assign": "match",
+    "SequentialDecider.observe": "match",
+    "recognize_frame": "match",
+    "ScanWindow.update_frame": "render",
+    "save_student_attendance": "db",
+    "load_gallery": "db",
+    "RecognitionJournal.flush": "db",
+    "TodayAttendance.poll": "db",
+    "TodayAttendance.refresh": "db",
+    "due_outbox_events": "db",
+    "finish_outbox_batch": "db",
+    "sync_once": "db",
+}
+
+
+def stage_functions():
+    functions = {}
+    for qualname in PIPELINE_STAGES:
+        obj = globals()
+        for part in qualname.split("."):
+            obj = obj[part] if isinstance(obj, dict) else getattr(obj, part)
+        functions[qualname] = obj
+    return functions
+
+
+def stage_ranges():
+    ranges = []
+    for qualname, function in stage_functions().items():
+        stage = PIPELINE_STAGES[qualname]
+        code = function.__code__
+        last = max(line for *_, line in code.co_lines() if line is not None)
+        ranges.append((code.co_filename, code.co_firstlineno, last, stage))
+    return ranges
+
+
+def allocation_stage(traceback, ranges):
+    for frame in reversed(traceback):
+        for filename, first, last, stage in ranges:
+            if frame.filename == filename and first <= frame.lineno <= last:
+                return stage
+    return "other"
+
+
+def allocation_growth(before, after, limit=10):
+    ranges = stage_ranges()
+    stages = {}
+    for diff in after.compare_to(before, "traceback"):
+        total = stages.setdefault(allocation_stage(diff.traceback, ranges), [0, 0])
+        total[0] += diff.size_diff
+        total[1] += diff.count_diff
+
+    lines = [f"{'stage':<9}{'KiB':>10}{'blocks':>9}"]
+    for stage, (size, count) in sorted(stages.items(), key=lambda item: -item[1][0]):
+        lines.append(f"{stage:<9}{size / 1024:>+10.1f}{count:>+9}")
+    lines.append("Top allocation sites:")
+    lines += [f"  {stat}" for stat in after.compare_to(before, "lineno")[:limit]]
+    return "\n".join(lines)
+
+
+def take_snapshot():
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+    ))
+
+
+def rss_mib():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # Peak rather than current RSS, but still shows a creeping leak.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+
+def release_models():
+    # DeepFace keeps every model it has built in a module-level cache, and
+    # Keras keeps their graphs; drop both so the next embedding rebuilds them.
+    try:
+        from deepface.modules import modeling
+        modeling.cached_models = {task: {} for task in modeling.cached_models}
+    except (ImportError, AttributeError):
+        pass
+    tf = sys.modules.get("tensorflow")
+    if tf is not None:
+        tf.keras.backend.clear_session()
+
+
+class MemoryMonitor(threading.Thread):
+    def __init__(self, budget=MEMORY_BUDGET_MB, interval=MEMORY_CHECK_S):
+        super().__init__(name="memory", daemon=True)
+        self.budget = budget
+        self.interval = interval
+        self.samples = deque(maxlen=MEMORY_TREND_SAMPLES)
+        self.peak = 0.0
+        self.alerts = 0
+        self.restarts = 0
+        self.over_budget = False
+        self.baseline = None
+        self.restart_requested = threading.Event()
+        self.snapshot_requested = threading.Event()
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+
+    def sample(self):
+        rss = rss_mib()
+        if rss is None:
+            return None
+        self.samples.append((time.monotonic(), rss))
+        self.peak = max(self.peak, rss)
+
+        if self.budget and rss > self.budget:
+            if not self.over_budget:
+                self.over_budget = True
+                self.alerts += 1
+                print(f"Memory alert: RSS {rss:.0f} MiB is over the {self.budget} MiB budget "
+                      f"(trend {self.trend():+.1f} MiB/h)")
+                if MEMORY_RESTART:
+                    self.restart_requested.set()
+        elif self.budget and rss < self.budget * 0.9:
+            # Re-arm only once well under budget, so a restart that did not
+            # free enough is not repeated every check.
+            self.over_budget = False
+        return rss
+
+    def trend(self):
+        # MiB per hour, least-squares over the sample window.
+        if len(self.samples) < 2:
+            return 0.0
+        t, rss = np.array(self.samples).T
+        if t[-1] == t[0]:
+            return 0.0
+        return np.polyfit(t - t[0], rss, 1)[0] * 3600
+
+    def snapshot(self):
+        # The first snapshot starts tracing; each later one reports what every
+        # pipeline stage allocated since the previous one and still holds.
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(MEMORY_TRACE_DEPTH)
+            self.baseline = take_snapshot()
+            return "Memory: allocation tracing started; request another snapshot to see growth"
+
+        snapshot = take_snapshot()
+        previous, self.baseline = self.baseline, snapshot
+        if previous is None:
+            return "Memory: baseline snapshot taken; request another snapshot to see growth"
+        return f"Memory growth since the previous snapshot:\n{allocation_growth(previous, snapshot)}"
+
+    def request_snapshot(self):
+        self.snapshot_requested.set()
+        self.wakeup.set()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.sample()
+            if self.snapshot_requested.is_set():
+                self.snapshot_requested.clear()
+                print(self.snapshot())
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+
+    def stop(self):
+        self.stopped.set()
+        self.wakeup.set()
+
+    def report(self):
+        if self.sample() is None:
+            return "Memory: RSS not available on this platform"
+        hours = (self.samples[-1][0] - self.samples[0][0]) / 3600
+        return (f"Memory: RSS {self.samples[-1][1]:.0f} MiB (peak {self.peak:.0f}), "
+                f"trend {self.trend():+.1f} MiB/h over {hours:.1f} h, "
+                f"{self.alerts} alerts, {self.restarts} inference restarts")
+
+
+memory_monitor = None
+
+
+def release_id():
+    # Profiles from different releases are told apart by the code they ran.
+    with open(__file__, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:10]
+
+
+class SamplingProfiler(threading.Thread):
+    def __init__(self, seconds=PROFILE_SECONDS, interval=PROFILE_INTERVAL_S, path=None):
+        super().__init__(name="profiler", daemon=True)
+        self.seconds = seconds
+        self.interval = interval
+        if path is None:
+            path = os.path.join(PROFILE_DIR, f"{KIOSK_ID}-{release_id()}-{datetime.now():%Y%m%d-%H%M%S}.folded")
+        self.path = path
+        self.stacks = {}
+        self.names = {}
+        self.samples = 0
+        self.stopped = threading.Event()
+
+    def sample(self, me):
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            if ident not in self.names:
+                # Named while alive; a thread may be gone by the time we write.
+                self.names.update((thread.ident, thread.name) for thread in threading.enumerate())
+            # Code objects only; labels are built once, when the file is written.
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            key = (ident, tuple(stack))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+        self.samples += 1
+
+    def run(self):
+        me = threading.get_ident()
+        start = next_at = time.perf_counter()
+        while not self.stopped.is_set() and time.perf_counter() - start < self.seconds:
+            self.sample(me)
+            # Fixed rate, not fixed sleep, so slow samples do not skew timing.
+            next_at += self.interval
+            self.stopped.wait(max(0.0, next_at - time.perf_counter()))
+        self.write()
+
+    def write(self):
+        stages = {function.__code__: PIPELINE_STAGES[qualname]
+                  for qualname, function in stage_functions().items()}
+        labels = {}
+        folded = {}
+        for (ident, stack), count in self.stacks.items():
+            # The innermost stage function decides; stage first, then thread,
+            # so one flame graph splits by both.
+            stage = next((stages[code] for code in stack if code in stages), "other")
+            frames = [stage, self.names.get(ident, str(ident))]
+            for code in reversed(stack):
+                if code not in labels:
+                    labels[code] = f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                frames.append(labels[code])
+            key = ";".join(frames)
+            folded[key] = folded.get(key, 0) + count
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "w") as f:
+            for key, count in sorted(folded.items()):
+                f.write(f"{key} {count}\n")
+        print(f"Profile: {self.samples} samples written to {self.path}")
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+profiler = None
+
+
+def start_profile(seconds=PROFILE_SECONDS):
+    global profiler
+    if profiler is not None and profiler.is_alive():
+        print(f"Profile already running, writing to {profiler.path}")
+        return profiler
+    profiler = SamplingProfiler(seconds)
+    profiler.start()
+    print(f"Profiling all threads for {seconds} s")
+    return profiler
+
+
+def build_matcher(cascade=None):
+    ids, names, embeddings = load_gallery()
+    if isinstance(embeddings, np.ndarray) and len(embeddings) >= SHARD_MIN_ROWS:
+        embeddings = ShardedGallery(embeddings)
+    if cascade is None:
+        cascade = CASCADE_ENABLED
+    return CascadeMatcher(ids, names, embeddings, load_fast_embeddings(ids) if cascade else None)
+
+
+def gallery_generation():
+    conn = sqlite3.connect(DB)
+    cur = conn.cursor()
+
+    cur.execute("SELECT value FROM meta WHERE key = 'gallery_generation'")
+    row = cur.fetchone()
+
+    conn.close()
+    return row[0] if row else 0
+
+
+def count_stale_embeddings():
+    conn = sqlite3.connect(DB)
+    cur = conn.cursor()
+
+    cur.execute("SELECT COUNT(*) FROM students WHERE embedding_version IS NOT ?", (EMBEDDING_VERSION,))
+    count = cur.fetchone()[0]
+
+    conn.close()
+    return count
+
+
+def swap_in_migrated_embeddings(cur):
+    # One transaction: running kiosks see either the whole old gallery or the whole new one.
+    cur.execute("BEGIN IMMEDIATE")
+    cur.execute("""
+        UPDATE students SET
+            embedding = (SELECT m.embedding FROM embedding_migration m
+                         WHERE m.student_id = students.student_id),
+            fast_embedding = (SELECT m.fast_embedding FROM embedding_migration m
+                              WHERE m.student_id = students.student_id),
+            fast_embedding_error = NULL,
+            embedding_version = ?,
+            embedding_q = NULL,
+            embedding_scale = NULL,
+            embedding_storage = NULL
+        WHERE student_id IN (SELECT student_id FROM embedding_migration WHERE version = ?)
+    """, (EMBEDDING_VERSION, EMBEDDING_VERSION))
+    swapped = cur.rowcount
+    cur.execute("DELETE FROM embedding_migration")
+    bump_gallery_generation(cur)
+    cur.execute("COMMIT")
+    return swapped
+
+
+def bump_gallery_generation(cur):
+    cur.execute("""
+        INSERT INTO meta (key, value) VALUES ('gallery_generation', 1)
+        ON CONFLICT(key) DO UPDATE SET value = value + 1
+    """)
+
+
+def load_sections():
+    conn = sqlite3.connect(DB)
+    cur = conn.cursor()
+
+    cur.execute("""
+        SELECT s.section_id, c.course_name, s.section_name
+        FROM sections s
+        JOIN courses c ON c.course_id = s.course_id
+        ORDER BY c.course_name, s.section_name
+    """)
+    rows = cur.fetchall()
+
+    conn.close()
+    return rows
+
+
+def load_rosters():
+    conn = sqlite3.connect(DB)
+    cur = conn.cursor()
+
+    cur.execute("SELECT section_id, student_id FROM enrollments")
+    rows = cur.fetchall()
+
+    conn.close()
+
+    rosters = {}
+    for section_id, student_id in rows:
+        rosters.setdefault(section_id, []).append(student_id)
+    return rosters
+
+
+def current_section(now=None):
+    now = now or datetime.now()
+
+    conn = sqlite3.connect(DB)
+    cur = conn.cursor()
+
+    cur.execute("""
+        SELECT section_id FROM timetable
+        WHERE weekday = ? AND start_time <= ? AND end_time > ?
+          AND (? IS NULL OR room = ?)
+        ORDER BY start_time DESC
+        LIMIT 1
+    """, (now.weekday(), now.strftime("%H:%M"), now.strftime("%H:%M"), KIOSK_ROOM, KIOSK_ROOM))
+    row = cur.fetchone()
+
+    conn.close()
+    return row[0] if row else None
+
+
+def insert_attendance_mark(cur, student_id):
+    # One date for both rows, even if the mark straddles midnight.
+    (today,) = cur.execute("SELECT DATE('now')").fetchone()
+
+    # An upsert rather than INSERT OR REPLACE: REPLACE deletes the old row
+    # without firing delete triggers, which would double-count the summaries.
+    cur.execute("""
+        INSERT INTO attendance (student_id, attendance_date, is_present)
+        VALUES (?, ?, TRUE)
+        ON CONFLICT(student_id, attendance_date) DO UPDATE SET is_present = excluded.is_present
+    """, (student_id, today))
+
+    if OUTBOX_SINK:
+        # Same transaction as the mark: either both are saved or neither is.
+        cur.execute("""
+            INSERT INTO attendance_outbox (event_key, student_id, attendance_date, marked_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(event_key) DO NOTHING
+        """, (f"{KIOSK_ID}:{student_id}:{today}", student_id, today,
+              datetime.now().astimezone().isoformat(timespec="seconds")))
+    return today
+
+
+def save_student_attendance(student_id):
+    # On the kiosk the mark goes through the home screen's connection, so the
+    # list takes it directly rather than reading today's rows back.
+    if today_attendance is not None and today_attendance.thread == threading.get_ident():
+        today_attendance.mark(student_id)
+    else:
+        conn = sqlite3.connect(DB)
+        insert_attendance_mark(conn.cursor(), student_id)
+        conn.commit()
+        conn.close()
+
+    if outbox_publisher is not None:
+        outbox_publisher.notify()
+
+
+def get_today_attendance():
+    conn = sqlite3.connect(DB)
+    cur = conn.cursor()
+
+    cur.execute("""
+        SELECT 
+            s.student_name,
+            COALESCE(a.is_present, FALSE) as is_present
+        FROM students s
+        LEFT JOIN attendance a ON (
+            s.student_id = a.student_id 
+            AND a.attendance_date = DATE('now')
+        )
+        ORDER BY s.student_name
+    """)
+
+    return cur.fetchall()
+
+
+today_attendance = None
+
+
+class TodayAttendance:
+    def __init__(self):
+        # Kept open: PRAGMA data_version on this connection changes only when
+        # some other connection commits, which makes an idle poll nearly free.
+        self.conn = sqlite3.connect(DB, isolation_level=None)
+        self.thread = threading.get_ident()
+        self.date = None
+        self.version = None
+        self.generation = None
+        self.seq = 0
+        self.names = {}
+        self.present = set()
+        # Today's marks for students deleted since, still in the daily count.
+        self.orphans = 0
+        # This kiosk's own marks, not yet returned by poll().
+        self.arrivals = []
+        self.refreshes = 0
+        self.deltas = 0
+
+    def refresh(self):
+        cur = self.conn.cursor()
+        # One read transaction, so the snapshot and the change_log position agree.
+        cur.execute("BEGIN")
+        try:
+            (self.version,) = cur.execute("PRAGMA data_version").fetchone()
+            (self.date,) = cur.execute("SELECT DATE('now')").fetchone()
+            # A push prunes the log, so it may be empty while entries up to
+            # sync_pushed_seq have been seen.
+            (self.seq,) = cur.execute("SELECT COALESCE(MAX(seq), 0) FROM change_log").fetchone()
+            self.seq = max(self.seq, get_meta(cur, "sync_pushed_seq", 0))
+            self.generation = get_meta(cur, "gallery_generation", 0)
+            self.names = dict(cur.execute("SELECT student_id, student_name FROM students"))
+            cur.execute("""
+                SELECT a.student_id FROM attendance a JOIN students s ON s.student_id = a.student_id
+                WHERE a.attendance_date = ? AND a.is_present
+            """, (self.date,))
+            self.present = {sid for (sid,) in cur}
+            (count,) = cur.execute(
+                "SELECT COALESCE(MAX(present_count), 0) FROM attendance_daily WHERE attendance_date = ?",
+                (self.date,)).fetchone()
+            self.orphans = count - len(self.present)
+        finally:
+            cur.execute("COMMIT")
+        self.arrivals = []
+        self.refreshes += 1
+
+    def mark(self, student_id):
+        # Commits on this connection leave its data_version alone, so only
+        # other writers' commits send poll() back to the database.
+        cur = self.conn.cursor()
+        cur.execute("BEGIN")
+        try:
+            today = insert_attendance_mark(cur, student_id)
+        except BaseException:
+            cur.execute("ROLLBACK")
+            raise
+        cur.execute("COMMIT")
+
+        if today != self.date or student_id in self.present:
+            return
+        if student_id not in self.names:
+            # Registered since the last look: let poll() read the name.
+            self.version = None
+            return
+        self.present.add(student_id)
+        self.arrivals.append((self.names[student_id], student_id))
+
+    def rows(self):
+        return sorted((self.names.get(sid, sid), sid) for sid in self.present)
+
+    def poll(self):
+        # The students who arrived since the last poll, or None when the state
+        # was rebuilt (new day, removals, unexplained changes) and every row
+        # should be redrawn.
+        cur = self.conn.cursor()
+        (today,) = cur.execute("SELECT DATE('now')").fetchone()
+        (version,) = cur.execute("PRAGMA data_version").fetchone()
+        if today != self.date:
+            self.refresh()
+            return None
+        arrivals, self.arrivals = self.arrivals, []
+        if version == self.version:
+            return sorted(arrivals)
+        if not SYNC_CENTRAL:
+            arrived = self.reread_present()
+            return None if arrived is None else sorted(arrivals + arrived)
+
+        cur.execute("BEGIN")
+        try:
+            (self.version,) = cur.execute("PRAGMA data_version").fetchone()
+            changes = cur.execute("""
+                SELECT seq, kind, student_id, attendance_date FROM change_log
+                WHERE seq > ? ORDER BY seq LIMIT ?
+            """, (self.seq, DASHBOARD_MAX_DELTA + 1)).fetchall()
+            # A push prunes the log; if it got past entries we never read, start over.
+            if (len(changes) > DASHBOARD_MAX_DELTA or get_meta(cur, "sync_pushed_seq", 0) > self.seq
+                    or get_meta(cur, "gallery_generation", 0) != self.generation):
+                changes = None
+            else:
+                students = {sid for _, kind, sid, _ in changes if kind == "student"}
+                marked = {sid for _, kind, sid, date in changes if kind == "attendance" and date == self.date}
+                renamed, attended = {}, set()
+                if students:
+                    marks = ",".join("?" * len(students))
+                    renamed = dict(cur.execute(
+                        f"SELECT student_id, student_name FROM students WHERE student_id IN ({marks})",
+                        list(students)))
+                if marked:
+                    marks = ",".join("?" * len(marked))
+                    cur.execute(f"""
+                        SELECT a.student_id FROM attendance a JOIN students s ON s.student_id = a.student_id
+                        WHERE a.attendance_date = ? AND a.is_present AND a.student_id IN ({marks})
+                    """, [self.date, *marked])
+                    attended = {sid for (sid,) in cur}
+                (count,) = cur.execute(
+                    "SELECT COALESCE(MAX(present_count), 0) FROM attendance_daily WHERE attendance_date = ?",
+                    (self.date,)).fetchone()
+        finally:
+            cur.execute("COMMIT")
+
+        if changes is None:
+            self.refresh()
+            return None
+        if changes:
+            self.seq = changes[-1][0]
+
+        deleted = set()
+        for sid in students:
+            if sid in renamed:
+                self.names[sid] = renamed[sid]
+            else:
+                self.names.pop(sid, None)
+                deleted.add(sid)
+        arrived = attended - self.present
+        gone = (marked - attended) & self.present
+        # A deleted student's mark stays in the daily count but leaves the list.
+        removed = (deleted - marked) & self.present
+        self.orphans += len(removed)
+        self.present |= arrived
+        self.present -= gone | removed
+        self.deltas += 1
+
+        # Writes that bypass change_log (pulled sync rows, manual edits) still
+        # move the trigger-maintained daily count.
+        if count != len(self.present) + self.orphans:
+            self.refresh()
+            return None
+        if gone or removed or (students & self.present) - arrived:
+            return None
+        return sorted(arrivals + [(self.names.get(sid, sid), sid) for sid in arrived])
+
+    def reread_present(self):
+        # change_log is only kept while sync is on. Without it, read today's
+        # present students again; the date index keeps that to one small range.
+        cur = self.conn.cursor()
+        cur.execute("BEGIN")
+        try:
+            (self.version,) = cur.execute("PRAGMA data_version").fetchone()
+            present = dict(cur.execute("""
+                SELECT a.student_id, s.student_name
+                FROM attendance a JOIN students s ON s.student_id = a.student_id
+                WHERE a.attendance_date = ? AND a.is_present
+            """, (self.date,)))
+        finally:
+            cur.execute("COMMIT")
+
+        arrived = present.keys() - self.present
+        gone = self.present - present.keys()
+        renamed = any(self.names.get(sid, sid) != present[sid] for sid in self.present - gone)
+        self.names.update(present)
+        self.present = set(present)
+        self.deltas += 1
+        if gone or renamed:
+            return None
+        return [(present[sid], sid) for sid in arrived]
+
+    def close(self):
+        global today_attendance
+        if today_attendance is self:
+            today_attendance = None
+        self.conn.close()
+
+
+def month_ranges(start, end):
+    # Split [start, end] into whole calendar months and the partial months at either end.
+    full, partial = [], []
+    year, month = int(start[:4]), int(start[5:7])
+    while f"{year:04d}-{month:02d}" <= end[:7]:
+        first = f"{year:04d}-{month:02d}-01"
+        last = f"{year:04d}-{month:02d}-{calendar.monthrange(year, month)[1]:02d}"
+        if start <= first and last <= end:
+            full.append(first[:7])
+        else:
+            partial.append((max(start, first), min(end, last)))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return full, partial
+
 
-        return crop
-    except:
-        return None
+def class_days(cur, start, end):
+    cur.execute("""
+        SELECT COUNT(*) FROM attendance_daily
+        WHERE attendance_date BETWEEN ? AND ? AND present_count > 0
+    """, (start, end))
+    return cur.fetchone()[0]
 
 
-def get_embedding(face):
-    try:
-        face_rgb = cv2.cvtColor(face, cv2.COLOR_BGR2RGB)
+def student_attendance_percentages(start, end):
+    conn = sqlite3.connect(DB)
+    cur = conn.cursor()
 
-        emb = DeepFace.represent(
-            face_rgb,
-            model_name="ArcFace",
-            detector_backend="skip"
-        )[0]["embedding"]
+    present = {}
+    full, partial = month_ranges(start, end)
+    if full:
+        cur.execute("""
+            SELECT student_id, SUM(present_days) FROM attendance_monthly
+            WHERE month BETWEEN ? AND ?
+            GROUP BY student_id
+        """, (full[0], full[-1]))
+        present.update(cur.fetchall())
+    for lo, hi in partial:
+        # A day can be in both an archive and the hot table (a late synced
+        # mark); count it once.
+        marked = set()
+        for table in attendance_tables(conn, lo, hi):
+            cur.execute(f"""
+                SELECT student_id, attendance_date FROM {table}
+                WHERE attendance_date BETWEEN ? AND ? AND is_present
+            """, (lo, hi))
+            marked.update(cur.fetchall())
+        for sid, _ in marked:
+            present[sid] = present.get(sid, 0) + 1
+
+    days = class_days(cur, start, end)
+    cur.execute("SELECT student_id, student_name FROM students ORDER BY student_name")
+    students = cur.fetchall()
 
-        return emb
-    except:
-        return None
+    conn.close()
 
+    rows = []
+    for sid, name in students:
+        count = present.get(sid, 0)
+        rows.append((sid, name, count, days, round(100.0 * count / days, 1) if days else 0.0))
+    return rows
 
-def init_db():
+
+def daily_attendance_counts(start, end):
     conn = sqlite3.connect(DB)
     cur = conn.cursor()
 
     cur.execute("""
-        CREATE TABLE IF NOT EXISTS students (
-            student_id TEXT PRIMARY KEY,
-            student_name TEXT NOT NULL,
-            image BLOB NOT NULL,
-            embedding BLOB NOT NULL
-        );
-    """)
-
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS attendance (
-            student_id TEXT REFERENCES students(student_id),
-            attendance_date TEXT DEFAULT (DATE('now')),
-            is_present BOOLEAN DEFAULT FALSE,
-            PRIMARY KEY (student_id, attendance_date)
-        );
-    """)
+        SELECT attendance_date, present_count FROM attendance_daily
+        WHERE attendance_date BETWEEN ? AND ? AND present_count > 0
+        ORDER BY attendance_date
+    """, (start, end))
+    rows = cur.fetchall()
 
-    conn.commit()
     conn.close()
+    return rows
 
 
-def save_student_to_db(id, name, image, embedding):
-    embedding = np.array(embedding, dtype=np.float32).tobytes()
-
+def attendance_matrix(start, end):
     conn = sqlite3.connect(DB)
     cur = conn.cursor()
 
     cur.execute("""
-        INSERT INTO students (student_id, student_name, image, embedding)
-        VALUES (?, ?, ?, ?);
-    """, (id, name, image, embedding))
+        SELECT attendance_date FROM attendance_daily
+        WHERE attendance_date BETWEEN ? AND ? AND present_count > 0
+        ORDER BY attendance_date
+    """, (start, end))
+    dates = [row[0] for row in cur.fetchall()]
+    column = {date: i for i, date in enumerate(dates)}
+
+    marks = {}
+    for table in attendance_tables(conn, start, end):
+        cur.execute(f"""
+            SELECT student_id, attendance_date FROM {table}
+            WHERE attendance_date BETWEEN ? AND ? AND is_present
+        """, (start, end))
+        for sid, date in cur:
+            marks.setdefault(sid, set()).add(column[date])
+
+    cur.execute("SELECT student_id, student_name FROM students ORDER BY student_name")
+    students = cur.fetchall()
 
-    conn.commit()
     conn.close()
 
+    rows = []
+    for sid, name in students:
+        present = marks.get(sid, ())
+        rows.append((sid, name, [i in present for i in range(len(dates))]))
+    return dates, rows
+
+
+def period_months():
+    return list(range(1, 13)) if ARCHIVE_PERIOD == "month" else sorted(TERM_START_MONTHS)
+
+
+def period_start(date):
+    year, month = int(date[:4]), int(date[5:7])
+    months = period_months()
+    earlier = [m for m in months if m <= month]
+    if not earlier:
+        return f"{year - 1:04d}-{months[-1]:02d}-01"
+    return f"{year:04d}-{earlier[-1]:02d}-01"
+
+
+def next_period_start(date):
+    year, month = int(date[:4]), int(date[5:7])
+    months = period_months()
+    later = [m for m in months if m > month]
+    if not later:
+        return f"{year + 1:04d}-{months[0]:02d}-01"
+    return f"{year:04d}-{later[0]:02d}-01"
+
+
+def archive_path(start, end):
+    # <database>-<first day>_<first day of next period>.db: the range is in the
+    # name so files stay routable if ARCHIVE_PERIOD changes later, and the
+    # database name keeps bench databases away from the real archive.
+    return os.path.join(ARCHIVE_DIR, f"{Path(DB).stem}-{start}_{end}.db")
+
+
+def archive_files():
+    if not ARCHIVE_DIR or not os.path.isdir(ARCHIVE_DIR):
+        return []
+    prefix = f"{Path(DB).stem}-"
+    files = []
+    for path in sorted(Path(ARCHIVE_DIR).glob("*_*.db")):
+        if path.name.startswith(prefix):
+            start, _, end = path.stem[len(prefix):].partition("_")
+            files.append((str(path), start, end))
+    return files
+
+
+def archive_for(date):
+    for path, start, end in archive_files():
+        if start <= date < end:
+            return path
+    return None
+
+
+def attendance_tables(conn, start, end):
+    # Every table that can hold attendance for [start, end]: overlapping
+    # archives oldest first, each attached only while the caller reads it,
+    # then the hot table, which also takes late synced marks for old dates.
+    # Callers must finish reading a table before asking for the next.
+    for path, lo, hi in archive_files():
+        if lo <= end and start < hi:
+            conn.execute("ATTACH DATABASE ? AS archive", (path,))
+            try:
+                yield "archive.attendance"
+            finally:
+                conn.execute("DETACH DATABASE archive")
+    yield "main.attendance"
 
-def load_all_students_faces():
+
+def archive_due(today=None):
+    if not ARCHIVE_DIR:
+        return False
     conn = sqlite3.connect(DB)
     cur = conn.cursor()
+    today = today or cur.execute("SELECT DATE('now')").fetchone()[0]
+    cur.execute("SELECT EXISTS (SELECT 1 FROM attendance WHERE attendance_date < ?)", (period_start(today),))
+    due = cur.fetchone()[0]
+    conn.close()
+    return bool(due)
+
+
+def archive_period(conn, start, end):
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    path = archive_path(start, end)
+    cur = conn.cursor()
+    cur.execute("ATTACH DATABASE ? AS archive", (path,))
+    try:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS archive.attendance (
+                student_id TEXT,
+                attendance_date TEXT,
+                is_present BOOLEAN DEFAULT FALSE,
+                PRIMARY KEY (student_id, attendance_date)
+            );
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS archive.idx_attendance_date
+            ON attendance (attendance_date, student_id)
+        """)
 
-    cur.execute("SELECT student_id, student_name, embedding FROM students")
-    rows = cur.fetchall()
+        # Main is in WAL mode, so SQLite cannot commit main and the archive
+        # atomically. Copy and commit the archive first; only rows the archive
+        # is then known to hold are deleted from main, in a second transaction.
+        # A crash in between leaves rows in both places, and re-running merges
+        # them: the upsert lets presence win, as in sync.
+        cur.execute("BEGIN IMMEDIATE")
+        cur.execute("""
+            INSERT INTO archive.attendance (student_id, attendance_date, is_present)
+            SELECT student_id, attendance_date, is_present FROM main.attendance
+            WHERE attendance_date >= ? AND attendance_date < ?
+            ON CONFLICT(student_id, attendance_date) DO UPDATE SET
+                is_present = MAX(is_present, excluded.is_present)
+        """, (start, end))
+        conn.commit()
+
+        cur.execute("BEGIN IMMEDIATE")
+        # Moving rows is not a local change for sync to push.
+        set_meta(cur, "applying_sync", 1)
+        (expected,) = cur.execute("""
+            SELECT COUNT(*) FROM main.attendance
+            WHERE attendance_date >= ? AND attendance_date < ?
+        """, (start, end)).fetchone()
+        moved = cur.execute("""
+            DELETE FROM main.attendance
+            WHERE attendance_date >= ? AND attendance_date < ?
+              AND EXISTS (SELECT 1 FROM archive.attendance x
+                          WHERE x.student_id = attendance.student_id
+                            AND x.attendance_date = attendance.attendance_date
+                            AND x.is_present >= attendance.is_present)
+        """, (start, end)).rowcount
+        if moved != expected:
+            # Marks synced in since the copy stay hot until the next run.
+            print(f"Archive {path}: {expected - moved} rows changed during the copy, kept in {DB}")
+
+        # The delete triggers just emptied the summaries for this period; the
+        # summaries stay in the hot database, so rebuild them from the archive
+        # plus whatever is still hot.
+        period = f"""
+            SELECT student_id, attendance_date FROM archive.attendance WHERE is_present
+            UNION
+            SELECT student_id, attendance_date FROM main.attendance
+            WHERE is_present AND attendance_date >= :start AND attendance_date < :end
+        """
+        cur.execute("DELETE FROM attendance_daily WHERE attendance_date >= ? AND attendance_date < ?",
+                    (start, end))
+        cur.execute(f"""
+            INSERT INTO attendance_daily (attendance_date, present_count)
+            SELECT attendance_date, COUNT(*) FROM ({period})
+            GROUP BY attendance_date
+        """, {"start": start, "end": end})
+        cur.execute("DELETE FROM attendance_monthly WHERE month >= ? AND month < ?", (start[:7], end[:7]))
+        cur.execute(f"""
+            INSERT INTO attendance_monthly (student_id, month, present_days)
+            SELECT student_id, substr(attendance_date, 1, 7), COUNT(*) FROM ({period})
+            GROUP BY student_id, substr(attendance_date, 1, 7)
+        """, {"start": start, "end": end})
+        cur.execute("DELETE FROM meta WHERE key = 'applying_sync'")
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        cur.execute("DETACH DATABASE archive")
+    return path, moved
+
+
+def archive_attendance(today=None):
+    conn = sqlite3.connect(DB)
+    cur = conn.cursor()
+    today = today or cur.execute("SELECT DATE('now')").fetchone()[0]
+    cutoff = period_start(today)
+
+    moved = []
+    start = ""
+    while True:
+        # Rows left behind by a period (changed mid-copy) wait for the next run.
+        cur.execute("SELECT MIN(attendance_date) FROM attendance WHERE attendance_date >= ? AND attendance_date < ?",
+                    (start, cutoff))
+        oldest = cur.fetchone()[0]
+        if oldest is None:
+            break
+        start = period_start(oldest)
+        end = next_period_start(start)
+        moved.append(archive_period(conn, start, end))
+        start = end
 
     conn.close()
+    return moved
 
-    ids, names, embeddings = [], [], []
 
-    for sid, name, emb_bytes in rows:
-        emb = np.frombuffer(emb_bytes, dtype=np.float32)
-        ids.append(sid)
-        names.append(name)
-        embeddings.append(emb)
+class CsvExportSink:
+    def __init__(self, path, columns, types):
+        self.file = open(path, "w", newline="", encoding="utf-8")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(columns)
+        self.flags = [t == "bool" for t in types]
 
-    return ids, names, np.vstack(embeddings)
+    def write(self, columns):
+        columns = [np.asarray(col, dtype=np.uint8) if flag else col
+                   for col, flag in zip(columns, self.flags)]
+        self.writer.writerows(zip(*columns))
 
+    def close(self):
+        self.file.close()
 
-def save_student_attendance(student_id):
+
+class ArrowExportSink:
+    def __init__(self, path, columns, types):
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise RuntimeError("Parquet and Arrow export need pyarrow (pip install pyarrow)")
+        self.pa = pa
+        self.schema = pa.schema([(name, pa.bool_() if t == "bool" else pa.string())
+                                 for name, t in zip(columns, types)])
+        if path.endswith(".parquet"):
+            import pyarrow.parquet as pq
+            self.writer = pq.ParquetWriter(path, self.schema)
+        else:
+            self.writer = pa.ipc.new_file(path, self.schema)
+
+    def write(self, columns):
+        arrays = [self.pa.array(np.asarray(col, dtype=bool) if field.type == self.pa.bool_() else col,
+                                type=field.type)
+                  for col, field in zip(columns, self.schema)]
+        self.writer.write_batch(self.pa.record_batch(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def open_export_sink(path, columns, types):
+    if path.endswith((".parquet", ".arrow", ".feather")):
+        return ArrowExportSink(path, columns, types)
+    return CsvExportSink(path, columns, types)
+
+
+def attendance_row_chunks(cur, start, end, chunk=EXPORT_CHUNK):
+    total = 0
+    for table in attendance_tables(cur.connection, start, end):
+        cur.execute(f"SELECT COUNT(*) FROM {table} WHERE attendance_date BETWEEN ? AND ?", (start, end))
+        total += cur.fetchone()[0]
+    columns = ["student_id", "student_name", "attendance_date", "is_present"]
+    yield columns, ["str", "str", "str", "bool"], total
+
+    # Archives come oldest first and before the hot table, so rows stay in
+    # date order across files.
+    for table in attendance_tables(cur.connection, start, end):
+        cur.execute(f"""
+            SELECT a.student_id, s.student_name, a.attendance_date, a.is_present
+            FROM {table} a
+            LEFT JOIN students s ON s.student_id = a.student_id
+            WHERE a.attendance_date BETWEEN ? AND ?
+            ORDER BY a.attendance_date, a.student_id
+        """, (start, end))
+        while True:
+            rows = cur.fetchmany(chunk)
+            if not rows:
+                break
+            yield len(rows), list(zip(*rows))
+
+
+def attendance_matrix_chunks(cur, start, end, chunk=EXPORT_CHUNK):
+    # attendance_matrix() for exports: one block of students at a time, each
+    # fetched through the primary key, so only chunk x dates cells are resident.
+    cur.execute("""
+        SELECT attendance_date FROM attendance_daily
+        WHERE attendance_date BETWEEN ? AND ? AND present_count > 0
+        ORDER BY attendance_date
+    """, (start, end))
+    dates = [row[0] for row in cur.fetchall()]
+    column = {date: i for i, date in enumerate(dates)}
+    cur.execute("SELECT COUNT(*) FROM students")
+    yield ["student_id", "student_name", *dates], ["str", "str"] + ["bool"] * len(dates), cur.fetchone()[0]
+
+    read = cur.connection.cursor()
+    last = ""
+    while True:
+        cur.execute("""
+            SELECT student_id, student_name FROM students
+            WHERE student_id > ? ORDER BY student_id LIMIT ?
+        """, (last, chunk))
+        students = cur.fetchall()
+        if not students:
+            return
+        last = students[-1][0]
+
+        row = {sid: i for i, (sid, _) in enumerate(students)}
+        present = np.zeros((len(students), len(dates)), dtype=bool)
+        marks = ",".join("?" * len(students))
+        for table in attendance_tables(cur.connection, start, end):
+            read.execute(f"""
+                SELECT student_id, attendance_date FROM {table}
+                WHERE student_id IN ({marks}) AND attendance_date BETWEEN ? AND ? AND is_present
+            """, (*row, start, end))
+            for sid, date in read:
+                present[row[sid], column[date]] = True
+
+        ids, names = zip(*students)
+        yield len(students), [ids, names, *present.T]
+
+
+def export_attendance(path, start, end, matrix=False, progress=None, cancelled=None):
     conn = sqlite3.connect(DB)
     cur = conn.cursor()
+    chunks = (attendance_matrix_chunks if matrix else attendance_row_chunks)(cur, start, end)
+
+    columns, types, total = next(chunks)
+    sink = open_export_sink(path, columns, types)
+    done = 0
+    try:
+        for count, data in chunks:
+            if cancelled is not None and cancelled():
+                break
+            sink.write(data)
+            done += count
+            if progress is not None:
+                progress(done, total)
+    finally:
+        sink.close()
+        conn.close()
+    return done
+
+
+def get_meta(cur, key, default=None):
+    cur.execute("SELECT value FROM meta WHERE key = ?", (key,))
+    row = cur.fetchone()
+    return row[0] if row else default
+
+
+def set_meta(cur, key, value):
+    cur.execute("""
+        INSERT INTO meta (key, value) VALUES (?, ?)
+        ON CONFLICT(key) DO UPDATE SET value = excluded.value
+    """, (key, value))
+
 
+def student_payload(cur, student_id):
     cur.execute("""
-        INSERT OR REPLACE INTO attendance (student_id, is_present)
-        VALUES (?, TRUE)
+        SELECT s.student_name, s.embedding, s.fast_embedding, s.embedding_version,
+               i.thumbnail, i.original
+        FROM students s
+        LEFT JOIN student_images i ON i.student_id = s.student_id
+        WHERE s.student_id = ?
     """, (student_id,))
+    return cur.fetchone()
+
+
+def attendance_payload(cur, student_id, attendance_date):
+    cur.execute("SELECT is_present FROM attendance WHERE student_id = ? AND attendance_date = ?",
+                (student_id, attendance_date))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def apply_student(cur, student_id, payload):
+    if payload is None:
+        cur.execute("DELETE FROM student_images WHERE student_id = ?", (student_id,))
+        cur.execute("DELETE FROM students WHERE student_id = ?", (student_id,))
+        return
+
+    name, embedding, fast_embedding, version, thumbnail, original = payload
+    cur.execute("""
+        INSERT INTO students (student_id, student_name, embedding, fast_embedding, embedding_version)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(student_id) DO UPDATE SET
+            student_name = excluded.student_name,
+            embedding = excluded.embedding,
+            fast_embedding = excluded.fast_embedding,
+            embedding_version = excluded.embedding_version
+    """, (student_id, name, embedding, fast_embedding, version))
+    if thumbnail is not None:
+        cur.execute("""
+            INSERT INTO student_images (student_id, thumbnail, original) VALUES (?, ?, ?)
+            ON CONFLICT(student_id) DO UPDATE SET
+                thumbnail = excluded.thumbnail, original = excluded.original
+        """, (student_id, thumbnail, original))
+
+
+def apply_attendance(cur, student_id, attendance_date, is_present):
+    if is_present is None:
+        cur.execute("DELETE FROM attendance WHERE student_id = ? AND attendance_date = ?",
+                    (student_id, attendance_date))
+        return
+
+    # Two kiosks marking the same student on the same day: presence wins, so
+    # the merge gives the same answer whichever kiosk syncs first.
+    cur.execute("""
+        INSERT INTO attendance (student_id, attendance_date, is_present) VALUES (?, ?, ?)
+        ON CONFLICT(student_id, attendance_date) DO UPDATE SET
+            is_present = MAX(is_present, excluded.is_present)
+        WHERE excluded.is_present > is_present
+    """, (student_id, attendance_date, is_present))
+
+
+def apply_change(cur, change):
+    kind, student_id, attendance_date, payload = change
+    if kind == "student":
+        apply_student(cur, student_id, payload)
+    else:
+        apply_attendance(cur, student_id, attendance_date, payload)
+
+
+class SqliteCentralStore:
+    # Stand-in for the central server: a SQLite file with the shared tables and
+    # a central_log that numbers every applied change. A networked store only
+    # has to offer the same push() and pull().
+    def __init__(self, path):
+        self.path = path
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        cur = conn.cursor()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS students (
+                student_id TEXT PRIMARY KEY,
+                student_name TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                fast_embedding BLOB,
+                embedding_version TEXT
+            );
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS student_images (
+                student_id TEXT PRIMARY KEY,
+                thumbnail BLOB NOT NULL,
+                original BLOB
+            );
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS attendance (
+                student_id TEXT,
+                attendance_date TEXT,
+                is_present BOOLEAN DEFAULT FALSE,
+                PRIMARY KEY (student_id, attendance_date)
+            );
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS central_log (
+                version INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                student_id TEXT NOT NULL,
+                attendance_date TEXT,
+                origin TEXT NOT NULL
+            );
+        """)
+        return conn
+
+    def push(self, kiosk, changes):
+        conn = self.connect()
+        cur = conn.cursor()
+        try:
+            cur.execute("BEGIN IMMEDIATE")
+            for change in changes:
+                apply_change(cur, change)
+                kind, student_id, attendance_date, _ = change
+                cur.execute("""
+                    INSERT INTO central_log (kind, student_id, attendance_date, origin)
+                    VALUES (?, ?, ?, ?)
+                """, (kind, student_id, attendance_date, kiosk))
+            cur.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def pull(self, kiosk, since, limit=SYNC_BATCH):
+        conn = self.connect()
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+                SELECT version, kind, student_id, attendance_date, origin FROM central_log
+                WHERE version > ? ORDER BY version LIMIT ?
+            """, (since, limit))
+            rows = cur.fetchall()
+
+            # Current state of each changed key, skipping the puller's own changes.
+            keys = OrderedDict()
+            for version, kind, student_id, attendance_date, origin in rows:
+                if origin != kiosk:
+                    keys[(kind, student_id, attendance_date)] = None
+                    keys.move_to_end((kind, student_id, attendance_date))
+
+            changes = []
+            for kind, student_id, attendance_date in keys:
+                if kind == "student":
+                    payload = student_payload(cur, student_id)
+                else:
+                    payload = attendance_payload(cur, student_id, attendance_date)
+                changes.append((kind, student_id, attendance_date, payload))
+            return changes, rows[-1][0] if rows else since
+        finally:
+            conn.close()
+
+
+def sync_once(store, kiosk=KIOSK_ID, batch=SYNC_BATCH):
+    conn = sqlite3.connect(DB, timeout=10, isolation_level=None)
+    cur = conn.cursor()
+    pushed = pulled = 0
+
+    try:
+        # Push first, so our own edits reach the central store before we pull
+        # anything that might overwrite them.
+        while True:
+            since = get_meta(cur, "sync_pushed_seq", 0)
+            cur.execute("""
+                SELECT seq, kind, student_id, attendance_date FROM change_log
+                WHERE seq > ? ORDER BY seq LIMIT ?
+            """, (since, batch))
+            rows = cur.fetchall()
+            if not rows:
+                break
+
+            # Several changes to one row collapse to its current state.
+            keys = OrderedDict()
+            for _, kind, student_id, attendance_date in rows:
+                keys[(kind, student_id, attendance_date)] = None
+                keys.move_to_end((kind, student_id, attendance_date))
+            changes = []
+            for kind, student_id, attendance_date in keys:
+                if kind == "student":
+                    payload = student_payload(cur, student_id)
+                else:
+                    payload = attendance_payload(cur, student_id, attendance_date)
+                changes.append((kind, student_id, attendance_date, payload))
+
+            store.push(kiosk, changes)  # raises while offline; the cursor stays put
+            cur.execute("BEGIN IMMEDIATE")
+            set_meta(cur, "sync_pushed_seq", rows[-1][0])
+            cur.execute("DELETE FROM change_log WHERE seq <= ?", (rows[-1][0],))
+            cur.execute("COMMIT")
+            pushed += len(changes)
+
+        gallery_changed = False
+        while True:
+            since = get_meta(cur, "sync_pulled_version", 0)
+            changes, version = store.pull(kiosk, since, batch)
+            if version == since:
+                break
+
+            cur.execute("BEGIN IMMEDIATE")
+            set_meta(cur, "applying_sync", 1)
+            for change in changes:
+                apply_change(cur, change)
+                if change[0] == "student":
+                    gallery_changed = True
+                    cur.execute("""
+                        UPDATE students SET embedding_q = NULL, embedding_scale = NULL,
+                            embedding_storage = NULL
+                        WHERE student_id = ?
+                    """, (change[1],))
+            cur.execute("DELETE FROM meta WHERE key = 'applying_sync'")
+            set_meta(cur, "sync_pulled_version", version)
+            if gallery_changed:
+                bump_gallery_generation(cur)
+            cur.execute("COMMIT")
+            pulled += len(changes)
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        conn.close()
+
+    return pushed, pulled
+
+
+class SyncWorker(threading.Thread):
+    def __init__(self, store, interval=SYNC_INTERVAL_S):
+        super().__init__(name="sync", daemon=True)
+        self.store = store
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                pushed, pulled = sync_once(self.store)
+                if pushed or pulled:
+                    print(f"Sync: pushed {pushed}, pulled {pulled} changes")
+            except (sqlite3.Error, OSError) as e:
+                # Offline: everything stays in change_log until the next attempt.
+                print(f"Sync skipped, central store unavailable: {e}")
+            self.stopped.wait(self.interval)
 
+    def stop(self):
+        self.stopped.set()
+
+
+class HttpOutboxSink:
+    def __init__(self, url, timeout=OUTBOX_TIMEOUT_S):
+        self.url = url
+        self.timeout = timeout
+
+    def post(self, body, key):
+        request = urllib.request.Request(self.url, data=body, method="POST", headers={
+            "Content-Type": "application/json",
+            "Idempotency-Key": key,
+        })
+        # Anything but 2xx raises HTTPError and the batch is retried.
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+    async def send(self, events):
+        body = json.dumps({"kiosk": KIOSK_ID, "events": events}).encode()
+        key = hashlib.sha256("\n".join(event["key"] for event in events).encode()).hexdigest()
+        await asyncio.to_thread(self.post, body, key)
+
+
+class FileOutboxSink:
+    def __init__(self, path):
+        self.path = path
+
+    def append(self, events):
+        with open(self.path, "a") as f:
+            for event in events:
+                f.write(json.dumps(event) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    async def send(self, events):
+        await asyncio.to_thread(self.append, events)
+
+
+def open_outbox_sink(target):
+    if target.startswith(("http://", "https://")):
+        return HttpOutboxSink(target)
+    return FileOutboxSink(target)
+
+
+def due_outbox_events(limit=OUTBOX_BATCH):
+    conn = sqlite3.connect(DB)
+    rows = conn.execute("""
+        SELECT id, event_key, student_id, attendance_date, marked_at, attempts
+        FROM attendance_outbox
+        WHERE delivered_at IS NULL AND next_attempt <= ?
+        ORDER BY id
+        LIMIT ?
+    """, (time.time(), limit)).fetchall()
+    conn.close()
+    return rows
+
+
+def finish_outbox_batch(ids, attempts, error=None):
+    conn = sqlite3.connect(DB)
+    now = time.time()
+    if error is None:
+        conn.executemany("UPDATE attendance_outbox SET delivered_at = ?, last_error = NULL WHERE id = ?",
+                         [(now, id_) for id_ in ids])
+    else:
+        # Exponential backoff with jitter, so kiosks that lost the same
+        # endpoint do not all come back at the same moment.
+        delay = min(OUTBOX_BACKOFF_MAX_S, OUTBOX_BACKOFF_S * 2 ** attempts) * random.uniform(0.5, 1.0)
+        conn.executemany("""
+            UPDATE attendance_outbox SET attempts = attempts + 1, next_attempt = ?, last_error = ?
+            WHERE id = ?
+        """, [(now + delay, error, id_) for id_ in ids])
     conn.commit()
     conn.close()
 
 
-def get_today_attendance():
+def prune_outbox():
     conn = sqlite3.connect(DB)
-    cur = conn.cursor()
+    conn.execute("DELETE FROM attendance_outbox WHERE delivered_at < ?",
+                 (time.time() - OUTBOX_RETENTION_DAYS * 86400,))
+    conn.commit()
+    conn.close()
 
-    cur.execute("""
-        SELECT 
-            s.student_name,
-            COALESCE(a.is_present, FALSE) as is_present
-        FROM students s
-        LEFT JOIN attendance a ON (
-            s.student_id = a.student_id 
-            AND a.attendance_date = DATE('now')
-        )
-        ORDER BY s.student_name
-    """)
 
-    return cur.fetchall()
+def outbox_status():
+    conn = sqlite3.connect(DB)
+    pending, failing, oldest = conn.execute("""
+        SELECT COUNT(*), SUM(attempts > 0), MIN(marked_at)
+        FROM attendance_outbox WHERE delivered_at IS NULL
+    """).fetchone()
+    (delivered,) = conn.execute(
+        "SELECT COUNT(*) FROM attendance_outbox WHERE delivered_at IS NOT NULL").fetchone()
+    error = conn.execute("""
+        SELECT last_error FROM attendance_outbox
+        WHERE delivered_at IS NULL AND last_error IS NOT NULL ORDER BY id DESC LIMIT 1
+    """).fetchone()
+    conn.close()
+    return pending, failing or 0, oldest, delivered, error[0] if error else None
+
+
+class OutboxPublisher(threading.Thread):
+    def __init__(self, sink, interval=OUTBOX_INTERVAL_S, batch=OUTBOX_BATCH):
+        super().__init__(name="outbox", daemon=True)
+        self.sink = sink
+        self.interval = interval
+        self.batch = batch
+        self.delivered = 0
+        self.failures = 0
+        self.loop = None
+        self.wakeup = None
+        self.stopped = False
+        self.ready = threading.Event()
+
+    def run(self):
+        asyncio.run(self.main())
+
+    async def main(self):
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        self.ready.set()
+        await asyncio.to_thread(prune_outbox)
+        while not self.stopped:
+            sent = await self.deliver_once()
+            if sent == self.batch:
+                continue  # backlog: keep going without waiting
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+
+    async def deliver_once(self):
+        try:
+            rows = await asyncio.to_thread(due_outbox_events, self.batch)
+        except sqlite3.Error as e:
+            print(f"Outbox: cannot read queue: {e}")
+            return 0
+        if not rows:
+            return 0
+
+        ids = [row[0] for row in rows]
+        events = [{"key": key, "student_id": student_id, "date": date, "present": True, "marked_at": marked_at}
+                  for _, key, student_id, date, marked_at, _ in rows]
+        attempts = max(row[5] for row in rows)
+        try:
+            await self.sink.send(events)
+        except Exception as e:
+            # Network, HTTP and disk errors alike: the batch stays queued.
+            self.failures += 1
+            await asyncio.to_thread(finish_outbox_batch, ids, attempts, f"{type(e).__name__}: {e}")
+            return 0
+        await asyncio.to_thread(finish_outbox_batch, ids, attempts)
+        self.delivered += len(ids)
+        return len(ids)
+
+    def notify(self):
+        # Called from the GUI thread after a mark; never blocks it.
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    def stop(self, timeout=OUTBOX_TIMEOUT_S):
+        self.stopped = True
+        self.notify()
+        self.join(timeout)
+
+    def report(self):
+        return f"Outbox: {self.delivered} attendance events delivered, {self.failures} failed attempts"
+
+
+outbox_publisher = None
+
+
+class CameraDevice:
+    def __init__(self, index):
+        self.index = index
+        self.frame = None
+        self.seq = 0
+        self.subscribers = 0
+        self.idle_since = time.monotonic()
+        self.connected = threading.Event()
+        self.attempted = threading.Event()
+        self.lock = threading.Lock()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name=f"camera-{index}", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        cap = None
+        failures = 0
+        while self.running:
+            if cap is None:
+                cap = cv2.VideoCapture(self.index)
+                if not cap.isOpened():
+                    cap.release()
+                    cap = None
+                    self.attempted.set()
+                    time.sleep(CAMERA_RETRY_S)
+                    continue
+                failures = 0
+                self.connected.set()
+                self.attempted.set()
+
+            ret, frame = cap.read()
+            if not ret:
+                # Unplugged or wedged: drop the handle and reopen from scratch.
+                failures += 1
+                if failures >= CAMERA_MAX_FAILURES:
+                    self.connected.clear()
+                    cap.release()
+                    cap = None
+                continue
+            failures = 0
+
+            frame.flags.writeable = False  # shared by every subscriber
+            with self.lock:
+                self.frame = frame
+                self.seq += 1
+
+        if cap is not None:
+            cap.release()
+        self.connected.clear()
+
+    def latest(self, after_seq):
+        with self.lock:
+            if self.seq == after_seq:
+                return after_seq, None
+            return self.seq, self.frame
+
+    def stop(self):
+        self.running = False
+        self.thread.join(timeout=CAMERA_RETRY_S + 1)
+
+
+class CameraSubscription:
+    def __init__(self, service, device):
+        self.service = service
+        self.device = device
+        self.seq = 0
+
+    @property
+    def index(self):
+        return self.device.index
 
+    @property
+    def connected(self):
+        return self.device.connected.is_set()
 
-init_db()
-try:
-    ids_, names_, embeddings_ = load_all_students_faces()
-except ValueError:
-    print("No data in database")
+    def wait_connected(self, timeout=CAMERA_OPEN_TIMEOUT):
+        # Returns as soon as the first open attempt has succeeded or failed.
+        self.device.attempted.wait(timeout)
+        return self.connected
+
+    def read(self):
+        # Newest frame not yet seen by this subscriber, or None. Frames are
+        # shared and read-only; copy before drawing on them.
+        self.seq, frame = self.device.latest(self.seq)
+        return frame
+
+    def close(self):
+        if self.device is not None:
+            self.service.release(self.device)
+            self.device = None
+
+
+class CameraService:
+    def __init__(self):
+        self.devices = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, index):
+        # An idle device is picked up again however long it has waited; the
+        # grace-period timer releases the others, so this never joins a
+        # camera thread on the GUI thread.
+        with self.lock:
+            device = self.devices.get(index)
+            if device is None:
+                device = self.devices[index] = CameraDevice(index)
+            device.subscribers += 1
+        return CameraSubscription(self, device)
+
+    def release(self, device):
+        with self.lock:
+            device.subscribers -= 1
+            if not device.subscribers:
+                device.idle_since = time.monotonic()
+                # Release it after the grace period even if nobody subscribes again.
+                timer = threading.Timer(CAMERA_IDLE_S, self.reap)
+                timer.daemon = True
+                timer.start()
+
+    def reap(self):
+        # Runs on the timer thread. Expired devices leave the table under the
+        # lock and are joined after it is released, so subscribers are never
+        # held up by a camera thread winding down; a new device for the same
+        # index keeps retrying the open until the old one lets go.
+        with self.lock:
+            expired = self.expire_idle()
+        for device in expired:
+            device.stop()
+
+    def expire_idle(self):
+        now = time.monotonic()
+        expired = []
+        for index, device in list(self.devices.items()):
+            if not device.subscribers and now - device.idle_since >= CAMERA_IDLE_S:
+                expired.append(self.devices.pop(index))
+        return expired
+
+    def close_all(self):
+        with self.lock:
+            for device in self.devices.values():
+                device.running = False
+            for device in self.devices.values():
+                device.stop()
+            self.devices.clear()
+
+
+camera_service = CameraService()
+
+
+RECORDING_MAGIC = b"NFREC1"
+FRAME_HEADER = struct.Struct("<dI")
+
+
+class FrameRecorder:
+    # Frames are encoded and written on a background thread so recording does
+    # not slow down the session being recorded. File layout: magic, a
+    # length-prefixed JSON header, then (timestamp, length, encoded frame) records.
+    def __init__(self, path, camera=None):
+        self.path = path
+        self.started = None
+        self.frames = 0
+        self.dropped = 0
+        self.queue = queue.Queue(maxsize=256)
+        self.file = open(path, "wb")
+
+        header = json.dumps({"codec": RECORD_CODEC, "camera": camera,
+                             "recorded": datetime.now().isoformat(timespec="seconds"),
+                             "embedding_version": EMBEDDING_VERSION}).encode()
+        self.file.write(RECORDING_MAGIC + struct.pack("<I", len(header)) + header)
+
+        self.thread = threading.Thread(target=self.run, name="recorder", daemon=True)
+        self.thread.start()
+
+    def write(self, frame, t=None):
+        t = time.monotonic() if t is None else t
+        if self.started is None:
+            self.started = t
+        try:
+            self.queue.put_nowait((t - self.started, frame))
+        except queue.Full:
+            # The encoder has fallen behind; losing a frame from the recording
+            # beats stalling the live session.
+            self.dropped += 1
+            return
+        self.frames += 1
+
+    def run(self):
+        params = [cv2.IMWRITE_JPEG_QUALITY, RECORD_QUALITY] if RECORD_CODEC == ".jpg" else []
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            t, frame = item
+            ok, buf = cv2.imencode(RECORD_CODEC, frame, params)
+            if ok:
+                self.file.write(FRAME_HEADER.pack(t, len(buf)) + buf.tobytes())
+        self.file.close()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+
+def read_recording(path):
+    with open(path, "rb") as f:
+        if f.read(len(RECORDING_MAGIC)) != RECORDING_MAGIC:
+            raise ValueError(f"{path} is not a NeuraFace recording")
+        (size,) = struct.unpack("<I", f.read(4))
+        header = json.loads(f.read(size))
+        yield header
+
+        while True:
+            record = f.read(FRAME_HEADER.size)
+            if len(record) < FRAME_HEADER.size:
+                return
+            t, size = FRAME_HEADER.unpack(record)
+            data = np.frombuffer(f.read(size), dtype=np.uint8)
+            yield t, cv2.imdecode(data, cv2.IMREAD_COLOR)
+
+
+class ReplaySource:
+    # Stands in for a CameraSubscription. In real-time mode a frame is handed
+    # out once its recorded offset has elapsed; otherwise every read() returns
+    # the next frame. Each frame pins the pipeline clock to its timestamp.
+    def __init__(self, path, realtime=True):
+        self.path = path
+        self.realtime = realtime
+        self.frames = read_recording(path)
+        self.header = next(self.frames)
+        self.index = f"replay {os.path.basename(path)}"
+        self.next = next(self.frames, None)
+        self.started = None
+        self.finished = self.next is None
+        embedding_cache.clear()
+
+    @property
+    def connected(self):
+        return True
+
+    def wait_connected(self, timeout=None):
+        return True
+
+    def read(self):
+        if self.next is None:
+            self.finished = True
+            return None
+
+        t, frame = self.next
+        if self.realtime:
+            if self.started is None:
+                self.started = time.monotonic() - t
+            if time.monotonic() - self.started < t:
+                return None
+
+        self.next = next(self.frames, None)
+        pipeline_clock.pin(t)
+        frame.flags.writeable = False
+        return frame
+
+    def close(self):
+        self.frames.close()
+        pipeline_clock.unpin()
 
 
 class NeuraFaceHome(QMainWindow):
@@ -290,8 +3507,62 @@ class NeuraFaceHome(QMainWindow):
         bottom_row.addWidget(right_button)
         layout.addLayout(bottom_row)
 
+        layout.addSpacerItem(QSpacerItem(20, 40))
+
+        self.here_label = QLabel("Here today")
+        self.here_label.setFont(QFont("Didot", 16, QFont.DemiBold))
+        self.here_label.setAlignment(Qt.AlignCenter)
+        layout.addWidget(self.here_label)
+
+        self.here_table = QTableView()
+        self.here_table.setFixedSize(600, 220)
+        self.here_table.setSortingEnabled(True)
+        self.here_table.horizontalHeader().setStretchLastSection(True)
+        self.here_table.verticalHeader().setVisible(False)
+        self.here_table.setStyleSheet("""
+            QTableView {
+                border: none;
+                border-radius: 12px;
+                background: rgba(255, 255, 255, 150);
+            }
+        """)
+        self.here_model = None
+
+        here_row = QHBoxLayout()
+        here_row.addStretch()
+        here_row.addWidget(self.here_table)
+        here_row.addStretch()
+        layout.addLayout(here_row)
+
         layout.addSpacerItem(QSpacerItem(20, 20))
 
+        self.today = None
+        self.dashboard_timer = QTimer()
+        self.dashboard_timer.timeout.connect(self.update_dashboard)
+
+        QShortcut(QKeySequence("Ctrl+Shift+P"), self, start_profile)
+
+    def update_dashboard(self):
+        global today_attendance
+        try:
+            if self.today is None:
+                self.today = today_attendance = TodayAttendance()
+            arrived = self.today.poll()
+        except sqlite3.Error as e:
+            self.here_label.setText(f"Here today: unavailable ({e})")
+            return
+
+        if arrived is None:
+            self.here_model = ListTableModel(self.today.rows(), ["Student", "ID"])
+            self.here_table.setModel(self.here_model)
+        elif arrived:
+            self.here_model.append_rows(arrived)
+        self.here_label.setText(f"Here today: {len(self.today.present)} of {len(self.today.names)}")
+
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        self.dashboard_timer.stop()
+
     def open_admin_login(self):
         self.admin_window = AdminLoginWindow(parent=self)
         self.admin_window.show()
@@ -310,6 +3581,8 @@ class NeuraFaceHome(QMainWindow):
     def showEvent(self, event):
         super().showEvent(event)
         self.move(0, 0)
+        self.update_dashboard()
+        self.dashboard_timer.start(DASHBOARD_POLL_MS)
 
 
 class AdminLoginWindow(QMainWindow):
@@ -637,23 +3910,23 @@ class NewStudentCaptureWindow(QMainWindow):
         form_row.addStretch()
         layout.addLayout(form_row)
 
-        self.cap = cv2.VideoCapture(self.cam_index)
+        self.camera = camera_service.subscribe(self.cam_index)
         self.timer = QTimer()
         self.timer.timeout.connect(self.update_frame)
         self.timer.start(10)
 
     def change_camera(self, index):
         self.cam_index = index
-        self.cap.release()
-        self.cap = cv2.VideoCapture(self.cam_index)
-        if not self.cap.isOpened():
+        self.camera.close()
+        self.camera = camera_service.subscribe(self.cam_index)
+        if not self.camera.wait_connected():
             QMessageBox.warning(self, "Camera Error", f"Camera {index} not available.")
 
     def update_frame(self):
-        ret, frame = self.cap.read()
-        if not ret:
+        frame = self.camera.read()
+        if frame is None:
             return
-        frame = cv2.flip(frame, 1)
+        frame = prepare_frame(frame)
         self.current_frame = frame.copy()
         rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
 
@@ -697,7 +3970,9 @@ class NewStudentCaptureWindow(QMainWindow):
             return
 
         face = extract_face(self.current_frame)
-        if face is None:
+        # The embedder runs its own detection and may still find no face in the crop.
+        emb = get_embedding(face) if face is not None else None
+        if emb is None:
             msg=QMessageBox(self)
             msg.setWindowTitle("Error")
             msg.setText("No face Detected")
@@ -720,37 +3995,415 @@ class NewStudentCaptureWindow(QMainWindow):
                 background-color: #666666
             }
             """)
+            msg.exec()
+            return
+
+        for other_id, other_name, dist in registration_gallery.nearest(emb):
+            if other_id != sid and dist < DUPLICATE_THRESHOLD:
+                QMessageBox.warning(
+                    self, "Already Registered",
+                    f"This face matches {other_name} ({other_id}), distance {dist:.2f}.\n"
+                    "Not registered."
+                )
+                return
+
+        fast_emb = get_embedding(face, FAST_MODEL)
+        ok, buf = cv2.imencode(".png", face)
+        save_student_to_db(sid, name, buf.tobytes(), emb, fast_emb)
+        registration_gallery.add(sid, name, emb)
+
+        QMessageBox.information(self, "Success", f"Registered {name}")
+        self.name_input.clear()
+        self.id_input.clear()
+
+    def closeEvent(self, event):
+        self.camera.close()
+        if self.parent_window:
+            self.parent_window.close()
+        if not self.is_back_navigation:
+            QApplication.quit()
+        event.accept()
+
+    def go_back(self):
+        self.is_back_navigation = True
+
+        self.timer.stop()
+        self.camera.close()
+
+        self.hide()
+        self.parent_window.show()
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.move(0, 0)
+
+
+class SqlPagedModel(QAbstractTableModel):
+    def __init__(self, query, params=(), parent=None, attach=None):
+        super().__init__(parent)
+        self.query = query.strip().rstrip(";")
+        self.params = tuple(params)
+        self.conn = sqlite3.connect(DB)
+        for alias, path in (attach or {}).items():
+            self.conn.execute(f"ATTACH DATABASE ? AS {alias}", (path,))
+
+        cur = self.conn.execute(f"SELECT * FROM ({self.query}) LIMIT 0", self.params)
+        self.columns = [d[0] for d in cur.description]
+
+        self.filter_text = ""
+        self.sort_column = None
+        self.sort_order = Qt.AscendingOrder
+
+        self.rows = []
+        self.cursor = None
+        self.exhausted = True
+        self.reload()
+
+    def select(self):
+        sql = f"SELECT * FROM ({self.query})"
+        params = list(self.params)
+
+        if self.filter_text:
+            quoted = ['"' + c.replace('"', '""') + '"' for c in self.columns]
+            sql += " WHERE " + " OR ".join(f"CAST({c} AS TEXT) LIKE ?" for c in quoted)
+            params += [f"%{self.filter_text}%"] * len(quoted)
+
+        if self.sort_column is not None:
+            direction = "DESC" if self.sort_order == Qt.DescendingOrder else "ASC"
+            sql += f" ORDER BY {self.sort_column + 1} {direction}"
+        return sql, params
+
+    def reload(self):
+        sql, params = self.select()
+        self.beginResetModel()
+        self.cursor = self.conn.execute(sql, params)
+        self.exhausted = False
+        self.rows = self.read_page()
+        self.endResetModel()
+
+    def read_page(self):
+        page = self.cursor.fetchmany(SQL_PAGE_SIZE)
+        if len(page) < SQL_PAGE_SIZE:
+            self.exhausted = True
+        return page
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.exhausted
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self.exhausted:
+            return
+        page = self.read_page()
+        if page:
+            self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(page) - 1)
+            self.rows.extend(page)
+            self.endInsertRows()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.columns)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and index.isValid():
+            return str(self.rows[index.row()][index.column()])
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return self.columns[section]
+        return section + 1
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        column = column if column >= 0 else None
+        if (column, order) == (self.sort_column, self.sort_order):
+            return
+        self.sort_column = column
+        self.sort_order = order
+        self.reload()
+
+    def set_filter(self, text):
+        self.filter_text = text
+        self.reload()
+
+    def close(self):
+        self.cursor = None
+        self.conn.close()
+
+
+
+class ListTableModel(QAbstractTableModel):
+    def __init__(self, rows, columns, parent=None):
+        super().__init__(parent)
+        self.all_rows = list(rows)
+        self.rows = self.all_rows
+        self.columns = list(columns)
+        self.filter_text = ""
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.columns)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and index.isValid():
+            return str(self.rows[index.row()][index.column()])
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return self.columns[section]
+        return section + 1
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        if column < 0:
+            return
+        self.beginResetModel()
+        self.rows = sorted(self.rows, key=lambda row: (row[column] is None, str(row[column])),
+                           reverse=order == Qt.DescendingOrder)
+        self.endResetModel()
+
+    def matches(self, row):
+        return not self.filter_text or any(self.filter_text in str(v).lower() for v in row)
+
+    def set_filter(self, text):
+        self.beginResetModel()
+        self.filter_text = text.lower()
+        self.rows = [row for row in self.all_rows if self.matches(row)]
+        self.endResetModel()
+
+    def append_rows(self, rows):
+        if self.rows is self.all_rows:
+            visible = rows
+        else:
+            visible = [row for row in rows if self.matches(row)]
+
+        start = len(self.rows)
+        if visible:
+            self.beginInsertRows(QModelIndex(), start, start + len(visible) - 1)
+        self.all_rows.extend(rows)
+        if self.rows is not self.all_rows:
+            self.rows.extend(visible)
+        if visible:
+            self.endInsertRows()
+
+    def close(self):
+        pass
+
+
+def connect_readonly():
+    conn = sqlite3.connect(Path(DB).resolve().as_uri() + "?mode=ro", uri=True)
+    conn.execute("PRAGMA query_only = ON")
+    return conn
+
+
+class SqlQueryWorker(QThread):
+    # Owns the console's read-only connection: every execute and every page
+    # fetch runs here, where Cancel can interrupt it, never on the GUI thread.
+    query_started = Signal(int)
+    # request id, column names, first page
+    query_ready = Signal(int, list, list)
+    # request id, next page
+    page_ready = Signal(int, list)
+    # request id, elapsed seconds, progress-handler ticks, cancelled
+    query_finished = Signal(int, float, int, bool)
+    query_failed = Signal(int, str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.requests = queue.Queue()
+        self.next_id = 0
+        self.current = None
+        self.cancelled = False
+        self.steps = 0
+
+    def submit(self, sql, params=()):
+        # A new statement supersedes whatever is still running.
+        self.cancel()
+        return self.enqueue(sql, params)
+
+    def fetch_more(self):
+        return self.enqueue(None, ())
+
+    def enqueue(self, sql, params):
+        self.next_id += 1
+        self.requests.put((self.next_id, sql, params))
+        return self.next_id
+
+    def cancel(self, request_id=None):
+        if request_id is None or request_id == self.current:
+            self.cancelled = True
+
+    def stop(self):
+        self.cancel()
+        self.requests.put(None)
+        self.wait()
+
+    def on_progress(self):
+        self.steps += 1
+        return 1 if self.cancelled else 0
+
+    def run(self):
+        conn = None
+        try:
+            conn = connect_readonly()
+            conn.set_progress_handler(self.on_progress, SQL_PROGRESS_STEPS)
+            cursor = None
+            while True:
+                request = self.requests.get()
+                if request is None:
+                    break
+                request_id, sql, params = request
+                self.current = request_id
+                self.cancelled = False
+                self.steps = 0
+                self.query_started.emit(request_id)
+                start = time.perf_counter()
+                try:
+                    if sql is not None:
+                        cursor = conn.execute(sql, params)
+                        if cursor.description is None:
+                            cursor = None
+                            self.query_failed.emit(request_id, "Only queries that return rows can be run here.")
+                        else:
+                            columns = [d[0] for d in cursor.description]
+                            self.query_ready.emit(request_id, columns, cursor.fetchmany(SQL_PAGE_SIZE))
+                    elif cursor is not None:
+                        self.page_ready.emit(request_id, cursor.fetchmany(SQL_PAGE_SIZE))
+                except sqlite3.Error as e:
+                    cursor = None
+                    if not self.cancelled:
+                        self.query_failed.emit(request_id, str(e))
+                self.query_finished.emit(request_id, time.perf_counter() - start, self.steps, self.cancelled)
+        except sqlite3.Error as e:
+            self.query_failed.emit(0, str(e))
+        finally:
+            if conn is not None:
+                conn.close()
+
+
+class SqlQueryModel(SqlPagedModel):
+    # SqlPagedModel for the SQL console, driven by an SqlQueryWorker. Plain
+    # SELECTs are wrapped so sorting and filtering happen in SQL; anything
+    # else (PRAGMA, EXPLAIN, ...) runs as written and only pages.
+    def __init__(self, query, worker, filter_text="", parent=None):
+        QAbstractTableModel.__init__(self, parent)
+        self.query = query.strip().rstrip(";")
+        self.params = ()
+        self.worker = worker
+        words = self.query.split(None, 1)
+        self.wrapped = bool(words) and words[0].upper() in ("SELECT", "WITH", "VALUES")
+
+        self.columns = []
+        self.filter_text = filter_text
+        self.sort_column = None
+        self.sort_order = Qt.AscendingOrder
+
+        self.rows = []
+        self.exhausted = True
+        self.request = None
+        self.fetching = False
+
+        worker.query_ready.connect(self.on_query_ready)
+        worker.page_ready.connect(self.on_page_ready)
+        worker.query_finished.connect(self.on_query_finished)
+        self.reload()
+
+    def reload(self):
+        # The filter needs the column names, which the first run provides.
+        if self.wrapped and (self.columns or not self.filter_text):
+            sql, params = self.select()
+        else:
+            sql, params = self.query, ()
+        self.fetching = False
+        self.request = self.worker.submit(sql, params)
+
+    def on_query_ready(self, request_id, columns, rows):
+        if request_id != self.request:
+            return
+        if self.wrapped and self.filter_text and not self.columns:
+            self.columns = columns
+            self.reload()
+            return
+        self.beginResetModel()
+        self.columns = columns
+        self.rows = rows
+        self.exhausted = len(rows) < SQL_PAGE_SIZE
+        self.endResetModel()
+
+    def on_page_ready(self, request_id, rows):
+        if request_id != self.request:
             return
+        self.fetching = False
+        if len(rows) < SQL_PAGE_SIZE:
+            self.exhausted = True
+        if rows:
+            self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(rows) - 1)
+            self.rows.extend(rows)
+            self.endInsertRows()
+
+    def on_query_finished(self, request_id, elapsed, steps, cancelled):
+        if request_id == self.request and cancelled:
+            # The cursor is gone; what has been fetched stays on screen.
+            self.fetching = False
+            self.exhausted = True
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self.exhausted or self.fetching:
+            return
+        self.fetching = True
+        self.request = self.worker.fetch_more()
 
-        emb = get_embedding(face)
-        ok, buf = cv2.imencode(".png", face)
-        save_student_to_db(sid, name, buf.tobytes(), emb)
+    def sort(self, column, order=Qt.AscendingOrder):
+        if self.wrapped:
+            super().sort(column, order)
 
-        QMessageBox.information(self, "Success", f"Registered {name}")
-        self.name_input.clear()
-        self.id_input.clear()
+    def set_filter(self, text):
+        if text == self.filter_text:
+            return
+        self.filter_text = text
+        if self.wrapped:
+            self.reload()
 
-    def closeEvent(self, event):
-        if self.cap.isOpened():
-            self.cap.release()
-        if self.parent_window:
-            self.parent_window.close()
-        if not self.is_back_navigation:
-            QApplication.quit()
-        event.accept()
+    def close(self):
+        self.worker.cancel(self.request)
+        self.worker.query_ready.disconnect(self.on_query_ready)
+        self.worker.page_ready.disconnect(self.on_page_ready)
+        self.worker.query_finished.disconnect(self.on_query_finished)
 
-    def go_back(self):
-        self.is_back_navigation = True
 
-        if hasattr(self, "cap") and self.cap.isOpened():
-            self.cap.release()
+class ExportWorker(QThread):
+    export_progress = Signal(int, int)
+    # rows written, elapsed seconds, path, cancelled
+    export_finished = Signal(int, float, str, bool)
+    export_failed = Signal(str)
 
-        self.hide()
-        self.parent_window.show()
+    def __init__(self, path, start, end, matrix, parent=None):
+        super().__init__(parent)
+        self.path = path
+        self.start_date = start
+        self.end_date = end
+        self.matrix = matrix
+        self.cancelled = False
 
-    def showEvent(self, event):
-        super().showEvent(event)
-        self.move(0, 0)
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        start = time.perf_counter()
+        try:
+            rows = export_attendance(self.path, self.start_date, self.end_date, self.matrix,
+                                     self.export_progress.emit, lambda: self.cancelled)
+        except Exception as e:
+            self.export_failed.emit(str(e))
+            return
+        self.export_finished.emit(rows, time.perf_counter() - start, self.path, self.cancelled)
 
 
 class AttendanceWindow(QMainWindow):
@@ -815,21 +4468,54 @@ class AttendanceWindow(QMainWindow):
         self.date_edit = QDateEdit(QDate.currentDate())
         self.date_edit.setCalendarPopup(True)
         self.date_edit.setFixedSize(150, 36)
-        self.date_edit.dateChanged.connect(self.load_date_attendance)
+        self.date_edit.dateChanged.connect(self.load_report)
+
+        to_label = QLabel("to")
+
+        self.to_date_edit = QDateEdit(QDate.currentDate())
+        self.to_date_edit.setCalendarPopup(True)
+        self.to_date_edit.setFixedSize(150, 36)
+        self.to_date_edit.setEnabled(False)
+
+        self.report_selector = QComboBox()
+        self.report_selector.setFixedHeight(36)
+        self.report_selector.addItems(["Daily Register", "Attendance %", "Daily Counts", "Date Matrix"])
+        self.report_selector.currentIndexChanged.connect(self.change_report)
 
         load_btn = QPushButton("Load")
-        load_btn.clicked.connect(self.load_date_attendance)
+        load_btn.clicked.connect(self.load_report)
+
+        self.export_btn = QPushButton("Export")
+        self.export_btn.clicked.connect(self.export_report)
+        self.export_worker = None
 
         date_row.addWidget(date_label)
         date_row.addWidget(self.date_edit)
+        date_row.addWidget(to_label)
+        date_row.addWidget(self.to_date_edit)
+        date_row.addWidget(self.report_selector)
         date_row.addWidget(load_btn)
+        date_row.addWidget(self.export_btn)
         date_row.addStretch()
 
+        self.filter_input = QLineEdit()
+        self.filter_input.setPlaceholderText("Filter rows...")
+        self.filter_input.setFixedSize(220, 36)
+        self.filter_input.textChanged.connect(lambda _: self.filter_timer.start(300))
+        date_row.addWidget(self.filter_input)
+
+        self.filter_timer = QTimer()
+        self.filter_timer.setSingleShot(True)
+        self.filter_timer.timeout.connect(self.apply_filter)
+
         layout.addLayout(date_row)
 
-        self.table = QTableWidget()
+        self.model = None
+        self.table = QTableView()
         self.table.setAlternatingRowColors(True)
-        self.table.setSelectionBehavior(QTableWidget.SelectRows)
+        self.table.setSelectionBehavior(QTableView.SelectRows)
+        self.table.setSortingEnabled(True)
+        self.table.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
         self.table.horizontalHeader().setStretchLastSection(True)
         layout.addWidget(self.table)
 
@@ -842,17 +4528,32 @@ class AttendanceWindow(QMainWindow):
         self.sql_input.setFixedHeight(36)
         self.sql_input.returnPressed.connect(self.execute_sql)
 
-        exec_btn = QPushButton("Execute")
-        exec_btn.clicked.connect(self.execute_sql)
+        self.exec_btn = QPushButton("Execute")
+        self.exec_btn.clicked.connect(self.execute_sql)
+
+        self.cancel_btn = QPushButton("Cancel")
+        self.cancel_btn.setEnabled(False)
+        self.cancel_btn.clicked.connect(self.cancel_sql)
+
+        plan_btn = QPushButton("Plan")
+        plan_btn.clicked.connect(self.explain_sql)
 
         clear_btn = QPushButton("Clear")
         clear_btn.clicked.connect(self.clear_table)
 
         sql_row.addWidget(sql_label)
         sql_row.addWidget(self.sql_input)
-        sql_row.addWidget(exec_btn)
+        sql_row.addWidget(self.exec_btn)
+        sql_row.addWidget(self.cancel_btn)
+        sql_row.addWidget(plan_btn)
         sql_row.addWidget(clear_btn)
 
+        self.query_worker = None
+        self.query_model = None
+        self.query_started = 0.0
+        self.query_timer = QTimer()
+        self.query_timer.timeout.connect(self.show_query_progress)
+
         layout.addLayout(sql_row)
 
         self.status_label = QLabel("Ready")
@@ -865,57 +4566,232 @@ class AttendanceWindow(QMainWindow):
         date = self.date_edit.date().toString("yyyy-MM-dd")
         self.status_label.setText(f"Loading {date}...")
 
-        conn = sqlite3.connect(DB)
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT s.student_name,
-                   COALESCE(a.is_present, 0),
-                   CASE WHEN a.is_present THEN '✅ Present' ELSE '❌ Absent' END
+        source, params, attach = "attendance", (), None
+        path = archive_for(date)
+        if path is not None:
+            # A late synced mark can land in the hot table for a date that is
+            # also in the archive: one row per student, presence wins.
+            source = """(SELECT student_id, attendance_date, MAX(is_present) AS is_present FROM (
+                             SELECT student_id, attendance_date, is_present FROM main.attendance
+                             WHERE attendance_date = ?
+                             UNION ALL
+                             SELECT student_id, attendance_date, is_present FROM archive.attendance
+                             WHERE attendance_date = ?)
+                         GROUP BY student_id, attendance_date)"""
+            params = (date, date)
+            attach = {"archive": path}
+
+        self.show_query(f"""
+            SELECT s.student_name AS "Name",
+                   COALESCE(a.is_present, 0) AS "Present",
+                   CASE WHEN a.is_present THEN '✅ Present' ELSE '❌ Absent' END AS "Status"
             FROM students s
-            LEFT JOIN attendance a
+            LEFT JOIN {source} a
             ON s.student_id = a.student_id AND a.attendance_date = ?
             ORDER BY s.student_name
-        """, (date,))
-        data = cur.fetchall()
-        conn.close()
+        """, (*params, date), attach)
+
+    def change_report(self, index):
+        self.to_date_edit.setEnabled(index != 0)
+        self.load_report()
+
+    def load_report(self):
+        report = self.report_selector.currentText()
+        if report == "Daily Register":
+            self.load_date_attendance()
+            return
+
+        start = self.date_edit.date().toString("yyyy-MM-dd")
+        end = self.to_date_edit.date().toString("yyyy-MM-dd")
+        if start > end:
+            start, end = end, start
+        self.status_label.setText(f"Loading {report} for {start} to {end}...")
+
+        if report == "Attendance %":
+            data = student_attendance_percentages(start, end)
+            columns = ["ID", "Name", "Days Present", "Class Days", "Attendance %"]
+        elif report == "Daily Counts":
+            data = daily_attendance_counts(start, end)
+            columns = ["Date", "Present"]
+        else:
+            dates, rows = attendance_matrix(start, end)
+            data = [(sid, name, *("✅" if p else "" for p in marks)) for sid, name, marks in rows]
+            columns = ["ID", "Name", *dates]
+
+        self.populate_table(data, columns)
+
+    def export_report(self):
+        if self.export_worker is not None:
+            self.export_worker.cancel()
+            return
+
+        start = self.date_edit.date().toString("yyyy-MM-dd")
+        end = self.to_date_edit.date().toString("yyyy-MM-dd") if self.to_date_edit.isEnabled() else start
+        if start > end:
+            start, end = end, start
+        matrix = self.report_selector.currentText() == "Date Matrix"
+
+        name = f"attendance_{'matrix' if matrix else 'rows'}_{start}_{end}"
+        path, _ = QFileDialog.getSaveFileName(
+            self, "Export Attendance", f"{name}.csv",
+            "CSV (*.csv);;Parquet (*.parquet);;Arrow (*.arrow)"
+        )
+        if not path:
+            return
 
-        self.populate_table(data, ["Name", "Present", "Status"])
-        self.status_label.setText(f"{len(data)} records loaded")
+        worker = ExportWorker(path, start, end, matrix)
+        worker.export_progress.connect(self.show_export_progress)
+        worker.export_finished.connect(self.export_done)
+        worker.export_failed.connect(self.export_error)
+        worker.finished.connect(self.export_cleanup)
+        self.export_worker = worker
+
+        self.export_btn.setText("Cancel Export")
+        self.status_label.setText(f"Exporting {'matrix' if matrix else 'rows'} for {start} to {end}...")
+        worker.start()
+
+    def show_export_progress(self, done, total):
+        self.status_label.setText(f"Exporting... {done:,} / {total:,}")
+
+    def export_done(self, rows, elapsed, path, cancelled):
+        note = " (cancelled)" if cancelled else ""
+        self.status_label.setText(f"Exported {rows:,} rows to {path} in {elapsed:.1f} s{note}")
+
+    def export_error(self, message):
+        self.status_label.setText("Export failed")
+        QMessageBox.critical(self, "Export Error", message)
+
+    def export_cleanup(self):
+        self.export_worker = None
+        self.export_btn.setText("Export")
 
     def execute_sql(self):
+        query = self.sql_input.text().strip()
+        if not query:
+            return
+
+        if self.query_worker is None:
+            worker = SqlQueryWorker()
+            worker.query_started.connect(self.query_begun)
+            worker.query_finished.connect(self.query_done)
+            worker.query_failed.connect(self.query_error)
+            self.query_worker = worker
+            worker.start()
+
+        # The view takes the model only once the first page brings its
+        # columns: the stretched last header section crashes on a model that
+        # has none.
+        if self.query_model is not None and self.query_model is not self.model:
+            self.query_model.close()
+        model = SqlQueryModel(query, self.query_worker, self.filter_input.text())
+        model.modelReset.connect(lambda: self.show_query_model(model))
+        self.query_model = model
+
+    def show_query_model(self, model):
+        if model is self.query_model and model is not self.model:
+            self.set_model(model)
+
+    def cancel_sql(self):
+        if self.query_worker is not None:
+            self.query_worker.cancel()
+
+    def query_begun(self, request_id):
+        self.cancel_btn.setEnabled(True)
+        self.query_started = time.perf_counter()
+        self.query_timer.start(100)
+
+    def show_query_progress(self):
+        elapsed = time.perf_counter() - self.query_started
+        self.status_label.setText(
+            f"Running... {elapsed:.1f} s, {self.query_worker.steps * SQL_PROGRESS_STEPS:,} VM steps"
+        )
+
+    def query_done(self, request_id, elapsed, steps, cancelled):
+        self.query_timer.stop()
+        self.cancel_btn.setEnabled(False)
+        model = self.query_model
+        if model is None or request_id != model.request:
+            return
+        if cancelled:
+            self.status_label.setText(f"Cancelled after {elapsed:.2f} s, {steps * SQL_PROGRESS_STEPS:,} VM steps")
+            return
+        more = " (scroll for more)" if model.canFetchMore(QModelIndex()) else ""
+        self.status_label.setText(
+            f"{model.rowCount()} rows in {elapsed:.2f} s, {steps * SQL_PROGRESS_STEPS:,} VM steps{more}"
+        )
+
+    def query_error(self, request_id, message):
+        self.status_label.setText("Query failed")
+        QMessageBox.critical(self, "SQL Error", message)
+
+    def explain_sql(self):
         query = self.sql_input.text().strip()
         if not query:
             return
         try:
-            conn = sqlite3.connect(DB)
-            cur = conn.cursor()
-            cur.execute(query)
+            conn = connect_readonly()
+            cur = conn.execute(f"EXPLAIN QUERY PLAN {query}")
             data = cur.fetchall()
-            cols = [d[0] for d in cur.description]
             conn.close()
-            self.populate_table(data, cols)
         except Exception as e:
             QMessageBox.critical(self, "SQL Error", str(e))
+            return
+        self.populate_table(data, ["id", "parent", "notused", "detail"])
 
-    def populate_table(self, data, columns):
-        self.table.setRowCount(len(data))
-        self.table.setColumnCount(len(columns))
-        self.table.setHorizontalHeaderLabels(columns)
+    def show_query(self, query, params=(), attach=None):
+        self.set_model(SqlPagedModel(query, params, attach=attach))
 
-        for r, row in enumerate(data):
-            for c, val in enumerate(row):
-                self.table.setItem(r, c, QTableWidgetItem(str(val)))
+    def populate_table(self, data, columns):
+        self.set_model(ListTableModel(data, columns))
+
+    def set_model(self, model):
+        # Swap the view over first: dropping the last reference to a model the
+        # view still holds frees it underneath the view.
+        old = self.model
+        self.table.setModel(model)
+        self.model = model
+        if old is not None:
+            old.close()
+        if self.query_model is not None and self.query_model is not model:
+            if self.query_model is not old:
+                self.query_model.close()
+            self.query_model = None
+        self.table.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+
+        if model is None:
+            return
+        if self.filter_input.text():
+            model.set_filter(self.filter_input.text())
+        model.modelReset.connect(self.update_row_status)
+        model.rowsInserted.connect(self.update_row_status)
 
+        # Only the first page is loaded here, so this stays cheap for huge results.
         self.table.resizeColumnsToContents()
+        self.update_row_status()
+
+    def update_row_status(self, *args):
+        more = " (scroll for more)" if self.model.canFetchMore(QModelIndex()) else ""
+        self.status_label.setText(f"{self.model.rowCount()} records loaded{more}")
+
+    def apply_filter(self):
+        if self.model is not None:
+            self.model.set_filter(self.filter_input.text())
 
     def clear_table(self):
-        self.table.clear()
+        self.set_model(None)
         self.status_label.setText("Cleared")
 
     def showEvent(self, event):
         super().showEvent(event)
         self.move(0, 0)
 
+    def stop_query(self):
+        if self.query_worker is not None:
+            self.query_worker.stop()
+        if self.export_worker is not None:
+            self.export_worker.cancel()
+            self.export_worker.wait()
+
     def go_back(self):
         self.is_back_navigation = True
 
@@ -926,6 +4802,7 @@ class AttendanceWindow(QMainWindow):
         self.parent_window.show()
 
     def closeEvent(self, event):
+        self.stop_query()
         if self.parent_window:
             self.parent_window.close()
         if not self.is_back_navigation:
@@ -934,7 +4811,7 @@ class AttendanceWindow(QMainWindow):
 
 
 class ScanWindow(QMainWindow):
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, source=None):
         super().__init__(parent)
         if parent:
             self.showMaximized()
@@ -943,10 +4820,12 @@ class ScanWindow(QMainWindow):
         self.is_back_navigation = False
 
         try:
-            ids_, names_, embeddings_ = load_all_students_faces()
-            self.ids = ids_
-            self.names = names_
-            self.embeddings = embeddings_
+            self.gallery_generation = gallery_generation()
+            self.matcher = build_matcher()
+            self.ids = self.matcher.ids
+            self.names = self.matcher.names
+            self.embeddings = self.matcher.embeddings
+            self.rosters = load_rosters()
         except:
             QMessageBox.critical(self, "Error", "Register atleast 1 student to continue")
             self.deleteLater()
@@ -982,9 +4861,26 @@ class ScanWindow(QMainWindow):
             }
         """)
 
+        self.active_section = None
+        self.session_selector = QComboBox()
+        self.session_selector.setFixedSize(260, 47)
+        self.session_selector.addItem("Auto (timetable)", "auto")
+        self.session_selector.addItem("All students", None)
+        for section_id, course_name, section_name in load_sections():
+            self.session_selector.addItem(f"{course_name} – {section_name}", section_id)
+        self.session_selector.currentIndexChanged.connect(self.change_session)
+        self.session_selector.setStyleSheet("""
+            QComboBox {
+                border-radius: 10px;
+                padding-left: 10px;
+                font-size: 14px;
+            }
+        """)
+
         back_row = QHBoxLayout()
         back_row.addWidget(back_btn)
         back_row.addStretch()
+        back_row.addWidget(self.session_selector)
         back_row.addWidget(self.cam_selector)
 
         self.setWindowTitle("NeuraFace – Scan")
@@ -1101,13 +4997,92 @@ class ScanWindow(QMainWindow):
 
         main_layout.addWidget(bottom_bar, alignment=Qt.AlignCenter)
 
-        self.cap = cv2.VideoCapture(self.cam_index)
+        self.camera = source if source is not None else camera_service.subscribe(self.cam_index)
+        self.recorder = None
+        if RECORD_DIR and source is None:
+            os.makedirs(RECORD_DIR, exist_ok=True)
+            path = os.path.join(RECORD_DIR, f"scan-{datetime.now():%Y%m%d-%H%M%S}.nfr")
+            self.recorder = FrameRecorder(path, self.cam_index)
         self.timer = QTimer()
         self.timer.timeout.connect(self.update_frame)
         self.timer.start(10)
 
         self.recognized_student_name = None
         self.recognized_student_id = None
+        self.decider = SequentialDecider()
+        self.detector = TiledDetector()
+
+        self.session_timer = QTimer()
+        self.session_timer.timeout.connect(self.check_gallery)
+        self.session_timer.timeout.connect(self.check_session)
+        self.session_timer.timeout.connect(self.check_memory)
+        self.session_timer.start(ROSTER_CHECK_MS)
+        self.check_session()
+
+        QShortcut(QKeySequence("Ctrl+Shift+P"), self, start_profile)
+
+    def set_session(self, section_id):
+        if not hasattr(self, "matcher"):
+            return
+        self.active_section = section_id
+        if section_id is None:
+            self.matcher.set_roster(None)
+        else:
+            self.matcher.set_roster(self.rosters.get(section_id, []))
+
+    def change_session(self, index):
+        choice = self.session_selector.itemData(index)
+        if choice == "auto":
+            self.check_session()
+        else:
+            self.set_session(choice)
+
+    def check_gallery(self):
+        # A finished `reembed` swaps the gallery underneath us; pick it up here
+        # so recognition never mixes embeddings from two model versions.
+        if not hasattr(self, "matcher"):
+            return
+        generation = gallery_generation()
+        if generation == self.gallery_generation:
+            return
+
+        self.gallery_generation = generation
+        self.matcher = build_matcher()
+        self.ids = self.matcher.ids
+        self.names = self.matcher.names
+        self.embeddings = self.matcher.embeddings
+        self.decider.reset()
+        self.set_session(self.active_section)
+
+    def check_memory(self):
+        if memory_monitor is None or not memory_monitor.restart_requested.is_set():
+            return
+        memory_monitor.restart_requested.clear()
+        self.restart_inference()
+
+    def restart_inference(self):
+        # Everything recognition has built up (detector pool, caches, loaded
+        # models, gallery) is thrown away and rebuilt from the database.
+        before = rss_mib()
+        self.detector.close()
+        embedding_cache.clear()
+        release_models()
+        if hasattr(self, "matcher"):
+            self.gallery_generation = None
+            self.check_gallery()
+        gc.collect()
+
+        if memory_monitor is not None:
+            memory_monitor.restarts += 1
+        if before is not None:
+            print(f"Inference restarted: RSS {before:.0f} -> {rss_mib():.0f} MiB")
+
+    def check_session(self):
+        if self.session_selector.currentData() != "auto":
+            return
+        section_id = current_section()
+        if section_id != self.active_section:
+            self.set_session(section_id)
 
     def accept_result(self):
         save_student_attendance(self.recognized_student_id)
@@ -1139,46 +5114,9 @@ class ScanWindow(QMainWindow):
 
         msg.exec()
 
-    def recognize_frame(self, frame, ids, names, embeddings):
-        results = []
-
-        detections = DeepFace.extract_faces(
-            frame,
-            detector_backend="opencv",
-            enforce_detection=False
-        )
-
-        for det in detections:
-            region = det["facial_area"]
-            x, y, w, h = region["x"], region["y"], region["w"], region["h"]
-
-            face = frame[y:y + h, x:x + w]
-            if face.size == 0:
-                continue
-
-            face_rgb = cv2.cvtColor(face, cv2.COLOR_BGR2RGB)
-
-            try:
-                emb = DeepFace.represent(
-                    face_rgb,
-                    model_name="ArcFace",
-                    detector_backend="skip"
-                )[0]["embedding"]
-            except Exception:
-                continue
-
-            emb = np.array(emb, dtype=np.float32)
-
-            dists = np.linalg.norm(embeddings - emb, axis=1)
-            best_idx = np.argmin(dists)
-            best_dist = dists[best_idx]
-
-            name = names[best_idx] if best_dist < THRESHOLD else "Unknown"
-            id_ = ids[best_idx] if best_dist < THRESHOLD else "Unknown"
-
-            results.append((x, y, w, h, name, id_, best_dist))
-
-        return results
+    def recognize_frame(self, frame, matcher, decider):
+        return recognize_frame(frame, self.detector, matcher, decider,
+                               recognition_journal, str(self.camera.index))
 
     def stop_capture(self):
         self.timer.stop()
@@ -1187,22 +5125,27 @@ class ScanWindow(QMainWindow):
         self.accept.setEnabled(False)
         self.recapture.setEnabled(False)
         self.details_label.setText("<h3>RECOGNIZED AS:</h3>")
+        self.decider.reset()
         self.timer.start(10)
 
     def update_frame(self):
-        ret, frame = self.cap.read()
-        if not ret:
-            self.video_label.setText("Camera failed")
+        frame = self.camera.read()
+        if frame is None:
+            if getattr(self.camera, "finished", False):
+                self.stop_capture()
+                self.video_label.setText("Replay finished")
+            elif not self.camera.connected:
+                self.video_label.setText(f"Camera {self.camera.index} disconnected, reconnecting...")
             return
+        if self.recorder is not None:
+            self.recorder.write(frame)
 
-        frame = cv2.flip(frame, 1)
+        frame = prepare_frame(frame)
         self.current_frame = frame.copy()
 
-        detections = self.recognize_frame(frame, self.ids, self.names, self.embeddings)
+        detections = self.recognize_frame(frame, self.matcher, self.decider)
 
-        known_count = sum(1 for *_, name, __, ___ in [
-            (x, y, w, h, name, id_, dist) for x, y, w, h, name, id_, dist in detections
-        ] if name != "Unknown")
+        known_count = sum(1 for *_, name, __, ___ in detections if name not in ("Unknown", PENDING))
 
         if known_count > 1:
             QMessageBox.warning(self, "Multiple People",
@@ -1210,11 +5153,14 @@ class ScanWindow(QMainWindow):
 
         found_known = False
         for x, y, w, h, name, id_, dist in detections:
-            color = (0, 255, 0) if name != "Unknown" else (0, 0, 255)
+            if name == PENDING:
+                color = (0, 255, 255)
+            else:
+                color = (0, 255, 0) if name != "Unknown" else (0, 0, 255)
             cv2.rectangle(frame, (x, y), (x + w, y + h), color, 2)
             cv2.putText(frame, f"{name}", (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
 
-            if name != "Unknown":
+            if name not in ("Unknown", PENDING):
                 self.recognized_student_name = name
                 self.recognized_student_id = id_
                 self.details_label.setText(
@@ -1240,14 +5186,27 @@ class ScanWindow(QMainWindow):
 
     def change_camera(self, index):
         self.cam_index = index
-        self.cap.release()
-        self.cap = cv2.VideoCapture(self.cam_index)
-        if not self.cap.isOpened():
+        self.camera.close()
+        self.camera = camera_service.subscribe(self.cam_index)
+        if not self.camera.wait_connected():
             QMessageBox.warning(self, "Camera Error", f"Camera {index} not available.")
 
+    def stop_recording(self):
+        if self.recorder is not None:
+            self.recorder.close()
+            dropped = f" ({self.recorder.dropped} dropped, encoder too slow)" if self.recorder.dropped else ""
+            print(f"Recorded {self.recorder.frames} frames to {self.recorder.path}{dropped}")
+            self.recorder = None
+
     def closeEvent(self, event):
-        if self.cap.isOpened():
-            self.cap.release()
+        if hasattr(self, "matcher"):
+            print(self.matcher.report())
+        print(embedding_cache.report())
+        if hasattr(self, "decider"):
+            print(self.decider.report())
+        self.detector.close()
+        self.camera.close()
+        self.stop_recording()
         if self.parent_window:
             self.parent_window.close()
         if not self.is_back_navigation:
@@ -1263,17 +5222,1494 @@ class ScanWindow(QMainWindow):
         self.is_back_navigation = True
 
         self.timer.stop()
-        if hasattr(self, "cap") and self.cap.isOpened():
-            self.cap.release()
+        self.session_timer.stop()
+        self.detector.close()
+        self.camera.close()
+        self.stop_recording()
 
         self.close()
         self.parent_window.show()
 
 
+def cascade_eval_command(argv):
+    parser = argparse.ArgumentParser(
+        prog="neuraface.py cascade-eval",
+        description="Compare cascade and ArcFace-only matching on labelled face photos. "
+                    "FOLDER holds one sub-folder per student_id; use 'unknown' for unregistered people."
+    )
+    parser.add_argument("folder")
+    args = parser.parse_args(argv)
+
+    filled, failed = backfill_fast_embeddings()
+    if filled or failed:
+        print(f"{FAST_MODEL} embeddings filled in for {filled} students, {failed} failed")
+    matcher = build_matcher(cascade=True)
+    if matcher.fast_embeddings is None:
+        print(f"Some students have no {FAST_MODEL} embedding; re-register them to evaluate the cascade")
+        return 1
+
+    total = arcface_correct = cascade_correct = 0
+    for label in sorted(os.listdir(args.folder)):
+        label_dir = os.path.join(args.folder, label)
+        if not os.path.isdir(label_dir):
+            continue
+        expected = "Unknown" if label == "unknown" else label
+
+        for fname in sorted(os.listdir(label_dir)):
+            frame = cv2.imread(os.path.join(label_dir, fname))
+            if frame is None:
+                continue
+            face = extract_face(frame)
+            if face is None:
+                continue
+
+            arcface = matcher.match_arcface(face)
+            cascade = matcher.match(face)
+            if arcface is None or cascade is None:
+                continue
+
+            total += 1
+            arcface_correct += arcface[1] == expected
+            cascade_correct += cascade[1] == expected
+
+    if not total:
+        print("No usable faces found")
+        return 1
+
+    print(f"Faces evaluated: {total}")
+    print(f"ArcFace-only accuracy: {arcface_correct / total:.2%}")
+    print(f"Cascade accuracy:      {cascade_correct / total:.2%}")
+    print(matcher.report())
+    return 0
+
+
+def roster_command(argv):
+    parser = argparse.ArgumentParser(
+        prog="neuraface.py roster",
+        description="Manage courses, sections, enrolments and timetable slots."
+    )
+    sub = parser.add_subparsers(dest="action", required=True)
+
+    p = sub.add_parser("course", help="add or rename a course")
+    p.add_argument("course_id")
+    p.add_argument("course_name")
+
+    p = sub.add_parser("section", help="add or rename a section of a course")
+    p.add_argument("section_id")
+    p.add_argument("course_id")
+    p.add_argument("section_name")
+
+    p = sub.add_parser("enroll", help="add students to a section")
+    p.add_argument("section_id")
+    p.add_argument("student_ids", nargs="+")
+
+    p = sub.add_parser("slot", help="schedule a section (weekday 0 = Monday)")
+    p.add_argument("section_id")
+    p.add_argument("weekday", type=int, choices=range(7))
+    p.add_argument("start_time", help="HH:MM")
+    p.add_argument("end_time", help="HH:MM")
+    p.add_argument("--room")
+
+    sub.add_parser("show", help="list sections with roster sizes")
+
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(DB)
+    cur = conn.cursor()
+
+    if args.action == "course":
+        cur.execute("INSERT OR REPLACE INTO courses (course_id, course_name) VALUES (?, ?)",
+                    (args.course_id, args.course_name))
+    elif args.action == "section":
+        cur.execute("INSERT OR REPLACE INTO sections (section_id, course_id, section_name) VALUES (?, ?, ?)",
+                    (args.section_id, args.course_id, args.section_name))
+    elif args.action == "enroll":
+        cur.executemany("INSERT OR IGNORE INTO enrollments (section_id, student_id) VALUES (?, ?)",
+                        [(args.section_id, sid) for sid in args.student_ids])
+    elif args.action == "slot":
+        cur.execute("""
+            INSERT INTO timetable (section_id, weekday, start_time, end_time, room)
+            VALUES (?, ?, ?, ?, ?)
+        """, (args.section_id, args.weekday, args.start_time, args.end_time, args.room))
+    else:
+        cur.execute("""
+            SELECT s.section_id, c.course_name, s.section_name, COUNT(e.student_id)
+            FROM sections s
+            JOIN courses c ON c.course_id = s.course_id
+            LEFT JOIN enrollments e ON e.section_id = s.section_id
+            GROUP BY s.section_id
+            ORDER BY c.course_name, s.section_name
+        """)
+        for section_id, course_name, section_name, count in cur.fetchall():
+            print(f"{section_id}\t{course_name} – {section_name}\t{count} students")
+
+    conn.commit()
+    conn.close()
+    return 0
+
+
+def synthetic_gallery(size, dim=512, seed=0):
+    # Unit directions sharing a common component, scaled to ArcFace-like norms,
+    # so impostor distances sit close to THRESHOLD instead of far beyond it.
+    rng = np.random.default_rng(seed)
+    common = rng.standard_normal(dim).astype(np.float32)
+    gallery = rng.standard_normal((size, dim)).astype(np.float32) + 0.6 * common
+    gallery /= np.linalg.norm(gallery, axis=1, keepdims=True)
+    return gallery * 4.0, rng
+
+
+def bench_quant_command(argv):
+    parser = argparse.ArgumentParser(
+        prog="neuraface.py bench-quant",
+        description="Memory and accuracy of quantized galleries on a synthetic benchmark."
+    )
+    parser.add_argument("--size", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--noise", type=float, default=0.08,
+                        help="per-dimension noise added to a gallery row to make a probe")
+    args = parser.parse_args(argv)
+
+    gallery, rng = synthetic_gallery(args.size)
+    truth = rng.integers(0, args.size, args.queries)
+    probes = gallery[truth] + rng.normal(0, args.noise, (args.queries, gallery.shape[1])).astype(np.float32)
+
+    exact_ids = np.empty(args.queries, dtype=np.intp)
+    start = time.perf_counter()
+    for i, probe in enumerate(probes):
+        exact_ids[i] = np.argmin(np.linalg.norm(gallery - probe, axis=1))
+    exact_ms = (time.perf_counter() - start) * 1000 / args.queries
+
+    print(f"Gallery: {args.size} x {gallery.shape[1]}, {args.queries} probes")
+    print(f"{'storage':<10}{'MiB':>9}{'saving':>9}{'approx top-1':>14}{'re-ranked':>11}{'ms/query':>10}")
+    print(f"{'float32':<10}{gallery.nbytes / 2**20:>9.1f}{'-':>9}{'-':>14}"
+          f"{np.mean(exact_ids == truth):>11.2%}{exact_ms:>10.2f}")
+
+    fetch = lambda idxs: gallery[idxs]
+    for storage in ("float16", "int8"):
+        quantized = [quantize_embedding(row, storage) for row in gallery]
+        qgallery = QuantizedGallery(np.vstack([q for q, _ in quantized]),
+                                    np.array([scale for _, scale in quantized], dtype=np.float32))
+
+        approx_hits = reranked_hits = 0
+        start = time.perf_counter()
+        for i, probe in enumerate(probes):
+            best_idx, _, _ = rerank_search(qgallery, probe, None, fetch)
+            reranked_hits += best_idx == exact_ids[i]
+        per_query = (time.perf_counter() - start) * 1000 / args.queries
+        for i, probe in enumerate(probes):
+            approx_hits += np.argmin(qgallery.distances(probe)) == exact_ids[i]
+
+        print(f"{storage:<10}{qgallery.nbytes / 2**20:>9.1f}"
+              f"{1 - qgallery.nbytes / gallery.nbytes:>9.0%}"
+              f"{approx_hits / args.queries:>14.2%}{reranked_hits / args.queries:>11.2%}{per_query:>10.2f}")
+
+    print("approx top-1 / re-ranked: agreement with the exact float32 search")
+    return 0
+
+
+def bench_shards_command(argv):
+    parser = argparse.ArgumentParser(
+        prog="neuraface.py bench-shards",
+        description="Exact gallery search latency vs shard count on a synthetic gallery."
+    )
+    parser.add_argument("--size", type=int, default=500000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--shards", type=int, nargs="+",
+                        default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    parser.add_argument("--chunk", type=int, default=SHARD_CHUNK)
+    args = parser.parse_args(argv)
+
+    gallery, rng = synthetic_gallery(args.size)
+    truth = rng.integers(0, args.size, args.queries)
+    probes = gallery[truth] + rng.normal(0, 0.08, (args.queries, gallery.shape[1])).astype(np.float32)
+
+    start = time.perf_counter()
+    expected = [np.argmin(np.linalg.norm(gallery - probe, axis=1)) for probe in probes]
+    baseline_ms = (time.perf_counter() - start) * 1000 / args.queries
+
+    print(f"Gallery: {args.size} x {gallery.shape[1]} ({gallery.nbytes / 2**20:.0f} MiB), "
+          f"{args.queries} queries, {os.cpu_count()} CPUs")
+    print(f"{'search':<14}{'ms/query':>10}{'speed-up':>10}{'per shard':>11}{'temp MiB':>10}{'agree':>8}")
+    print(f"{'norm(g - e)':<14}{baseline_ms:>10.2f}{'1.00x':>10}{'-':>11}"
+          f"{gallery.nbytes / 2**20:>10.1f}{'-':>8}")
+
+    first = None
+    for shards in args.shards:
+        sharded = ShardedGallery(gallery, shards, args.chunk)
+        sharded.topk(probes[0])  # start the pool threads
+
+        start = time.perf_counter()
+        found = [sharded.topk(probe, 2)[0][0] for probe in probes]
+        ms = (time.perf_counter() - start) * 1000 / args.queries
+        first = first or ms * len(sharded.shards)
+        temp = sum(b.nbytes for b in sharded.buffers) / 2**20
+        agree = np.mean(np.array(found) == np.array(expected))
+        print(f"{f'{len(sharded.shards)} shards':<14}{ms:>10.2f}{baseline_ms / ms:>9.2f}x"
+              f"{first / (ms * len(sharded.shards)):>10.0%}{temp:>10.1f}{agree:>8.0%}")
+        sharded.close()
+
+    print("speed-up: vs norm(g - e); per shard: scaling efficiency vs the first row")
+    return 0
+
+
+def gallery_report_command(argv):
+    parser = argparse.ArgumentParser(
+        prog="neuraface.py gallery-report",
+        description="All-pairs distance analysis of the registered gallery: impostor distance "
+                    "distribution, suggested thresholds and likely duplicate enrolments."
+    )
+    parser.add_argument("--synthetic", type=int, metavar="N",
+                        help="analyse a synthetic N-student gallery instead of the database")
+    parser.add_argument("--block", type=int, default=GALLERY_BLOCK)
+    parser.add_argument("--duplicate-threshold", type=float, default=DUPLICATE_THRESHOLD)
+    parser.add_argument("--show", type=int, default=20, help="duplicate pairs to list")
+    args = parser.parse_args(argv)
+
+    if args.synthetic:
+        embeddings, _ = synthetic_gallery(args.synthetic)
+        ids = [f"S{i:06d}" for i in range(args.synthetic)]
+        names = ids
+    else:
+        try:
+            ids, names, embeddings = load_all_students_faces()
+        except ValueError:
+            print("No students registered")
+            return 1
+    if len(ids) < 2:
+        print("Need at least two students")
+        return 1
+
+    start = time.perf_counter()
+    analysis = analyze_gallery(embeddings, args.duplicate_threshold, args.block)
+    elapsed = time.perf_counter() - start
+
+    n = len(ids)
+    print(f"Gallery: {n} students, {analysis.pairs} pairs in {elapsed:.1f} s "
+          f"({analysis.pairs / elapsed / 1e6:.0f}M pairs/s, {args.block}x{args.block} tiles)")
+
+    print("\nImpostor distances (every pair of different students):")
+    for q in (0.0001, 0.001, 0.01, 0.05, 0.5):
+        print(f"  {q:>7.2%} of pairs closer than {analysis.threshold_at(q):.2f}")
+    print("Nearest other student, per student:")
+    for q in (0.01, 0.05, 0.5):
+        print(f"  {q:>7.0%} of students within {np.quantile(analysis.nearest, q):.2f}")
+
+    print(f"\nCurrent THRESHOLD {THRESHOLD:.2f}: pair FAR {analysis.pair_far(THRESHOLD):.2e}, "
+          f"{np.mean(analysis.nearest < THRESHOLD):.2%} of students have a neighbour inside it")
+    # A probe is compared with all n students, so the 1:N false accept rate is ~n x pair FAR.
+    print("Suggested thresholds (1:N false accept rate of an unregistered face):")
+    for target in (0.01, 0.001):
+        print(f"  {target:>5.1%}: {analysis.threshold_at(target / n):.2f}")
+
+    print(f"\nLikely duplicate enrolments (distance < {args.duplicate_threshold:.2f}): "
+          f"{len(analysis.duplicates)}")
+    for a, b, dist in analysis.duplicates[:args.show]:
+        print(f"  {dist:6.2f}  {ids[a]} {names[a]}  <->  {ids[b]} {names[b]}")
+    return 0
+
+
+def match_boxes(found, reference, iou=0.5):
+    matched = 0
+    free = list(found)
+    for ref in reference:
+        best = max(free, key=lambda box: box_iou(box, ref), default=None)
+        if best is not None and box_iou(best, ref) >= iou:
+            free.remove(best)
+            matched += 1
+    return matched, len(free)
+
+
+def bench_tiles_command(argv):
+    parser = argparse.ArgumentParser(
+        prog="neuraface.py bench-tiles",
+        description="Latency and recall of tiled detection on high-resolution frames. Recall is "
+                    "measured against slow whole-frame detection at full resolution."
+    )
+    parser.add_argument("folder", help="folder of full-resolution classroom frames")
+    parser.add_argument("--tiles", type=int, nargs="+", default=[640, 960, 1280, 1920])
+    parser.add_argument("--overlap", type=float, default=DETECT_TILE_OVERLAP)
+    parser.add_argument("--workers", type=int, default=DETECT_WORKERS)
+    parser.add_argument("--downscale", type=int, default=1280,
+                        help="width of the downscaled single-pass baseline")
+    args = parser.parse_args(argv)
+
+    frames = []
+    for fname in sorted(os.listdir(args.folder)):
+        frame = cv2.imread(os.path.join(args.folder, fname))
+        if frame is not None:
+            frames.append(frame)
+    if not frames:
+        print("No readable frames")
+        return 1
+
+    def run(detect):
+        times, found = [], []
+        for frame in frames:
+            start = time.perf_counter()
+            found.append(detect(frame))
+            times.append((time.perf_counter() - start) * 1000)
+        return float(np.median(times)), found
+
+    def downscaled(frame):
+        scale = args.downscale / frame.shape[1]
+        small = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        return [tuple(int(v / scale) for v in box[:4]) for box in detect_boxes(small)]
+
+    full_ms, reference = run(lambda frame: [box[:4] for box in detect_boxes(frame)])
+    total = sum(len(boxes) for boxes in reference)
+    height, width = frames[0].shape[:2]
+    print(f"{len(frames)} frames of {width}x{height}, {total} faces found by whole-frame detection, "
+          f"{args.workers} workers, {args.overlap:.0%} overlap")
+    print(f"{'method':<22}{'ms/frame':>10}{'recall':>9}{'extra':>7}")
+
+    def row(label, ms, found):
+        matched = extra = 0
+        for boxes, ref in zip(found, reference):
+            m, e = match_boxes(boxes, ref)
+            matched += m
+            extra += e
+        recall = matched / total if total else 1.0
+        print(f"{label:<22}{ms:>10.0f}{recall:>9.1%}{extra:>7}")
+
+    row("whole frame", full_ms, reference)
+    row(f"downscaled to {args.downscale}", *run(downscaled))
+    for tile in args.tiles:
+        detector = TiledDetector(tile, args.overlap, args.workers, wait=True)
+        detector.detect(frames[0])  # start and warm the pool outside the timing
+        row(f"tiles {tile}", *run(detector.detect))
+        detector.close()
+
+    print("extra: faces not found by whole-frame detection (small faces it missed, or false positives)")
+    return 0
+
+
+def replay_command(argv):
+    parser = argparse.ArgumentParser(
+        prog="neuraface.py replay",
+        description="Feed a recorded scan session through the recognition pipeline. "
+                    "Runs headless as fast as possible unless --realtime or --gui is given."
+    )
+    parser.add_argument("recording")
+    parser.add_argument("--realtime", action="store_true", help="keep the recorded frame timing")
+    parser.add_argument("--gui", action="store_true", help="replay into the scan window")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="run N times and check that every run gives the same results")
+    parser.add_argument("--out", help="write per-frame results to this CSV")
+    parser.add_argument("--journal", help="also journal every recognition event to this file")
+    parser.add_argument("--memory", action="store_true",
+                        help="trace allocations and report per-stage growth after the first run")
+    parser.add_argument("--profile", help="sample stacks for all runs into this collapsed-stack file")
+    args = parser.parse_args(argv)
+
+    if args.gui:
+        app = QApplication(sys.argv)
+        home = NeuraFaceHome()
+        scan = ScanWindow(home, source=ReplaySource(args.recording, args.realtime))
+        scan.showMaximized()
+        return app.exec()
+
+    try:
+        matcher = build_matcher()
+    except ValueError:
+        print("No students registered")
+        return 1
+
+    journal = RecognitionJournal(args.journal) if args.journal else None
+    if args.memory:
+        tracemalloc.start(MEMORY_TRACE_DEPTH)
+    baseline = None
+    sampler = None
+    if args.profile:
+        sampler = SamplingProfiler(np.inf, path=args.profile)
+        sampler.start()
+    digests = []
+    # One detector for every run, so a tiled recording starts its pool once.
+    detector = TiledDetector(wait=True)
+    for run in range(args.repeat):
+        source = ReplaySource(args.recording, args.realtime)
+        decider = SequentialDecider()
+
+        rows, latencies = [], []
+        digest = hashlib.sha256()
+        while True:
+            frame = source.read()
+            if frame is None:
+                if source.finished:
+                    break
+                time.sleep(0.001)
+                continue
+
+            frame = prepare_frame(frame)
+            start = time.perf_counter()
+            results = recognize_frame(frame, detector, matcher, decider, journal, source.index)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+            for result in results:
+                rows.append((len(latencies) - 1, pipeline_clock.now(), *result))
+            digest.update(repr(results).encode())
+
+        source.close()
+        digests.append(digest.hexdigest())
+
+        if not latencies:
+            print("Recording has no frames")
+            detector.close()
+            return 1
+        decided = {row[7] for row in rows if row[6] not in (PENDING, "Unknown")}
+        print(f"Run {run + 1}: {len(latencies)} frames, {len(rows)} faces, "
+              f"median {np.median(latencies):.1f} ms/frame, p95 {np.percentile(latencies, 95):.1f} ms, "
+              f"recognised {sorted(decided)}, results {digests[-1][:16]}")
+
+        if args.memory:
+            # The first run loads models and fills caches; anything still
+            # growing on identical later runs is a leak.
+            gc.collect()
+            rss = rss_mib()
+            print(f"  RSS {rss:.0f} MiB" if rss is not None else "  RSS not available")
+            if baseline is None:
+                baseline = take_snapshot()
+            else:
+                print(f"  Growth since run 1:\n{allocation_growth(baseline, take_snapshot())}")
+    detector.close()
+
+    if args.out:
+        with open(args.out, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["frame", "t", "x", "y", "w", "h", "name", "student_id", "distance"])
+            writer.writerows(rows)
+
+    print(decider.report())
+    if sampler is not None:
+        sampler.stop()
+    if journal is not None:
+        journal.close()
+        print(journal.report())
+    if args.memory and args.repeat < 2:
+        print("Use --repeat 2 or more to see memory growth between runs")
+    if len(set(digests)) > 1:
+        print("Runs disagree: recognition is not deterministic for this recording")
+        return 1
+    return 0
+
+
+def read_profile(path):
+    stages, functions, total = {}, {}, 0
+    with open(path) as f:
+        for line in f:
+            stack, _, count = line.rstrip("\n").rpartition(" ")
+            if not stack:
+                continue
+            count = int(count)
+            frames = stack.split(";")
+            stages[frames[0]] = stages.get(frames[0], 0) + count
+            functions[frames[-1]] = functions.get(frames[-1], 0) + count
+            total += count
+    return stages, functions, total
+
+
+def profile_compare_command(argv):
+    parser = argparse.ArgumentParser(
+        prog="neuraface.py profile-compare",
+        description="Compare collapsed-stack profiles (from SIGUSR2, Ctrl+Shift+P or replay --profile) "
+                    "side by side: share of samples per pipeline stage and the busiest functions."
+    )
+    parser.add_argument("profiles", nargs="+")
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args(argv)
+
+    profiles = [read_profile(path) for path in args.profiles]
+    labels = [Path(path).stem[-24:] for path in args.profiles]
+    width = max(10, *(len(label) + 2 for label in labels))
+    share = lambda counts, key, total: f"{counts.get(key, 0) / total:.1%}" if total else "-"
+
+    print(f"{'stage':<12}" + "".join(f"{label:>{width}}" for label in labels))
+    for stage in ("capture", "detect", "embed", "match", "render", "db", "other"):
+        print(f"{stage:<12}" + "".join(f"{share(s, stage, t):>{width}}" for s, _, t in profiles))
+    print(f"{'samples':<12}" + "".join(f"{t:>{width}}" for _, _, t in profiles))
+
+    busiest = {}
+    for _, functions, total in profiles:
+        for function, count in functions.items():
+            busiest[function] = max(busiest.get(function, 0), count / total if total else 0)
+    print("\nBusiest functions (share of samples where they are on top of the stack):")
+    for function in sorted(busiest, key=busiest.get, reverse=True)[:args.top]:
+        print(f"{function[:60]:<60}" + "".join(f"{share(f, function, t):>{width}}" for _, f, t in profiles))
+    return 0
+
+
+def sync_command(argv):
+    parser = argparse.ArgumentParser(
+        prog="neuraface.py sync",
+        description="Push local changes to the central store and pull other kiosks' changes."
+    )
+    parser.add_argument("--central", default=SYNC_CENTRAL, required=SYNC_CENTRAL is None,
+                        help="central store (SQLite file)")
+    parser.add_argument("--kiosk", default=KIOSK_ID)
+    parser.add_argument("--batch", type=int, default=SYNC_BATCH)
+    args = parser.parse_args(argv)
+
+    if not SYNC_CENTRAL:
+        print("SYNC_CENTRAL is None, so local changes are not logged: pulling only")
+
+    conn = sqlite3.connect(DB)
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*) FROM change_log WHERE seq > ?", (get_meta(cur, "sync_pushed_seq", 0),))
+    pending = cur.fetchone()[0]
+    conn.close()
+
+    start = time.perf_counter()
+    try:
+        pushed, pulled = sync_once(SqliteCentralStore(args.central), args.kiosk, args.batch)
+    except (sqlite3.Error, OSError) as e:
+        print(f"Central store unavailable ({e}); {pending} local changes stay queued")
+        return 1
+    print(f"Kiosk {args.kiosk}: pushed {pushed} changes ({pending} log entries), "
+          f"pulled {pulled} in {time.perf_counter() - start:.2f} s")
+    return 0
+
+
+class StandInSinkHandler(http.server.BaseHTTPRequestHandler):
+    # Stand-in for the student information system: accepts outbox batches,
+    # dedupes on event key and fails a configurable share of requests.
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if random.random() < server.fail_rate:
+            server.failed += 1
+            self.send_response(503)
+            self.end_headers()
+            return
+
+        events = json.loads(body)["events"]
+        fresh = [event for event in events if event["key"] not in server.seen]
+        server.seen.update(event["key"] for event in fresh)
+        server.accepted += len(fresh)
+        server.duplicates += len(events) - len(fresh)
+        if server.out:
+            with open(server.out, "a") as f:
+                for event in fresh:
+                    f.write(json.dumps(event) + "\n")
+
+        reply = json.dumps({"accepted": len(fresh), "duplicates": len(events) - len(fresh)}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+        print(f"{self.headers.get('Idempotency-Key', '')[:12]}: {len(fresh)} accepted, "
+              f"{len(events) - len(fresh)} duplicates ({server.accepted} total, {server.failed} refused)")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def outbox_command(argv):
+    parser = argparse.ArgumentParser(
+        prog="neuraface.py outbox",
+        description="Inspect or deliver the attendance outbox, or run a local stand-in endpoint."
+    )
+    parser.add_argument("action", choices=["status", "deliver", "stand-in"])
+    parser.add_argument("--sink", default=OUTBOX_SINK, help="URL or file to deliver to (deliver)")
+    parser.add_argument("--timeout", type=float, default=60.0, help="give up delivering after this many seconds")
+    parser.add_argument("--port", type=int, default=8765, help="stand-in port")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of stand-in requests answered 503")
+    parser.add_argument("--out", help="stand-in: append accepted events to this file")
+    args = parser.parse_args(argv)
+
+    if args.action == "stand-in":
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", args.port), StandInSinkHandler)
+        server.fail_rate, server.out = args.fail_rate, args.out
+        server.seen, server.accepted, server.duplicates, server.failed = set(), 0, 0, 0
+        print(f"Stand-in endpoint on http://127.0.0.1:{args.port}/ (failing {args.fail_rate:.0%}); Ctrl+C to stop")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        server.server_close()
+        print(f"{server.accepted} events accepted, {server.duplicates} duplicates, {server.failed} refused")
+        return 0
+
+    if args.action == "deliver":
+        if not args.sink:
+            print("No sink: set OUTBOX_SINK or pass --sink")
+            return 1
+        publisher = OutboxPublisher(open_outbox_sink(args.sink), interval=0.5)
+        publisher.start()
+        deadline = time.time() + args.timeout
+        while outbox_status()[0] and time.time() < deadline:
+            time.sleep(0.5)
+        publisher.stop()
+        print(publisher.report())
+
+    pending, failing, oldest, delivered, error = outbox_status()
+    print(f"{pending} pending ({failing} retrying, oldest marked {oldest or '-'}), {delivered} delivered")
+    if error:
+        print(f"Last error: {error}")
+    return 1 if args.action == "deliver" and pending else 0
+
+
+def export_command(argv):
+    parser = argparse.ArgumentParser(
+        prog="neuraface.py export",
+        description="Stream attendance to CSV, Parquet or Arrow (chosen by the file extension)."
+    )
+    parser.add_argument("output")
+    parser.add_argument("--from", dest="start", default="0000-01-01")
+    parser.add_argument("--to", dest="end", default="9999-12-31")
+    parser.add_argument("--matrix", action="store_true", help="student x date matrix instead of raw rows")
+    args = parser.parse_args(argv)
+
+    def progress(done, total):
+        print(f"\r{done:,} / {total:,}", end="", flush=True)
+
+    start = time.perf_counter()
+    try:
+        rows = export_attendance(args.output, args.start, args.end, args.matrix, progress)
+    except RuntimeError as e:
+        print(e)
+        return 1
+    print(f"\nExported {rows:,} rows to {args.output} "
+          f"({os.path.getsize(args.output) / 2**20:.1f} MiB) in {time.perf_counter() - start:.1f} s")
+    return 0
+
+
+def journal_command(argv):
+    parser = argparse.ArgumentParser(
+        prog="neuraface.py journal",
+        description="Query the recognition journal: summaries, distance statistics for "
+                    "tuning THRESHOLD, per-student audit trails and event replay."
+    )
+    parser.add_argument("--journal", default=JOURNAL_PATH or "journal.db")
+    parser.add_argument("--since", help="ISO date/time, e.g. 2026-03-01 or 2026-03-01T09:00")
+    parser.add_argument("--until", help="ISO date/time")
+    parser.add_argument("--camera")
+    sub = parser.add_subparsers(dest="action", required=True)
+    sub.add_parser("summary", help="event counts, outcomes and stage latencies")
+    sub.add_parser("distances", help="distance and margin statistics around THRESHOLD")
+    p = sub.add_parser("student", help="every event whose outcome or nearest match is this student")
+    p.add_argument("student_id")
+    p = sub.add_parser("replay", help="print events in order, optionally paced in real time")
+    p.add_argument("--realtime", action="store_true")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.journal):
+        print(f"No journal at {args.journal}")
+        return 1
+    conn = sqlite3.connect(f"file:{args.journal}?mode=ro", uri=True)
+    cur = conn.cursor()
+
+    where, params = ["1"], []
+    if args.since:
+        where.append("ts >= ?")
+        params.append(datetime.fromisoformat(args.since).timestamp())
+    if args.until:
+        where.append("ts < ?")
+        params.append(datetime.fromisoformat(args.until).timestamp())
+    if args.camera:
+        where.append("camera = ?")
+        params.append(args.camera)
+    if args.action == "student":
+        where.append("(outcome = ? OR nearest_id = ?)")
+        params += [args.student_id, args.student_id]
+    clause = " AND ".join(where)
+
+    def stamp(ts):
+        return datetime.fromtimestamp(ts).isoformat(sep=" ", timespec="milliseconds")
+
+    if args.action == "summary":
+        cur.execute(f"SELECT COUNT(*), MIN(ts), MAX(ts), COUNT(DISTINCT camera) FROM recognition_events WHERE {clause}",
+                    params)
+        count, first, last, cameras = cur.fetchone()
+        if not count:
+            print("No events")
+            return 0
+        print(f"{count} events from {stamp(first)} to {stamp(last)} on {cameras} camera(s)")
+
+        cur.execute(f"""
+            SELECT stage, COUNT(*), AVG(embed_ms), AVG(search_ms) FROM recognition_events
+            WHERE {clause} GROUP BY stage ORDER BY COUNT(*) DESC
+        """, params)
+        print(f"{'stage':<13}{'events':>8}{'embed ms':>10}{'search ms':>11}")
+        for stage, n, embed_ms, search_ms in cur.fetchall():
+            print(f"{stage:<13}{n:>8}{embed_ms:>10.1f}{search_ms:>11.2f}")
+
+        cur.execute(f"SELECT detect_ms FROM recognition_events WHERE {clause}", params)
+        detect = np.array([row[0] for row in cur.fetchall()])
+        print(f"detect ms: median {np.median(detect):.1f}, p95 {np.percentile(detect, 95):.1f}, "
+              f"max {detect.max():.1f}")
+
+        cur.execute(f"""
+            SELECT outcome, COUNT(*) FROM recognition_events
+            WHERE {clause} AND stage != 'tracked' GROUP BY outcome ORDER BY COUNT(*) DESC LIMIT 15
+        """, params)
+        print("outcomes of matched faces:", ", ".join(f"{o} {n}" for o, n in cur.fetchall()))
+
+    elif args.action == "distances":
+        cur.execute(f"""
+            SELECT distance, margin, outcome FROM recognition_events
+            WHERE {clause} AND stage = 'arcface'
+        """, params)
+        rows = cur.fetchall()
+        if not rows:
+            print("No ArcFace matches")
+            return 0
+        dist = np.array([r[0] for r in rows])
+        margin = np.array([r[1] if r[1] is not None else np.inf for r in rows])
+        print(f"{len(rows)} ArcFace matches; THRESHOLD {THRESHOLD:.2f}")
+        print("distance quantiles: " + ", ".join(
+            f"p{q} {np.percentile(dist, q):.2f}" for q in (1, 5, 25, 50, 75, 95, 99)))
+        accepted = dist < THRESHOLD
+        print(f"accepted {accepted.mean():.1%}; within 0.5 of THRESHOLD (borderline) "
+              f"{(np.abs(dist - THRESHOLD) < 0.5).mean():.1%}")
+        if accepted.any():
+            finite = margin[accepted & np.isfinite(margin)]
+            if len(finite):
+                print(f"accepted matches with second-best margin < 1.0 (possible confusions): "
+                      f"{(finite < 1.0).mean():.1%}")
+        edges = np.linspace(0, max(dist.max(), THRESHOLD * 2), 21)
+        counts, _ = np.histogram(dist, edges)
+        peak = counts.max()
+        for lo, n in zip(edges, counts):
+            bar = "#" * int(40 * n / peak) if peak else ""
+            mark = " <- THRESHOLD" if lo <= THRESHOLD < lo + edges[1] else ""
+            print(f"  {lo:6.2f} {n:>7} {bar}{mark}")
+
+    else:
+        cur.execute(f"""
+            SELECT ts, camera, track, stage, outcome, nearest_id, distance, margin
+            FROM recognition_events WHERE {clause} ORDER BY ts
+        """, params)
+        previous = None
+        for ts, camera, track, stage, outcome, nearest, dist, margin in cur:
+            if args.action == "replay" and args.realtime and previous is not None:
+                time.sleep(min(ts - previous, 5.0))
+            previous = ts
+            margin = "-" if margin is None else f"{margin:.2f}"
+            print(f"{stamp(ts)}  cam {camera}  track {track:>4}  {stage:<11} {outcome:<10} "
+                  f"nearest {nearest}  dist {dist:.2f}  margin {margin}")
+
+    conn.close()
+    return 0
+
+
+def timed(fn, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def bench_reports_command(argv):
+    global DB
+
+    parser = argparse.ArgumentParser(
+        prog="neuraface.py bench-reports",
+        description="Benchmark attendance reports on a synthetic multi-year database."
+    )
+    parser.add_argument("--students", type=int, default=2000)
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--db", default="bench_reports.db")
+    args = parser.parse_args(argv)
+
+    if os.path.exists(args.db):
+        os.remove(args.db)
+    DB = args.db
+    for path, _, _ in archive_files():
+        os.remove(path)
+    init_db()
+
+    today = date.today()
+    days = [today - timedelta(days=i) for i in range(args.years * 365)]
+    days = sorted(d.isoformat() for d in days if d.weekday() < 5)
+    ids = [f"S{i:06d}" for i in range(args.students)]
+    rng = np.random.default_rng(0)
+
+    conn = sqlite3.connect(DB)
+    cur = conn.cursor()
+    cur.executemany(
+        "INSERT INTO students (student_id, student_name, embedding) VALUES (?, ?, x'')",
+        [(sid, f"Student {sid}") for sid in ids]
+    )
+    start = time.perf_counter()
+    for day in days:
+        present = rng.random(args.students) < 0.85
+        cur.executemany(
+            "INSERT INTO attendance (student_id, attendance_date, is_present) VALUES (?, ?, TRUE)",
+            [(sid, day) for sid, p in zip(ids, present) if p]
+        )
+    conn.commit()
+    load_s = time.perf_counter() - start
+
+    cur.execute("SELECT COUNT(*) FROM attendance")
+    total_rows = cur.fetchone()[0]
+    print(f"{args.students} students, {len(days)} class days, {total_rows} attendance rows "
+          f"({os.path.getsize(DB) / 2**20:.1f} MiB), loaded with triggers in {load_s:.1f} s")
+
+    year_start = (today - timedelta(days=365)).isoformat()
+    month_start = (today - timedelta(days=30)).isoformat()
+    end = today.isoformat()
+
+    def raw_percentages():
+        cur.execute("""
+            SELECT student_id, COUNT(*) FROM attendance NOT INDEXED
+            WHERE attendance_date BETWEEN ? AND ? AND is_present
+            GROUP BY student_id
+        """, (year_start, end))
+        cur.fetchall()
+        cur.execute("""
+            SELECT COUNT(DISTINCT attendance_date) FROM attendance NOT INDEXED
+            WHERE attendance_date BETWEEN ? AND ?
+        """, (year_start, end))
+        cur.fetchall()
+
+    def raw_counts():
+        cur.execute("""
+            SELECT attendance_date, COUNT(*) FROM attendance NOT INDEXED
+            WHERE attendance_date BETWEEN ? AND ? AND is_present
+            GROUP BY attendance_date
+        """, (year_start, end))
+        cur.fetchall()
+
+    def raw_matrix():
+        cur.execute("""
+            SELECT student_id, attendance_date FROM attendance NOT INDEXED
+            WHERE attendance_date BETWEEN ? AND ? AND is_present
+        """, (month_start, end))
+        cur.fetchall()
+
+    reports = [
+        ("attendance % (1 year)", raw_percentages, lambda: student_attendance_percentages(year_start, end)),
+        ("daily counts (1 year)", raw_counts, lambda: daily_attendance_counts(year_start, end)),
+        ("date matrix (30 days)", raw_matrix, lambda: attendance_matrix(month_start, end)),
+    ]
+    print(f"{'report':<24}{'table scan ms':>15}{'indexed/summary ms':>20}")
+    for label, raw, fast in reports:
+        print(f"{label:<24}{timed(raw):>15.1f}{timed(fast):>20.1f}")
+
+    cur.execute("""
+        SELECT COUNT(*) FROM attendance_daily d
+        WHERE present_count != (SELECT COUNT(*) FROM attendance a
+                                WHERE a.attendance_date = d.attendance_date AND a.is_present)
+    """)
+    print("summaries consistent" if cur.fetchone()[0] == 0 else "summaries INCONSISTENT")
+    conn.close()
+    return 0
+
+
+def compact_db_command(argv):
+    parser = argparse.ArgumentParser(
+        prog="neuraface.py compact-db",
+        description="VACUUM the database, e.g. after face images were moved out of the students table."
+    )
+    parser.parse_args(argv)
+
+    before = os.path.getsize(DB)
+    conn = sqlite3.connect(DB)
+    conn.execute("VACUUM")
+    conn.close()
+    print(f"{DB}: {before / 2**20:.1f} MiB -> {os.path.getsize(DB) / 2**20:.1f} MiB")
+    return 0
+
+
+def hot_path_timings(today):
+    conn = sqlite3.connect(DB)
+    cur = conn.cursor()
+    cur.execute("SELECT student_id FROM students LIMIT 1")
+    student = cur.fetchone()
+
+    def register():
+        cur.execute("""
+            SELECT s.student_name, COALESCE(a.is_present, 0)
+            FROM students s
+            LEFT JOIN attendance a ON s.student_id = a.student_id AND a.attendance_date = ?
+        """, (today,))
+        cur.fetchall()
+
+    def mark():
+        cur.execute("BEGIN")
+        cur.execute("""
+            INSERT INTO attendance (student_id, attendance_date, is_present) VALUES (?, ?, TRUE)
+            ON CONFLICT(student_id, attendance_date) DO UPDATE SET is_present = excluded.is_present
+        """, (student[0], today))
+        conn.rollback()
+
+    today_state = TodayAttendance()
+    timings = {
+        "daily register": timed(register, 5),
+        "here-today refresh": timed(today_state.refresh, 5),
+        "term attendance %": timed(lambda: student_attendance_percentages(period_start(today), today), 5),
+    }
+    if student is not None:
+        timings["mark attendance"] = timed(mark, 5)
+    today_state.close()
+    conn.close()
+    return timings
+
+
+def archive_command(argv):
+    parser = argparse.ArgumentParser(
+        prog="neuraface.py archive",
+        description="Move attendance from before the current term into per-period archive files, "
+                    "then compare hot-path query times and database size before and after."
+    )
+    parser.add_argument("--today", help="archive as if today were this date (YYYY-MM-DD)")
+    parser.add_argument("--no-vacuum", action="store_true", help="leave the freed pages in the database file")
+    args = parser.parse_args(argv)
+
+    if not ARCHIVE_DIR:
+        print("ARCHIVE_DIR is None: archiving is disabled")
+        return 1
+    # Cheap enough to run from cron every night: skip the timings when no term has ended.
+    if not archive_due(args.today):
+        print("Nothing from before the current term to archive")
+        return 0
+
+    conn = sqlite3.connect(DB)
+    today = args.today or conn.execute("SELECT DATE('now')").fetchone()[0]
+    hot_rows = lambda: conn.execute("SELECT COUNT(*) FROM attendance").fetchone()[0]
+    rows_before, size_before = hot_rows(), os.path.getsize(DB)
+    before = hot_path_timings(today)
+
+    start = time.perf_counter()
+    moved = archive_attendance(today)
+    elapsed = time.perf_counter() - start
+    if not moved:
+        print(f"Nothing before {period_start(today)} to archive")
+    for path, rows in moved:
+        print(f"{path}: {rows} rows moved, {os.path.getsize(path) / 2**20:.1f} MiB")
+
+    if moved and not args.no_vacuum:
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    after = hot_path_timings(today)
+
+    print(f"Archived in {elapsed:.1f} s; hot database keeps {period_start(today)} onwards")
+    print(f"{'':<22}{'before':>12}{'after':>12}")
+    print(f"{'attendance rows':<22}{rows_before:>12}{hot_rows():>12}")
+    print(f"{'database MiB':<22}{size_before / 2**20:>12.1f}{os.path.getsize(DB) / 2**20:>12.1f}")
+    for name, ms in before.items():
+        print(f"{name + ' ms':<22}{ms:>12.2f}{after[name]:>12.2f}")
+    conn.close()
+    return 0
+
+
+def bulk_worker_init():
+    # Build the models once per worker so every photo after the first is warm.
+    # A failing initializer makes Pool respawn workers forever, so errors are
+    # left to surface per photo as "embedding failed".
+    try:
+        DeepFace.build_model("ArcFace")
+        DeepFace.build_model(FAST_MODEL)
+    except Exception as e:
+        print(f"Model warm-up failed: {e}")
+
+
+def bulk_embed(task):
+    sid, name, path = task
+    frame = cv2.imread(path)
+    if frame is None:
+        return sid, name, path, None, "cannot read image"
+
+    face = extract_face(frame)
+    if face is None:
+        return sid, name, path, None, "no face detected"
+
+    emb = get_embedding(face, use_cache=False)
+    fast_emb = get_embedding(face, FAST_MODEL, use_cache=False)
+    if emb is None:
+        return sid, name, path, None, "embedding failed"
+
+    ok, buf = cv2.imencode(".png", face)
+    return sid, name, path, (buf.tobytes(), emb, fast_emb), None
+
+
+def bulk_import_command(argv):
+    parser = argparse.ArgumentParser(
+        prog="neuraface.py bulk-import",
+        description="Register students from a CSV with columns id,name,photo. "
+                    "Students already in the database are skipped, so an interrupted import can be re-run."
+    )
+    parser.add_argument("csv_path")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    parser.add_argument("--batch", type=int, default=100, help="students per transaction")
+    parser.add_argument("--failures", help="CSV to write failed rows to (default: <csv>.failures.csv)")
+    args = parser.parse_args(argv)
+
+    base_dir = os.path.dirname(os.path.abspath(args.csv_path))
+    with open(args.csv_path, newline="", encoding="utf-8") as f:
+        rows = [(r["id"].strip(), r["name"].strip(), os.path.join(base_dir, r["photo"].strip()))
+                for r in csv.DictReader(f)]
+
+    conn = sqlite3.connect(DB)
+    cur = conn.cursor()
+    cur.execute("SELECT student_id FROM students")
+    existing = {row[0] for row in cur.fetchall()}
+
+    tasks = [row for row in rows if row[0] not in existing]
+    print(f"{len(rows)} rows, {len(rows) - len(tasks)} already registered, "
+          f"{len(tasks)} to import with {args.workers} workers")
+
+    failures_path = args.failures or os.path.splitext(args.csv_path)[0] + ".failures.csv"
+    failures = []
+    imported = 0
+    pending = 0
+    start = time.perf_counter()
+
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(args.workers, initializer=bulk_worker_init) as pool:
+        for done, (sid, name, path, result, error) in enumerate(
+                pool.imap_unordered(bulk_embed, tasks, chunksize=4), 1):
+            if error is None:
+                try:
+                    insert_student(cur, sid, name, *result)
+                    pending += 1
+                except sqlite3.IntegrityError as e:
+                    error = f"duplicate id ({e})"
+            if error is not None:
+                failures.append((sid, path, error))
+
+            if pending >= args.batch or done == len(tasks):
+                conn.commit()
+                imported += pending
+                pending = 0
+                rate = done / (time.perf_counter() - start)
+                eta = (len(tasks) - done) / rate if rate else 0
+                print(f"{done}/{len(tasks)} processed, {imported} imported, {len(failures)} failed, "
+                      f"{rate:.1f} photos/s, ETA {eta:.0f} s")
+
+    conn.commit()
+    conn.close()
+
+    if failures:
+        with open(failures_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["id", "photo", "error"])
+            writer.writerows(failures)
+        print(f"{len(failures)} failures written to {failures_path}")
+
+    elapsed = time.perf_counter() - start
+    print(f"Imported {imported} students in {elapsed:.1f} s")
+    return 1 if failures else 0
+
+
+def reembed_worker(task):
+    sid, image = task
+    face = cv2.imdecode(np.frombuffer(image, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if face is None:
+        return sid, None, None, "cannot decode stored image"
+
+    emb = get_embedding(face, use_cache=False)
+    if emb is None:
+        return sid, None, None, "embedding failed"
+    fast_emb = get_embedding(face, FAST_MODEL, use_cache=False)
+
+    emb = np.array(emb, dtype=np.float32).tobytes()
+    if fast_emb is not None:
+        fast_emb = np.array(fast_emb, dtype=np.float32).tobytes()
+    return sid, emb, fast_emb, None
+
+
+def reembed_command(argv):
+    parser = argparse.ArgumentParser(
+        prog="neuraface.py reembed",
+        description=f"Re-embed stored faces made by another model version into {EMBEDDING_VERSION}. "
+                    "Progress is staged, so the command can be interrupted and re-run; kiosks "
+                    "keep using the old gallery until every face is done and it is swapped in."
+    )
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    parser.add_argument("--batch", type=int, default=REEMBED_BATCH)
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(DB, isolation_level=None)
+    cur = conn.cursor()
+
+    # Staged rows from an older target are useless now.
+    cur.execute("DELETE FROM embedding_migration WHERE version != ?", (EMBEDDING_VERSION,))
+    cur.execute("""
+        SELECT s.student_id FROM students s
+        WHERE s.embedding_version IS NOT ?
+          AND s.student_id NOT IN (SELECT student_id FROM embedding_migration)
+    """, (EMBEDDING_VERSION,))
+    todo = [row[0] for row in cur.fetchall()]
+    cur.execute("SELECT COUNT(*) FROM embedding_migration")
+    staged = cur.fetchone()[0]
+    print(f"Target {EMBEDDING_VERSION}: {len(todo)} to re-embed, {staged} already staged")
+
+    def tasks():
+        # Pool pulls this generator on its task-handler thread, and sqlite3
+        # objects are tied to the thread that made them: use a connection of its own.
+        read = sqlite3.connect(DB)
+        try:
+            for start in range(0, len(todo), args.batch):
+                chunk = todo[start:start + args.batch]
+                marks = ",".join("?" * len(chunk))
+                rows = read.execute(f"""
+                    SELECT student_id, COALESCE(original, thumbnail) FROM student_images
+                    WHERE student_id IN ({marks})
+                """, chunk).fetchall()
+                yield from rows
+        finally:
+            read.close()
+
+    failures = []
+    pending = []
+    start = time.perf_counter()
+    done = 0
+
+    def flush():
+        if not pending:
+            return
+        cur.execute("BEGIN")
+        cur.executemany("""
+            INSERT OR REPLACE INTO embedding_migration (student_id, version, embedding, fast_embedding)
+            VALUES (?, ?, ?, ?)
+        """, pending)
+        cur.execute("COMMIT")
+        pending.clear()
+
+    if todo:
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Pool(args.workers, initializer=bulk_worker_init) as pool:
+            for sid, emb, fast_emb, error in pool.imap_unordered(reembed_worker, tasks(), chunksize=4):
+                done += 1
+                if error is None:
+                    pending.append((sid, EMBEDDING_VERSION, emb, fast_emb))
+                else:
+                    failures.append((sid, error))
+                if len(pending) >= args.batch:
+                    flush()
+                    rate = done / (time.perf_counter() - start)
+                    print(f"{done}/{len(todo)} re-embedded, {len(failures)} failed, {rate:.1f} faces/s")
+        flush()
+
+    cur.execute("SELECT COUNT(*) FROM students WHERE embedding_version IS NOT ?", (EMBEDDING_VERSION,))
+    stale = cur.fetchone()[0]
+    cur.execute("SELECT COUNT(*) FROM embedding_migration")
+    staged = cur.fetchone()[0]
+
+    for sid, error in failures:
+        print(f"  {sid}: {error}")
+    if staged < stale:
+        print(f"{stale - staged} students could not be re-embedded; the old gallery stays active. "
+              "Fix or re-register them and run reembed again.")
+        conn.close()
+        return 1
+
+    swapped = swap_in_migrated_embeddings(cur) if staged else 0
+    conn.close()
+    print(f"Swapped in {swapped} re-embedded students in {time.perf_counter() - start:.1f} s")
+
+    # Students registered before the cascade existed have no fast embedding yet.
+    filled, failed = backfill_fast_embeddings()
+    if filled or failed:
+        print(f"{FAST_MODEL} embeddings filled in for {filled} students, {failed} failed")
+    return 0
+
+
+def synthetic_face_png(rng, size=224):
+    face = np.full((size, size, 3), 90, dtype=np.uint8)
+    cv2.ellipse(face, (size // 2, size // 2), (size // 3, size // 2 - 10), 0, 0, 360,
+                [int(c) for c in rng.integers(120, 220, 3)], -1)
+    for x in (size // 3, 2 * size // 3):
+        cv2.circle(face, (x, size * 2 // 5), size // 20, (40, 40, 40), -1)
+    noise = rng.normal(0, 6, face.shape)
+    face = np.clip(face + noise, 0, 255).astype(np.uint8)
+    ok, buf = cv2.imencode(".png", face)
+    return buf.tobytes()
+
+
+def kiosk_load_worker(task):
+    # One simulated kiosk: scans (match + attendance write), registrations
+    # (duplicate check + insert) and gallery reloads at fixed rates, all
+    # through the real DB functions. Only the embedder is fake.
+    global DB, get_embedding
+    kiosk, db, start_at, duration, rates, seed = task
+    DB = db
+    rng = np.random.default_rng(seed)
+
+    ids, names, embeddings = load_all_students_faces()
+    matcher = CascadeMatcher(ids, names, embeddings)
+
+    def fake_embedding(face, model_name="ArcFace", use_cache=True):
+        # The "face" is the index of the gallery row it should resemble.
+        row = embeddings[int(face[0, 0]) % len(embeddings)]
+        return row + rng.normal(0, 0.05, row.shape).astype(np.float32)
+    get_embedding = fake_embedding
+
+    def locked_write(write, *args):
+        # The real insert, in a transaction that takes the write lock up front
+        # so the time queued on it is measured apart from the work itself.
+        conn = sqlite3.connect(DB)
+        try:
+            start = time.perf_counter()
+            conn.execute("BEGIN IMMEDIATE")
+            waited = (time.perf_counter() - start) * 1000
+            write(conn.cursor(), *args)
+            conn.commit()
+        finally:
+            conn.close()
+        return waited
+
+    schedule = []
+    for op, rate in rates.items():
+        if rate > 0:
+            t = rng.uniform(0, 1 / rate)
+            while t < duration:
+                schedule.append((t, op))
+                t += 1 / rate
+    schedule.sort()
+
+    png = synthetic_face_png(rng, 64)
+    samples = []
+    registered = 0
+    while time.time() < start_at:
+        time.sleep(0.001)
+
+    for at, op in schedule:
+        delay = start_at + at - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+        error = None
+        waited = None
+        start = time.perf_counter()
+        try:
+            if op == "scan":
+                face = np.array([[rng.integers(len(embeddings))]])
+                name, id_, _, _ = matcher.match(face)
+                samples.append(("match", (time.perf_counter() - start) * 1000, None, None))
+                start = time.perf_counter()
+                op = "write"
+                if id_ != "Unknown":
+                    waited = locked_write(insert_attendance_mark, id_)
+            elif op == "register":
+                emb = rng.standard_normal(embeddings.shape[1]).astype(np.float32) * 4
+                registration_gallery.nearest(emb)
+                sid = f"K{kiosk:02d}-{registered:05d}"
+                waited = locked_write(insert_student, sid, "Load Test", png, emb)
+                registration_gallery.add(sid, "Load Test", emb)
+                registered += 1
+            else:
+                load_all_students_faces()
+        except sqlite3.OperationalError as e:
+            error = str(e)
+        samples.append((op, (time.perf_counter() - start) * 1000, waited, error))
+
+    return kiosk, samples
+
+
+def bench_kiosks_command(argv):
+    global DB
+
+    parser = argparse.ArgumentParser(
+        prog="neuraface.py bench-kiosks",
+        description="Simulate N kiosk processes sharing one database and report throughput, "
+                    "tail latency and lock waits as N grows."
+    )
+    parser.add_argument("--kiosks", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per run")
+    parser.add_argument("--students", type=int, default=2000)
+    parser.add_argument("--scan-rate", type=float, default=5.0, help="scans per second per kiosk")
+    parser.add_argument("--register-rate", type=float, default=0.2, help="registrations per second per kiosk")
+    parser.add_argument("--reload-rate", type=float, default=0.1, help="gallery reloads per second per kiosk")
+    parser.add_argument("--db", default="bench_kiosks.db")
+    args = parser.parse_args(argv)
+
+    rates = {"scan": args.scan_rate, "register": args.register_rate, "reload": args.reload_rate}
+    gallery, rng = synthetic_gallery(args.students)
+    png = synthetic_face_png(rng, 64)
+    ctx = multiprocessing.get_context("spawn")
+
+    print(f"{args.students} students, {args.duration:.0f} s per run; per kiosk: {args.scan_rate:g} scans/s, "
+          f"{args.register_rate:g} registrations/s, {args.reload_rate:g} gallery reloads/s")
+    print(f"{'kiosks':>6}{'ops/s':>8}{'offered':>9}  {'op':<9}{'p50 ms':>8}{'p95 ms':>8}{'p99 ms':>9}"
+          f"{'max ms':>9}{'wait ms':>9}{'errors':>7}")
+
+    for n in args.kiosks:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.db + suffix):
+                os.remove(args.db + suffix)
+        DB = args.db
+        init_db()
+        conn = sqlite3.connect(DB)
+        cur = conn.cursor()
+        for i, emb in enumerate(gallery):
+            insert_student(cur, f"S{i:06d}", f"Student {i}", png, emb)
+        conn.commit()
+        conn.close()
+
+        start_at = time.time() + 3.0  # every worker imports and loads the gallery first
+        tasks = [(k, args.db, start_at, args.duration, rates, k) for k in range(n)]
+        with ctx.Pool(n) as pool:
+            results = pool.map(kiosk_load_worker, tasks)
+
+        samples = [sample for _, kiosk_samples in results for sample in kiosk_samples]
+        ops = sum(1 for op, _, _, _ in samples if op != "match")
+        offered = n * sum(rates.values())
+        first = True
+        for op in ("match", "write", "register", "reload"):
+            latencies = np.array([ms for o, ms, _, _ in samples if o == op])
+            if not len(latencies):
+                continue
+            errors = sum(1 for o, _, _, error in samples if o == op and error)
+            p50 = np.percentile(latencies, 50)
+            waits = [waited for o, _, waited, _ in samples if o == op and waited is not None]
+            wait = np.mean(waits) if waits else 0.0
+            lead = f"{n:>6}{ops / args.duration:>8.1f}{offered:>9.1f}" if first else " " * 23
+            print(f"{lead}  {op:<9}{p50:>8.1f}{np.percentile(latencies, 95):>8.1f}"
+                  f"{np.percentile(latencies, 99):>9.1f}{latencies.max():>9.1f}{wait:>9.1f}{errors:>7}")
+            first = False
+
+    print("wait ms: mean time a write spent in BEGIN IMMEDIATE waiting for the database write lock")
+    return 0
+
+
+def table_mib(table):
+    conn = sqlite3.connect(DB)
+    try:
+        size = conn.execute("SELECT SUM(pgsize) FROM dbstat WHERE name = ?", (table,)).fetchone()[0]
+    except sqlite3.OperationalError:
+        size = None
+    conn.close()
+    return float("nan") if size is None else size / 2**20
+
+
+def bench_images_command(argv):
+    global DB, KEEP_ORIGINAL_IMAGES
+
+    parser = argparse.ArgumentParser(
+        prog="neuraface.py bench-images",
+        description="DB size and gallery-load time before and after moving images out of students."
+    )
+    parser.add_argument("--students", type=int, default=2000)
+    parser.add_argument("--db", default="bench_images.db")
+    parser.add_argument("--drop-originals", action="store_true")
+    args = parser.parse_args(argv)
+
+    KEEP_ORIGINAL_IMAGES = not args.drop_originals
+    if os.path.exists(args.db):
+        os.remove(args.db)
+    DB = args.db
+
+    rng = np.random.default_rng(0)
+    conn = sqlite3.connect(DB)
+    conn.execute("""
+        CREATE TABLE students (
+            student_id TEXT PRIMARY KEY,
+            student_name TEXT NOT NULL,
+            image BLOB NOT NULL,
+            embedding BLOB NOT NULL
+        );
+    """)
+    conn.executemany(
+        "INSERT INTO students (student_id, student_name, image, embedding) VALUES (?, ?, ?, ?)",
+        ((f"S{i:06d}", f"Student {i}", synthetic_face_png(rng),
+          rng.standard_normal(512).astype(np.float32).tobytes()) for i in range(args.students))
+    )
+    conn.commit()
+    conn.close()
+
+    before_size = os.path.getsize(DB)
+    before_table = table_mib("students")
+    before_ms = timed(load_all_students_faces)
+
+    start = time.perf_counter()
+    init_db()
+    conn = sqlite3.connect(DB)
+    conn.execute("VACUUM")
+    conn.close()
+    migrate_s = time.perf_counter() - start
+
+    after_size = os.path.getsize(DB)
+    after_table = table_mib("students")
+    after_ms = timed(load_all_students_faces)
+
+    print(f"{args.students} students, migration + VACUUM in {migrate_s:.1f} s "
+          f"(thumbnails {THUMB_FORMAT} {THUMB_SIZE}px, originals {'kept' if KEEP_ORIGINAL_IMAGES else 'dropped'})")
+    print(f"{'':<14}{'DB MiB':>10}{'students MiB':>15}{'gallery load ms':>18}")
+    print(f"{'inline PNG':<14}{before_size / 2**20:>10.1f}{before_table:>15.1f}{before_ms:>18.1f}")
+    print(f"{'image store':<14}{after_size / 2**20:>10.1f}{after_table:>15.1f}{after_ms:>18.1f}")
+    return 0
+
+
+COMMANDS = {
+    "cascade-eval": cascade_eval_command,
+    "compact-db": compact_db_command,
+    "archive": archive_command,
+    "bulk-import": bulk_import_command,
+    "reembed": reembed_command,
+    "gallery-report": gallery_report_command,
+    "bench-shards": bench_shards_command,
+    "bench-tiles": bench_tiles_command,
+    "replay": replay_command,
+    "sync": sync_command,
+    "export": export_command,
+    "outbox": outbox_command,
+    "journal": journal_command,
+    "profile-compare": profile_compare_command,
+    "bench-kiosks": bench_kiosks_command,
+    "bench-images": bench_images_command,
+    "bench-reports": bench_reports_command,
+    "bench-quant": bench_quant_command,
+    "roster": roster_command,
+}
+
+
 if __name__ == "__main__":
+    # Here rather than at import: spawned pool workers import this module too,
+    # and must neither migrate the database nor load a gallery of their own.
+    init_db()
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        sys.exit(COMMANDS[sys.argv[1]](sys.argv[2:]))
+
     app = QApplication(sys.argv)
 
+    try:
+        load_gallery()
+    except ValueError:
+        print("No data in database")
+    else:
+        stale = count_stale_embeddings()
+        if stale:
+            print(f"{stale} embeddings were made by an older model; run 'python neuraface.py reembed'")
+
+    if JOURNAL_PATH:
+        recognition_journal = RecognitionJournal(JOURNAL_PATH)
+
+    if MEMORY_CHECK_S:
+        memory_monitor = MemoryMonitor()
+        memory_monitor.start()
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, lambda *_: memory_monitor.request_snapshot())
+
+    if hasattr(signal, "SIGUSR2"):
+        signal.signal(signal.SIGUSR2, lambda *_: start_profile())
+
+    sync_worker = None
+    if SYNC_CENTRAL:
+        sync_worker = SyncWorker(SqliteCentralStore(SYNC_CENTRAL))
+        sync_worker.start()
+
+    if OUTBOX_SINK:
+        outbox_publisher = OutboxPublisher(open_outbox_sink(OUTBOX_SINK))
+        outbox_publisher.start()
+
     w = NeuraFaceHome()
     w.showMaximized()
 
-    sys.exit(app.exec())
\ No newline at end of file
+    status = app.exec()
+    if sync_worker is not None:
+        sync_worker.stop()
+    if outbox_publisher is not None:
+        outbox_publisher.stop()
+        print(outbox_publisher.report())
+    camera_service.close_all()
+    if recognition_journal is not None:
+        recognition_journal.close()
+        print(recognition_journal.report())
+    if memory_monitor is not None:
+        memory_monitor.stop()
+        print(memory_monitor.report())
+    sys.exit(status)
\ No newline at end of file